@@ -7,7 +7,6 @@ import time
 from typing import Dict, List
 import datetime
 
-import aiohttp
 import openai
 from azure.core.credentials import AzureKeyCredential, AccessToken
 from azure.ai.formrecognizer.aio import DocumentAnalysisClient
@@ -28,6 +27,7 @@ from quart import (
     request,
     send_file,
     send_from_directory,
+    url_for,
 )
 from quart_schema import Contact, Info, QuartSchema, HttpSecurityScheme
 from quart.views import MethodView
@@ -41,7 +41,16 @@ from approaches.standardchat import StandardChatApproach
 from utils import (
     require_auth,
     catch_and_return_http_code,
+    current_user_id,
 )
+from customerrors import NotFoundError
+from core.jwks import JWKSKeyStore
+from core.tokencache import VerifiedTokenCache
+from core.httppool import HTTPSessionPool
+from core.tokencounter import token_counter
+from core.answercache import InMemoryAnswerCache
+from core.querycache import QueryRewriteCache
+from core.cpuexecutor import CPUExecutor
 
 from chat import chatBP
 
@@ -52,7 +61,14 @@ from services.IndexService import (
 
 from services.CategoryService import (
     CategoryService,
+    JOB_POST_CATEGORY,
+    JOB_PUT_CATEGORY,
 )
+from services.IngestionJobService import IngestionJob, IngestionJobService
+from services.PromptService import PromptService
+from services.UsecaseDefinitionService import UsecaseDefinitionCache
+from services.EmbeddingService import DocumentEmbeddingService, EmbeddingService
+from services.ChatHistoryWriter import ChatHistoryWriter
 
 from models.Models import TemperatureModel, ModelModel
 
@@ -93,6 +109,19 @@ AZURE_FORMRECOGNIZER_SERVICE = os.getenv(
 )
 AZURE_FORMRECOGNIZER_KEY = os.getenv("AZURE_FORMRECOGNIZER_KEY", "")
 
+# Auth
+# TODO: Replace AZURE_TENANT_ID_AUTH with AZURE_TENANT_ID if AAD in Sandbox is set up
+AZURE_TENANT_ID_AUTH = os.getenv("AZURE_TENANT_ID_AUTH")
+# Point this to a local stand-in JWKS server to run without access to login.microsoftonline.com
+AZURE_AUTH_JWKS_URI = os.getenv(
+    "AZURE_AUTH_JWKS_URI",
+    f"https://login.microsoftonline.com/{AZURE_TENANT_ID_AUTH}/discovery/v2.0/keys",
+)
+AZURE_AUTH_JWKS_TTL = int(os.getenv("AZURE_AUTH_JWKS_TTL", JWKSKeyStore.DEFAULT_TTL))
+AZURE_AUTH_TOKEN_CACHE_SIZE = int(
+    os.getenv("AZURE_AUTH_TOKEN_CACHE_SIZE", VerifiedTokenCache.DEFAULT_MAXSIZE)
+)
+
 
 KB_FIELDS_CONTENT = os.getenv("KB_FIELDS_CONTENT", "content")
 KB_FIELDS_CATEGORY = os.getenv("KB_FIELDS_CATEGORY", "category")
@@ -108,14 +137,103 @@ CONFIG_FORMRECOGNIZER_CLIENT = "fr_client"
 CONFIG_SEARCH_CLIENT = "search_client"
 CONFIG_TEMPERATURE = "temperature_list"
 CONFIG_MODEL = "model_list"
+CONFIG_JWKS_KEYSTORE = "jwks_keystore"
+CONFIG_TOKEN_CACHE = "token_cache"
+CONFIG_OPENAI_SESSION_POOL = "openai_session_pool"
+CONFIG_PROMPT_SERVICE = "prompt_service"
+CONFIG_USECASE_DEFINITION_CACHE = "usecase_definition_cache"
+CONFIG_ANSWER_CACHE = "answer_cache"
+CONFIG_QUERY_REWRITE_CACHE = "query_rewrite_cache"
+CONFIG_EMBEDDING_SERVICE = "embedding_service"
+CONFIG_DOCUMENT_EMBEDDING_SERVICE = "document_embedding_service"
+CONFIG_INGESTION_JOB_SERVICE = "ingestion_job_service"
+CONFIG_CPU_EXECUTOR = "cpu_executor"
+CONFIG_CHAT_HISTORY_WRITER = "chat_history_writer"
 
 COSMOSDB_DATABASE_DEMO = "Demo"
 COSMOSDB_CONTAINER_USECASEDEFINITION = "UseCaseDefinition"
+USECASE_DEFINITION_TTL = int(
+    os.getenv("USECASE_DEFINITION_TTL", UsecaseDefinitionCache.DEFAULT_TTL)
+)
 
 COSMOSDB_DATABASE_KEYDATA = "KeyData"
 COSMOSDB_CONTAINER_TEMPERATURE = "Temperature"
 COSMOSDB_CONTAINER_MODEL = "Model"
 COSMOSDB_CONTAINER_PROMPT = "Prompts"
+PROMPTS_TTL = int(os.getenv("PROMPTS_TTL", PromptService.DEFAULT_TTL))
+# opt-in: every worker process caches answers on its own. After a category changes, the other workers serve its
+# previous answers until their usecase definition cache reloads it, for up to USECASE_DEFINITION_TTL seconds
+# (60 by default)
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() == "true"
+ANSWER_CACHE_SIZE = int(
+    os.getenv("ANSWER_CACHE_SIZE", InMemoryAnswerCache.DEFAULT_MAXSIZE)
+)
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", InMemoryAnswerCache.DEFAULT_TTL))
+# minimum cosine similarity of near-duplicate questions, unset disables the similarity lookup
+ANSWER_CACHE_SIMILARITY_THRESHOLD = os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD")
+QUERY_REWRITE_CACHE_SIZE = int(
+    os.getenv("QUERY_REWRITE_CACHE_SIZE", QueryRewriteCache.DEFAULT_MAXSIZE)
+)
+QUERY_REWRITE_CACHE_TTL = int(
+    os.getenv("QUERY_REWRITE_CACHE_TTL", QueryRewriteCache.DEFAULT_TTL)
+)
+QUERY_REWRITE_HISTORY_TURNS = int(
+    os.getenv("QUERY_REWRITE_HISTORY_TURNS", QueryRewriteCache.DEFAULT_HISTORY_TURNS)
+)
+EMBEDDING_CACHE_SIZE = int(
+    os.getenv("EMBEDDING_CACHE_SIZE", EmbeddingService.DEFAULT_MAXSIZE)
+)
+EMBEDDING_BATCH_WINDOW = float(
+    os.getenv("EMBEDDING_BATCH_WINDOW", EmbeddingService.DEFAULT_BATCH_WINDOW)
+)
+# file the embedding cache is persisted to between restarts, unset keeps it in memory only
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH")
+INGESTION_EMBEDDING_BATCH_SIZE = int(
+    os.getenv(
+        "INGESTION_EMBEDDING_BATCH_SIZE", DocumentEmbeddingService.DEFAULT_BATCH_SIZE
+    )
+)
+INGESTION_EMBEDDING_CONCURRENCY = int(
+    os.getenv(
+        "INGESTION_EMBEDDING_CONCURRENCY", DocumentEmbeddingService.DEFAULT_CONCURRENCY
+    )
+)
+# directory of the ingestion job queue and the uploaded files of queued jobs, must survive restarts and be shared by
+# all workers. The default is below $HOME, which is /home on App Service: the persistent storage shared by all
+# instances (Azure Files), where SQLite needs the DELETE journal, as WAL does not work on network file systems.
+INGESTION_JOB_DIR = os.getenv(
+    "INGESTION_JOB_DIR", os.path.join(os.getenv("HOME", "/home"), "ingestion-jobs")
+)
+INGESTION_JOB_JOURNAL_MODE = os.getenv("INGESTION_JOB_JOURNAL_MODE", "DELETE")
+# seconds a stopping worker waits for its running jobs, keep below the graceful timeout in gunicorn.conf.py
+INGESTION_JOB_STOP_TIMEOUT = float(
+    os.getenv("INGESTION_JOB_STOP_TIMEOUT", IngestionJobService.DEFAULT_STOP_TIMEOUT)
+)
+INGESTION_JOB_WORKERS = int(
+    os.getenv("INGESTION_JOB_WORKERS", IngestionJobService.DEFAULT_CONCURRENCY)
+)
+# worker processes for pdf splitting and text conversion of uploads, 0 runs them in threads instead. Every gunicorn
+# worker starts its own pool, so a deployment runs GUNICORN_WORKERS (2 * cpus + 1 by default) times this many extra
+# processes, each importing the dependencies of the app. The default shares the cpus among the gunicorn workers,
+# which is a single process per worker unless GUNICORN_WORKERS is set lower than the number of cpus.
+CPU_EXECUTOR_WORKERS = int(
+    os.getenv(
+        "CPU_EXECUTOR_WORKERS",
+        max(
+            CPUExecutor.DEFAULT_MAX_WORKERS,
+            (os.cpu_count() or 1)
+            // int(os.getenv("GUNICORN_WORKERS", (os.cpu_count() or 1) * 2 + 1)),
+        ),
+    )
+)
+# chat turns that are queued for writing at most, further turns wait for a free place
+CHAT_HISTORY_MAX_PENDING = int(
+    os.getenv("CHAT_HISTORY_MAX_PENDING", ChatHistoryWriter.DEFAULT_MAX_PENDING)
+)
+# use first-turn questions as search query without asking GPT to rewrite them
+QUERY_REWRITE_SKIP_SINGLE_TURN = (
+    os.getenv("QUERY_REWRITE_SKIP_SINGLE_TURN", "false").lower() == "true"
+)
 
 
 APPLICATIONINSIGHTS_CONNECTION_STRING = os.getenv(
@@ -224,6 +342,24 @@ class IndexView(MethodView):
 """
 
 
+def job_response(job: IngestionJob) -> Dict:
+    return {
+        **job.to_response(),
+        "status_url": url_for("routes.ingestion_job", job_id=job.id),
+    }
+
+
+@bp.route("/api/ingestion/jobs/<job_id>", methods=["GET"])
+@catch_and_return_http_code
+@require_auth
+async def ingestion_job(job_id):
+    """Returns the status, the progress of each stage and the result of a category upload"""
+    job = await current_app.config[CONFIG_INGESTION_JOB_SERVICE].get(job_id)
+    if job is None or job.owner != current_user_id():
+        raise NotFoundError(f"Could not find ingestion job with id: {job_id}", 404)
+    return jsonify(job_response(job)), 200
+
+
 class CategoryView(MethodView):
     @catch_and_return_http_code
     @require_auth
@@ -236,50 +372,38 @@ class CategoryView(MethodView):
     @catch_and_return_http_code
     @require_auth
     async def post(self, usecasetype_id, index_id):
-        current_index_idx, _ = await IndexService().get_current_index_and_idx(
-            id=index_id, usecasetype_id=usecasetype_id
-        )
         model = await ModelProvider().from_request(
             request=request, schema=SupportedModelTypes.Category
         )
-        category_service = CategoryService()
-        categories = await category_service.post(
+        job = await CategoryService().submit(
+            kind=JOB_POST_CATEGORY,
             category=model,
             usecasetype_id=usecasetype_id,
             index_id=index_id,
-            index_idx=current_index_idx,
+            owner=current_user_id(),
         )
-        return jsonify(categories), 201
+        return jsonify(job_response(job)), 202
 
     @catch_and_return_http_code
     @require_auth
     async def put(self, usecasetype_id, index_id):
-        current_index_idx, _ = await IndexService().get_current_index_and_idx(
-            id=index_id, usecasetype_id=usecasetype_id
-        )
         model = await ModelProvider().from_request(
             request=request, schema=SupportedModelTypes.Category
         )
-        category_service = CategoryService()
-        categories = await category_service.put(
+        job = await CategoryService().submit(
+            kind=JOB_PUT_CATEGORY,
             category=model,
             usecasetype_id=usecasetype_id,
             index_id=index_id,
-            index_idx=current_index_idx,
+            owner=current_user_id(),
         )
-        return jsonify(categories), 201
+        return jsonify(job_response(job)), 202
 
     @catch_and_return_http_code
     @require_auth
     async def delete(self, usecasetype_id, index_id, category_id):
-        (
-            current_index_idx,
-            current_index,
-        ) = await IndexService().get_current_index_and_idx(
-            id=index_id, usecasetype_id=usecasetype_id
-        )
         categories = await CategoryService().delete(
-            category_id, usecasetype_id=usecasetype_id, index_idx=current_index_idx
+            category_id, usecasetype_id=usecasetype_id, index_id=index_id
         )
         return jsonify(categories), 200
 
@@ -323,18 +447,48 @@ async def ask():
         impl = current_app.config[CONFIG_ASK_APPROACHES].get(approach)
         if not impl:
             return jsonify({"error": "unknown approach"}), 400
-        # Workaround for: https://github.com/openai/openai-python/issues/371
-        async with aiohttp.ClientSession() as s:
-            openai.aiosession.set(s)
-            r = await impl.run(
-                request_json["question"], request_json.get("overrides") or {}
-            )
+        r = await impl.run(
+            request_json["question"], request_json.get("overrides") or {}
+        )
         return jsonify(r)
     except Exception as e:
         logging.exception("Exception in /ask")
         return jsonify({"error": str(e)}), 500
 
 
+@bp.route("/api/metrics", methods=["GET"])
+@catch_and_return_http_code
+@require_auth
+async def metrics():
+    """Returns the counters of the in-process caches and pools of this worker"""
+    resp = {
+        "jwks_keystore": current_app.config[CONFIG_JWKS_KEYSTORE].metrics(),
+        "token_cache": current_app.config[CONFIG_TOKEN_CACHE].metrics(),
+        "openai_session_pool": current_app.config[
+            CONFIG_OPENAI_SESSION_POOL
+        ].metrics(),
+        "prompt_service": current_app.config[CONFIG_PROMPT_SERVICE].metrics(),
+        "usecase_definition_cache": current_app.config[
+            CONFIG_USECASE_DEFINITION_CACHE
+        ].metrics(),
+        "token_counter": token_counter.metrics(),
+        "answer_cache": current_app.config[CONFIG_ANSWER_CACHE].metrics()
+        if current_app.config[CONFIG_ANSWER_CACHE] is not None
+        else None,
+        "query_rewrite_cache": current_app.config[CONFIG_QUERY_REWRITE_CACHE].metrics(),
+        "embedding_service": current_app.config[CONFIG_EMBEDDING_SERVICE].metrics(),
+        "document_embedding_service": current_app.config[
+            CONFIG_DOCUMENT_EMBEDDING_SERVICE
+        ].metrics(),
+        "ingestion_jobs": current_app.config[CONFIG_INGESTION_JOB_SERVICE].metrics(),
+        "cpu_executor": current_app.config[CONFIG_CPU_EXECUTOR].metrics(),
+        "chat_history_writer": current_app.config[
+            CONFIG_CHAT_HISTORY_WRITER
+        ].metrics(),
+    }
+    return jsonify(resp), 200
+
+
 @bp.after_request
 async def set_headers(response: Response):
     if request.method in ["POST", "DELETE"]:
@@ -370,6 +524,13 @@ async def ensure_openai_token():
         openai.api_key = openai_token.token
 
 
+@bp.before_request
+async def use_openai_session_pool():
+    # Workaround for: https://github.com/openai/openai-python/issues/371
+    # openai.aiosession is a ContextVar, so it has to be set for every request
+    openai.aiosession.set(current_app.config[CONFIG_OPENAI_SESSION_POOL].session)
+
+
 @bp.before_app_serving
 async def setup_clients():
     current_app.config["AZURE_SEARCH_INDEX"] = "gptkbindex-woe"
@@ -433,6 +594,48 @@ async def setup_clients():
     current_app.config[CONFIG_CREDENTIAL] = azure_credential
     current_app.config[CONFIG_BLOB_CLIENT] = blob_client
     current_app.config[CONFIG_COSMOSDB_CLIENT] = cosmosdb_client
+    current_app.config[CONFIG_JWKS_KEYSTORE] = JWKSKeyStore(
+        jwks_uri=AZURE_AUTH_JWKS_URI, ttl=AZURE_AUTH_JWKS_TTL
+    )
+    current_app.config[CONFIG_TOKEN_CACHE] = VerifiedTokenCache(
+        maxsize=AZURE_AUTH_TOKEN_CACHE_SIZE
+    )
+    openai_session_pool = HTTPSessionPool.from_env("OPENAI_HTTP_POOL")
+    await openai_session_pool.open()
+    current_app.config[CONFIG_OPENAI_SESSION_POOL] = openai_session_pool
+    answer_cache = (
+        InMemoryAnswerCache(
+            maxsize=ANSWER_CACHE_SIZE,
+            ttl=ANSWER_CACHE_TTL,
+            similarity_threshold=float(ANSWER_CACHE_SIMILARITY_THRESHOLD)
+            if ANSWER_CACHE_SIMILARITY_THRESHOLD
+            else None,
+        )
+        if ANSWER_CACHE_ENABLED
+        else None
+    )
+    current_app.config[CONFIG_ANSWER_CACHE] = answer_cache
+    query_rewrite_cache = QueryRewriteCache(
+        maxsize=QUERY_REWRITE_CACHE_SIZE,
+        ttl=QUERY_REWRITE_CACHE_TTL,
+        history_turns=QUERY_REWRITE_HISTORY_TURNS,
+        skip_single_turn=QUERY_REWRITE_SKIP_SINGLE_TURN,
+    )
+    current_app.config[CONFIG_QUERY_REWRITE_CACHE] = query_rewrite_cache
+    embedding_service = EmbeddingService(
+        AZURE_OPENAI_EMB_DEPLOYMENT,
+        maxsize=EMBEDDING_CACHE_SIZE,
+        batch_window=EMBEDDING_BATCH_WINDOW,
+        persist_path=EMBEDDING_CACHE_PATH,
+    )
+    await embedding_service.start()
+    current_app.config[CONFIG_EMBEDDING_SERVICE] = embedding_service
+    current_app.config[CONFIG_DOCUMENT_EMBEDDING_SERVICE] = DocumentEmbeddingService(
+        AZURE_OPENAI_EMB_DEPLOYMENT,
+        model=AZURE_OPENAI_EMB_MODEL,
+        batch_size=INGESTION_EMBEDDING_BATCH_SIZE,
+        concurrency=INGESTION_EMBEDDING_CONCURRENCY,
+    )
     # Various approaches to integrate GPT and external knowledge, most applications will use a single one of these patterns
     # or some derivative, here we include several for exploration purposes
     current_app.config[CONFIG_ASK_APPROACHES] = {
@@ -443,6 +646,7 @@ async def setup_clients():
             AZURE_OPENAI_EMB_DEPLOYMENT,
             KB_FIELDS_SOURCEPAGE,
             KB_FIELDS_CONTENT,
+            embedding_service=embedding_service,
         ),
         "rrr": ReadRetrieveReadApproach(
             search_client,
@@ -450,6 +654,7 @@ async def setup_clients():
             AZURE_OPENAI_EMB_DEPLOYMENT,
             KB_FIELDS_SOURCEPAGE,
             KB_FIELDS_CONTENT,
+            embedding_service=embedding_service,
         ),
         "rda": ReadDecomposeAsk(
             search_client,
@@ -457,6 +662,7 @@ async def setup_clients():
             AZURE_OPENAI_EMB_DEPLOYMENT,
             KB_FIELDS_SOURCEPAGE,
             KB_FIELDS_CONTENT,
+            embedding_service=embedding_service,
         ),
     }
     current_app.config[CONFIG_CHAT_APPROACHES] = {
@@ -467,6 +673,9 @@ async def setup_clients():
             AZURE_OPENAI_EMB_DEPLOYMENT,
             KB_FIELDS_SOURCEPAGE,
             KB_FIELDS_CONTENT,
+            answer_cache=answer_cache,
+            query_rewrite_cache=query_rewrite_cache,
+            embedding_service=embedding_service,
         ),
         "sc": StandardChatApproach(
             AZURE_OPENAI_CHATGPT_DEPLOYMENT, AZURE_OPENAI_CHATGPT_MODEL
@@ -494,9 +703,51 @@ async def setup_clients():
     models = [ModelModel(**model).retrieve_props_for_post() for model in models_]
     current_app.config[CONFIG_MODEL] = models
 
+    prompt_service = PromptService(ttl=PROMPTS_TTL)
+    await prompt_service.start()
+    current_app.config[CONFIG_PROMPT_SERVICE] = prompt_service
+
+    current_app.config[CONFIG_USECASE_DEFINITION_CACHE] = UsecaseDefinitionCache(
+        ttl=USECASE_DEFINITION_TTL
+    )
+
+    cpu_executor = CPUExecutor(max_workers=CPU_EXECUTOR_WORKERS)
+    cpu_executor.start()
+    current_app.config[CONFIG_CPU_EXECUTOR] = cpu_executor
+
+    # chat turns are stored after the answer is sent
+    chat_history_writer = ChatHistoryWriter(max_pending=CHAT_HISTORY_MAX_PENDING)
+    await chat_history_writer.start(current_app._get_current_object())
+    current_app.config[CONFIG_CHAT_HISTORY_WRITER] = chat_history_writer
+
+    # category uploads run in the background, jobs interrupted by the last shutdown are picked up again
+    ingestion_job_service = IngestionJobService(
+        INGESTION_JOB_DIR,
+        concurrency=INGESTION_JOB_WORKERS,
+        stop_timeout=INGESTION_JOB_STOP_TIMEOUT,
+        journal_mode=INGESTION_JOB_JOURNAL_MODE,
+        before_job=lambda: openai.aiosession.set(openai_session_pool.session),
+    )
+    for kind in (JOB_POST_CATEGORY, JOB_PUT_CATEGORY):
+        ingestion_job_service.register(
+            kind,
+            lambda payload, attachments, progress, kind=kind: CategoryService.run_job(
+                kind, payload, attachments, progress
+            ),
+        )
+    await ingestion_job_service.start(current_app._get_current_object())
+    current_app.config[CONFIG_INGESTION_JOB_SERVICE] = ingestion_job_service
+
 
 @bp.after_app_serving
 async def teardown_client():
+    await current_app.config[CONFIG_INGESTION_JOB_SERVICE].stop()
+    await current_app.config[CONFIG_CPU_EXECUTOR].stop()
+    await current_app.config[CONFIG_PROMPT_SERVICE].stop()
+    await current_app.config[CONFIG_EMBEDDING_SERVICE].stop()
+    # writes the queued chat turns, so before the cosmos db client is closed
+    await current_app.config[CONFIG_CHAT_HISTORY_WRITER].stop()
+    await current_app.config[CONFIG_OPENAI_SESSION_POOL].close()
     await current_app.config[CONFIG_COSMOSDB_CLIENT].close()
 
 
@@ -1,15 +1,32 @@
-from typing import Any, List, Union
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, Dict, List, Optional, Union
 
 import openai
 from azure.search.documents.aio import SearchClient
 from azure.search.documents.models import QueryType
 
 from approaches.approach import ChatApproach
+from core.answercache import AbstractAnswerCache, AnswerCacheKey
 from core.messagebuilder import MessageBuilder
 from core.modelhelper import get_token_limit
+from core.querycache import QueryRewriteCache
+from services.EmbeddingService import EmbeddingService
 from text import nonewlines
 
 
+@dataclass
+class PreparedChat:
+    messages: list
+    data_points: List[str]
+    thoughts: str
+    # set if the answer was served from the answer cache
+    answer: Optional[str] = None
+    cache_key: Optional[AnswerCacheKey] = None
+    query_vector: Optional[List[float]] = None
+
+
 class ChatReadRetrieveReadApproach(ChatApproach):
     # Chat roles
     SYSTEM = "system"
@@ -57,14 +74,22 @@ If you cannot generate a search query, return just the number 0.
         embedding_deployment: str,
         sourcepage_field: str,
         content_field: str,
+        answer_cache: AbstractAnswerCache | None = None,
+        query_rewrite_cache: QueryRewriteCache | None = None,
+        embedding_service: EmbeddingService | None = None,
     ):
         self.search_client = search_client
         self.chatgpt_deployment = chatgpt_deployment
         self.chatgpt_model = chatgpt_model
         self.embedding_deployment = embedding_deployment
+        self.embedding_service = embedding_service or EmbeddingService(
+            embedding_deployment
+        )
         self.sourcepage_field = sourcepage_field
         self.content_field = content_field
         self.chatgpt_token_limit = get_token_limit(chatgpt_model)
+        self.answer_cache = answer_cache
+        self.query_rewrite_cache = query_rewrite_cache
 
     async def run(
         self,
@@ -76,7 +101,135 @@ If you cannot generate a search query, return just the number 0.
         query_prompt_template: str | None = None,
         query_fewshots: List[str] | None = None,
         follow_up_question: str | None = None,
+        prompt_version: str | None = None,
+        category_version: str | None = None,
     ) -> Any:
+        prepared = await self.prepare(
+            history=history,
+            overrides=overrides,
+            category_id=category_id,
+            system_prompt=system_prompt,
+            category_system_prompt=category_system_prompt,
+            query_prompt_template=query_prompt_template,
+            query_fewshots=query_fewshots,
+            follow_up_question=follow_up_question,
+            prompt_version=prompt_version,
+            category_version=category_version,
+        )
+
+        if prepared.answer is None:
+            chat_completion = await openai.ChatCompletion.acreate(
+                **self.completion_args(prepared.messages, overrides)
+            )
+            prepared.answer = chat_completion.choices[0].message.content
+            await self.cache_answer(prepared)
+
+        return {
+            "data_points": prepared.data_points,
+            "answer": prepared.answer,
+            "thoughts": prepared.thoughts,
+        }
+
+    async def run_stream(
+        self,
+        history: list[dict[str, str]],
+        overrides: dict[str, Any],
+        category_id: str,
+        system_prompt: str | None = None,
+        category_system_prompt: str | None = None,
+        query_prompt_template: str | None = None,
+        query_fewshots: List[str] | None = None,
+        follow_up_question: str | None = None,
+        prompt_version: str | None = None,
+        category_version: str | None = None,
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """Streaming variant of run.
+
+        Yields a leading frame with the data points and thoughts as soon as the retrieval is done, followed by one
+        frame per chunk of the answer as it is generated. A cached answer is sent as a single chunk.
+
+        Yields:
+            Dict[str, Any]: {"data_points": [...], "thoughts": "..."} first, then {"answer": "<chunk>"}
+        """
+        prepared = await self.prepare(
+            history=history,
+            overrides=overrides,
+            category_id=category_id,
+            system_prompt=system_prompt,
+            category_system_prompt=category_system_prompt,
+            query_prompt_template=query_prompt_template,
+            query_fewshots=query_fewshots,
+            follow_up_question=follow_up_question,
+            prompt_version=prompt_version,
+            category_version=category_version,
+        )
+        yield {"data_points": prepared.data_points, "thoughts": prepared.thoughts}
+
+        if prepared.answer is not None:
+            yield {"answer": prepared.answer}
+            return
+
+        chat_completion = await openai.ChatCompletion.acreate(
+            **self.completion_args(prepared.messages, overrides), stream=True
+        )
+        answer: List[str] = []
+        async for chunk in chat_completion:
+            # azure sends a leading chunk without choices (prompt filter results)
+            if not chunk.choices:
+                continue
+            if content := chunk.choices[0].delta.get("content"):
+                answer.append(content)
+                yield {"answer": content}
+        prepared.answer = "".join(answer)
+        await self.cache_answer(prepared)
+
+    def completion_args(
+        self, messages: list, overrides: dict[str, Any]
+    ) -> Dict[str, Any]:
+        return {
+            "deployment_id": self.chatgpt_deployment,
+            "model": self.chatgpt_model,
+            "messages": messages,
+            "temperature": overrides.get("temperature") or 0.7,
+            "max_tokens": 1024,
+            "n": 1,
+        }
+
+    async def cache_answer(self, prepared: PreparedChat) -> None:
+        if self.answer_cache is None or prepared.cache_key is None:
+            return
+        await self.answer_cache.set(
+            prepared.cache_key,
+            {
+                "data_points": prepared.data_points,
+                "answer": prepared.answer,
+            },
+            embedding=prepared.query_vector,
+        )
+
+    async def prepare(
+        self,
+        history: list[dict[str, str]],
+        overrides: dict[str, Any],
+        category_id: str,
+        system_prompt: str | None = None,
+        category_system_prompt: str | None = None,
+        query_prompt_template: str | None = None,
+        query_fewshots: List[str] | None = None,
+        follow_up_question: str | None = None,
+        prompt_version: str | None = None,
+        category_version: str | None = None,
+    ) -> PreparedChat:
+        """Runs everything up to the final completion: query generation, retrieval and prompt construction.
+
+        If an answer cache is configured, it is looked up right after the search query has been generated, under a
+        key that includes `category_version`, a stamp that changes whenever the category does. On a hit,
+        the retrieval is skipped and the cached answer and data points are returned with the prepared chat. The
+        thoughts are never cached, they are built from the messages of the current request.
+
+        Returns:
+            PreparedChat: messages for the final completion, data points and thoughts
+        """
         # this will be the category specific query template
         if query_prompt_template is not None:
             self.query_prompt_template = query_prompt_template
@@ -103,44 +256,52 @@ If you cannot generate a search query, return just the number 0.
             else None
         )
 
-        user_q = "Generate search query for: " + history[-1]["user"]
-
         # STEP 1: Generate an optimized keyword search query based on the chat history and the last question
-        messages = self.get_messages_from_history(
-            self.query_prompt_template,
-            self.chatgpt_model,
-            history,
-            user_q,
-            self.query_prompt_few_shots,
-            self.chatgpt_token_limit - len(user_q),
-        )
-
-        chat_completion = await openai.ChatCompletion.acreate(
-            deployment_id=self.chatgpt_deployment,
-            model=self.chatgpt_model,
-            messages=messages,
-            temperature=0.0,
-            max_tokens=32,
-            n=1,
-        )
-
-        query_text = chat_completion.choices[0].message.content
-        if query_text.strip() == "0":
-            # Use the last user input if we failed to generate a better query
-            query_text = history[-1]["user"]
+        if self.query_rewrite_cache is not None:
+            query_text = await self.query_rewrite_cache.get_or_rewrite(
+                history,
+                prompt_version=prompt_version or self.query_prompt_version(),
+                rewrite=lambda: self.generate_query(history),
+            )
+        else:
+            query_text = await self.generate_query(history)
 
         # STEP 2: Retrieve relevant documents from the search index with the GPT optimized query
 
         # If retrieval mode includes vectors, compute an embedding for the query
         if has_vector:
-            query_vector = (
-                await openai.Embedding.acreate(
-                    engine=self.embedding_deployment, input=query_text
-                )
-            )["data"][0]["embedding"]
+            query_vector = await self.embedding_service.embed(query_text)
         else:
             query_vector = None
 
+        cache_key = None
+        if self.answer_cache is not None:
+            cache_key = AnswerCacheKey.create(
+                category_id=category_id,
+                query=query_text,
+                overrides=overrides,
+                prompt_version=f"{prompt_version}:{category_system_prompt}",
+                previous_turns=history[:-1],
+                category_version=category_version,
+            )
+            cached = await self.answer_cache.get(cache_key, embedding=query_vector)
+            if cached is not None:
+                messages = self.build_messages(
+                    history,
+                    overrides,
+                    "\n".join(cached["data_points"]),
+                    system_prompt,
+                    category_system_prompt,
+                )
+                return PreparedChat(
+                    messages=messages,
+                    data_points=cached["data_points"],
+                    thoughts=self.build_thoughts(
+                        query_text if has_text else None, messages
+                    ),
+                    answer=cached["answer"],
+                )
+
         # Only keep the text query if the retrieval mode uses text, otherwise drop it
         if not has_text:
             query_text = None
@@ -185,14 +346,34 @@ If you cannot generate a search query, return just the number 0.
             ]
         content = "\n".join(results)
 
+        # STEP 3: Generate a contextual and content specific answer using the search results and chat history
+        messages = self.build_messages(
+            history, overrides, content, system_prompt, category_system_prompt
+        )
+        thoughts = self.build_thoughts(query_text, messages)
+        return PreparedChat(
+            messages=messages,
+            data_points=results,
+            thoughts=thoughts,
+            cache_key=cache_key,
+            query_vector=query_vector,
+        )
+
+    def build_messages(
+        self,
+        history: list[dict[str, str]],
+        overrides: dict[str, Any],
+        content: str,
+        system_prompt: str | None = None,
+        category_system_prompt: str | None = None,
+    ) -> list:
+        """Builds the messages of the final completion from the chat history and the retrieved sources"""
         follow_up_questions_prompt = (
             self.follow_up_questions_prompt_content
             if overrides.get("suggestFollowupQuestions")
             else ""
         )
 
-        # STEP 3: Generate a contextual and content specific answer using the search results and chat history
-
         # Allow client to replace the entire prompt, or to inject into the exiting prompt using >>>
         prompt_override = overrides.get("prompt_override")
         if prompt_override is None:
@@ -228,7 +409,7 @@ If you cannot generate a search query, return just the number 0.
             )
         """
 
-        messages = self.get_messages_from_history(
+        return self.get_messages_from_history(
             system_message,
             self.chatgpt_model,
             history,
@@ -237,25 +418,48 @@ If you cannot generate a search query, return just the number 0.
             max_tokens=self.chatgpt_token_limit - 1024,
         )
 
+    @staticmethod
+    def build_thoughts(query_text: str | None, messages: list) -> str:
+        msg_to_display = "\n\n".join([str(message) for message in messages])
+        return (
+            f"Searched for:<br>{query_text}<br><br>Conversations:<br>"
+            + msg_to_display.replace("\n", "<br>")
+        )
+
+    async def generate_query(self, history: list[dict[str, str]]) -> str:
+        """Asks GPT for a search query based on the chat history and the last question"""
+        user_q = "Generate search query for: " + history[-1]["user"]
+
+        messages = self.get_messages_from_history(
+            self.query_prompt_template,
+            self.chatgpt_model,
+            history,
+            user_q,
+            self.query_prompt_few_shots,
+            self.chatgpt_token_limit - len(user_q),
+        )
+
         chat_completion = await openai.ChatCompletion.acreate(
             deployment_id=self.chatgpt_deployment,
             model=self.chatgpt_model,
             messages=messages,
-            temperature=overrides.get("temperature") or 0.7,
-            max_tokens=1024,
+            temperature=0.0,
+            max_tokens=32,
             n=1,
         )
 
-        chat_content = chat_completion.choices[0].message.content
-
-        msg_to_display = "\n\n".join([str(message) for message in messages])
+        query_text = chat_completion.choices[0].message.content
+        if query_text.strip() == "0":
+            # Use the last user input if we failed to generate a better query
+            query_text = history[-1]["user"]
+        return query_text
 
-        return {
-            "data_points": results,
-            "answer": chat_content,
-            "thoughts": f"Searched for:<br>{query_text}<br><br>Conversations:<br>"
-            + msg_to_display.replace("\n", "<br>"),
-        }
+    def query_prompt_version(self) -> str:
+        return hashlib.sha1(
+            json.dumps(
+                [self.query_prompt_template, self.query_prompt_few_shots]
+            ).encode("utf-8")
+        ).hexdigest()[:12]
 
     def get_messages_from_history(
         self,
@@ -270,25 +474,20 @@ If you cannot generate a search query, return just the number 0.
 
         # Add examples to show the chat what responses we want. It will try to mimic any responses and make sure they match the rules laid out in the system message.
         for shot in few_shots:
-            message_builder.append_message(shot.get("role"), shot.get("content"))
-
-        user_content = user_conv
-        append_index = len(few_shots) + 1
+            message_builder.append_leading(shot.get("role"), shot.get("content"))
 
-        message_builder.append_message(self.USER, user_content, index=append_index)
+        message_builder.append_trailing(self.USER, user_conv)
 
+        turns = []
         for h in reversed(history[:-1]):
-            if bot_msg := h.get("bot"):
-                message_builder.append_message(
-                    self.ASSISTANT, bot_msg, index=append_index
-                )
+            turn = []
             if user_msg := h.get("user"):
-                message_builder.append_message(self.USER, user_msg, index=append_index)
-            if message_builder.token_length > max_tokens:
-                break
+                turn.append({"role": self.USER, "content": user_msg})
+            if bot_msg := h.get("bot"):
+                turn.append({"role": self.ASSISTANT, "content": bot_msg})
+            turns.append(turn)
 
-        messages = message_builder.messages
-        return messages
+        return message_builder.build(turns, max_tokens=max_tokens)
 
     def translate_category_to_filter(self, category_id: str):
         return f"category_id eq '{category_id}'"
@@ -13,14 +13,16 @@ from langchain.tools.base import BaseTool
 
 from approaches.approach import AskApproach
 from langchainadapters import HtmlCallbackHandler
+from services.EmbeddingService import EmbeddingService
 from text import nonewlines
 
 
 class ReadDecomposeAsk(AskApproach):
-    def __init__(self, search_client: SearchClient, openai_deployment: str, embedding_deployment: str, sourcepage_field: str, content_field: str):
+    def __init__(self, search_client: SearchClient, openai_deployment: str, embedding_deployment: str, sourcepage_field: str, content_field: str, embedding_service: EmbeddingService | None = None):
         self.search_client = search_client
         self.openai_deployment = openai_deployment
         self.embedding_deployment = embedding_deployment
+        self.embedding_service = embedding_service or EmbeddingService(embedding_deployment)
         self.sourcepage_field = sourcepage_field
         self.content_field = content_field
 
@@ -34,7 +36,7 @@ class ReadDecomposeAsk(AskApproach):
 
         # If retrieval mode includes vectors, compute an embedding for the query
         if has_vector:
-            query_vector = (await openai.Embedding.acreate(engine=self.embedding_deployment, input=query_text))["data"][0]["embedding"]
+            query_vector = await self.embedding_service.embed(query_text)
         else:
             query_vector = None
 
@@ -6,6 +6,7 @@ from azure.search.documents.models import QueryType
 
 from approaches.approach import AskApproach
 from core.messagebuilder import MessageBuilder
+from services.EmbeddingService import EmbeddingService
 from text import nonewlines
 
 
@@ -36,11 +37,12 @@ info4.pdf: In-network institutions include Overlake, Swedish and others in the r
 """
     answer = "In-network deductibles are $500 for employee and $1000 for family [info1.txt] and Overlake is in-network for the employee plan [info2.pdf][info4.pdf]."
 
-    def __init__(self, search_client: SearchClient, openai_deployment: str, chatgpt_model: str, embedding_deployment: str, sourcepage_field: str, content_field: str):
+    def __init__(self, search_client: SearchClient, openai_deployment: str, chatgpt_model: str, embedding_deployment: str, sourcepage_field: str, content_field: str, embedding_service: EmbeddingService | None = None):
         self.search_client = search_client
         self.openai_deployment = openai_deployment
         self.chatgpt_model = chatgpt_model
         self.embedding_deployment = embedding_deployment
+        self.embedding_service = embedding_service or EmbeddingService(embedding_deployment)
         self.sourcepage_field = sourcepage_field
         self.content_field = content_field
 
@@ -54,7 +56,7 @@ info4.pdf: In-network institutions include Overlake, Swedish and others in the r
 
         # If retrieval mode includes vectors, compute an embedding for the query
         if has_vector:
-            query_vector = (await openai.Embedding.acreate(engine=self.embedding_deployment, input=q))["data"][0]["embedding"]
+            query_vector = await self.embedding_service.embed(q)
         else:
             query_vector = None
 
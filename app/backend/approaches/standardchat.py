@@ -1,7 +1,6 @@
 from typing import Any, List
 
-import openai
-from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
+from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach, PreparedChat
 from core.modelhelper import get_token_limit
 
 
@@ -14,16 +13,16 @@ class StandardChatApproach(ChatReadRetrieveReadApproach):
         self.chatgpt_deployment = chatgpt_deployment
         self.chatgpt_model = chatgpt_model
         self.chatgpt_token_limit = get_token_limit(chatgpt_model)
+        self.answer_cache = None
 
-    async def run(
+    async def prepare(
         self,
         history: List[dict[str, str]],
         overrides: dict[str, Any],
         category_system_prompt: str | None = None,
-        follow_up_question: str | None = None,
         *args,
         **kwargs,
-    ) -> Any:
+    ) -> PreparedChat:
         messages = self.get_messages_from_history(
             category_system_prompt or "",
             self.chatgpt_model,
@@ -33,22 +32,8 @@ class StandardChatApproach(ChatReadRetrieveReadApproach):
             max_tokens=self.chatgpt_token_limit - 1024,
         )
 
-        chat_completion = await openai.ChatCompletion.acreate(
-            deployment_id=self.chatgpt_deployment,
-            model=self.chatgpt_model,
+        return PreparedChat(
             messages=messages,
-            temperature=overrides.get("temperature") or 0.7,
-            max_tokens=1024,
-            n=1,
+            data_points=[],
+            thoughts=self.build_thoughts(history[-1]["user"], messages),
         )
-
-        chat_content = chat_completion.choices[0].message.content
-
-        msg_to_display = "\n\n".join([str(message) for message in messages])
-
-        return {
-            "data_points": [],
-            "answer": chat_content,
-            "thoughts": f"Searched for:<br>{history[-1]['user']}<br><br>Conversations:<br>"
-            + msg_to_display.replace("\n", "<br>"),
-        }
@@ -1,4 +1,5 @@
-from typing import List
+import logging
+from typing import Any, AsyncGenerator, Dict, List, Optional
 from pydantic import BaseModel
 from quart import (
     Blueprint,
@@ -6,38 +7,44 @@ from quart import (
     current_app,
     jsonify,
     request,
+    stream_with_context,
 )
-import json
 import os
-import aiohttp
-import openai
 from quart_schema import validate_headers, validate_response
-from services.CosmosDBService import CosmosDBService
 from services.ChatHistoryService import ChatHistoryService, ConversationModel
-from customerrors import InternalServerError
+from services.ChatHistoryWriter import ChatHistoryWriter
+from services.PromptService import PromptService, PromptTypes
+from services.UsecaseDefinitionService import UsecaseDefinitionCache
+from customerrors import (
+    InternalServerError,
+    InvalidQueryParameterError,
+    NotFoundError,
+)
 from utils import (
     require_auth,
     require_json,
     catch_and_return_http_code,
+    current_user_id,
     ExampleQuestionsGenerator,
 )
 
 from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
 from approaches.standardchat import StandardChatApproach
+from core.answercache import category_version
 from dataclasses import dataclass
 
-
 AZURE_OPENAI_CHATGPT_DEPLOYMENT = os.getenv("AZURE_OPENAI_CHATGPT_DEPLOYMENT", "chat")
 AZURE_OPENAI_CHATGPT_MODEL = os.getenv("AZURE_OPENAI_CHATGPT_MODEL", "gpt-35-turbo")
 
 CONFIG_CHAT_APPROACHES = "chat_approaches"
+CONFIG_CHAT_HISTORY_WRITER = "chat_history_writer"
 CONFIG_COSMOSDB_CLIENT = "cosmosdb_client"
 CONFIG_SEARCH_CLIENT = "search_client"
-COSMOSDB_DATABASE_DEMO = "Demo"
-COSMOSDB_CONTAINER_USECASEDEFINITION = "UseCaseDefinition"
+CONFIG_PROMPT_SERVICE = "prompt_service"
+CONFIG_USECASE_DEFINITION_CACHE = "usecase_definition_cache"
 
-COSMOSDB_DATABASE_KEYDATA = "KeyData"
-COSMOSDB_CONTAINER_PROMPT = "Prompts"
+DEFAULT_CONVERSATIONS_PER_PAGE = 20
+MAX_CONVERSATIONS_PER_PAGE = 100
 
 chatBP = Blueprint(
     "chat",
@@ -46,9 +53,32 @@ chatBP = Blueprint(
 )
 
 
+def _history_writer() -> ChatHistoryWriter:
+    return current_app.config[CONFIG_CHAT_HISTORY_WRITER]
+
+
 @dataclass
 class ConversationList:
     conversations: List[ConversationModel]
+    # token for the next page of a paginated listing, None for the last page
+    continuation_token: Optional[str] = None
+
+
+def _listing_limit(limit: Optional[str]) -> Optional[int]:
+    if limit is None:
+        return None
+    if not limit.isdigit() or not 1 <= int(limit) <= MAX_CONVERSATIONS_PER_PAGE:
+        raise InvalidQueryParameterError(
+            f"limit must be an integer between 1 and {MAX_CONVERSATIONS_PER_PAGE}",
+            400,
+        )
+    return int(limit)
+
+
+def _listing_newest_first(order: str) -> bool:
+    if order not in ("asc", "desc"):
+        raise InvalidQueryParameterError("order must be asc or desc", 400)
+    return order == "desc"
 
 
 @chatBP.route(
@@ -59,13 +89,32 @@ class ConversationList:
 @require_auth
 @validate_response(ConversationList, 200)
 async def get_chat_histories(usecasetype_id, index_id, category_id) -> ConversationList:
-    """_summary_"""
-    chat_histories = await ChatHistoryService.get_all_histories(
-        user_id=current_app.config["user"]["oid"],
+    """Lists the conversations of the user in the category, sorted by timestamp.
+
+    Query parameters:
+        limit: returns a page of at most this many conversations, and the continuation_token of the next page if
+            there is one. Without a limit, all conversations are returned.
+        continuation_token: returns the page after the one that returned this token
+        order: asc (oldest first, the default) or desc (newest first), the same for all pages of a listing
+    """
+    limit = _listing_limit(request.args.get("limit"))
+    continuation_token = request.args.get("continuation_token")
+    newest_first = _listing_newest_first(request.args.get("order", "asc"))
+    user_id = current_user_id()
+    await _history_writer().flushed(user_id)
+    if limit is None and continuation_token is None:
+        chat_histories = await ChatHistoryService.get_all_histories(
+            user_id=user_id, category_id=category_id, newest_first=newest_first
+        )
+        return ConversationList(conversations=chat_histories)
+    chat_histories, next_token = await ChatHistoryService.get_histories_page(
+        user_id=user_id,
         category_id=category_id,
+        limit=limit or DEFAULT_CONVERSATIONS_PER_PAGE,
+        continuation_token=continuation_token,
+        newest_first=newest_first,
     )
-    return ConversationList(conversations=chat_histories)
-    # return jsonify([asdict(chat_history) for chat_history in chat_histories])
+    return ConversationList(conversations=chat_histories, continuation_token=next_token)
 
 
 @dataclass
@@ -81,23 +130,15 @@ class ExampleQuestions:
 @require_auth
 @validate_response(ExampleQuestions, 200)
 async def get_example_questions(usecasetype_id, index_id, category_id):
-    cdb_service = CosmosDBService(
-        database=COSMOSDB_DATABASE_KEYDATA, container=COSMOSDB_CONTAINER_PROMPT
-    )
-    query = "Select p.type, p.content from Prompts p"
-    prompts = await cdb_service.query(query=query)
-    example_question_prompt = next(
-        (prompt["content"] for prompt in prompts if prompt["type"] == "example")
+    prompt_service: PromptService = current_app.config[CONFIG_PROMPT_SERVICE]
+    example_question_prompt = prompt_service.get(PromptTypes.EXAMPLE)
+    examples = await ExampleQuestionsGenerator().generate_example_questions(
+        current_app.config[CONFIG_SEARCH_CLIENT],
+        category_id,
+        example_question_prompt,
+        AZURE_OPENAI_CHATGPT_DEPLOYMENT,
+        AZURE_OPENAI_CHATGPT_MODEL,
     )
-    async with aiohttp.ClientSession() as s:
-        openai.aiosession.set(s)
-        examples = await ExampleQuestionsGenerator().generate_example_questions(
-            current_app.config[CONFIG_SEARCH_CLIENT],
-            category_id,
-            example_question_prompt,
-            AZURE_OPENAI_CHATGPT_DEPLOYMENT,
-            AZURE_OPENAI_CHATGPT_MODEL,
-        )
     return ExampleQuestions(example_questions=examples)
 
 
@@ -108,13 +149,52 @@ async def get_example_questions(usecasetype_id, index_id, category_id):
 @catch_and_return_http_code
 @require_auth
 async def get_conversation(usecasetype_id, index_id, category_id, chat_id):
-    user_id = current_app.config["user"]["oid"]
+    user_id = current_user_id()
+    await _history_writer().flushed(user_id)
     conversation = await ChatHistoryService.get_conversation(
         user_id=user_id, category_id=category_id, conversation_id=chat_id
     )
     return jsonify(conversation), 200
 
 
+async def _approach_arguments(
+    usecasetype_id: str, index_id: str, category_id: str, chat: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Collects the keyword arguments for ChatApproach.run / run_stream of a chat request"""
+    definitions: UsecaseDefinitionCache = current_app.config[
+        CONFIG_USECASE_DEFINITION_CACHE
+    ]
+    definition = await definitions.get(usecasetype_id)
+    current_category = definition.get_category(index_id, category_id)
+    category_system_prompt = (
+        current_category["system_prompt"]
+        if len(current_category["system_prompt"])
+        else None
+    )
+
+    prompt_service: PromptService = current_app.config[CONFIG_PROMPT_SERVICE]
+    return {
+        "history": chat["history"],
+        "overrides": chat["overrides"],
+        "category_id": category_id,
+        "system_prompt": prompt_service.get(PromptTypes.SYSTEM),
+        "category_system_prompt": category_system_prompt,
+        "query_prompt_template": prompt_service.get(PromptTypes.QUERY),
+        "query_fewshots": prompt_service.query_fewshots,
+        "follow_up_question": prompt_service.get(PromptTypes.FOLLOWUP),
+        "prompt_version": prompt_service.version,
+        # changes with the files and prompt of the category, so no worker serves answers of a previous version
+        "category_version": category_version(current_category),
+    }
+
+
+def _is_new_conversation(chat: Dict[str, Any]) -> bool:
+    """Whether the question of a chat request starts its conversation. The history sent along holds the previous
+    turns, so a single entry also marks the first turn if the client did not flag it as new_conversation.
+    """
+    return bool(chat.get("new_conversation")) or len(chat["history"]) == 1
+
+
 @chatBP.route(
     "/chat/<chat_id>",
     methods=["POST"],
@@ -123,84 +203,29 @@ async def get_conversation(usecasetype_id, index_id, category_id, chat_id):
 @require_auth
 @require_json
 async def collect_chat_query_and_answer(usecasetype_id, index_id, category_id, chat_id):
+    user_id = current_user_id()
     request_json: dict = await request.get_json()
     conversation_new = request_json.get("new_conversation")
     chat = request_json
     approach: ChatReadRetrieveReadApproach | StandardChatApproach = current_app.config[
         CONFIG_CHAT_APPROACHES
     ].get(chat["approach"])
-
-    cdb_service = CosmosDBService(
-        database=COSMOSDB_DATABASE_DEMO, container=COSMOSDB_CONTAINER_USECASEDEFINITION
-    )
-    query = "Select u.indices from UseCaseDefinition u where u.id=@id"
-    params = [{"name": "@id", "value": usecasetype_id}]
-    items = await cdb_service.query(query=query, params=params)
-    indices = items[0]["indices"]
-    current_index = next((item for item in indices if item["id"] == index_id), None)
-
-    current_category = next(
-        (item for item in current_index["categories"] if item["id"] == category_id),
-        None,
-    )
-    category_system_prompt = (
-        current_category["system_prompt"]
-        if len(current_category["system_prompt"])
-        else None
-    )
-
-    cdb_service = CosmosDBService(
-        database=COSMOSDB_DATABASE_KEYDATA, container=COSMOSDB_CONTAINER_PROMPT
-    )
-    query = "Select p.type, p.content from Prompts p"
-    prompts = await cdb_service.query(query=query)
-    followup_prompt = next(
-        (prompt["content"] for prompt in prompts if prompt["type"] == "followup")
-    )
-    query_prompt = next(
-        (prompt["content"] for prompt in prompts if prompt["type"] == "query")
-    )
-    system_prompt = next(
-        (prompt["content"] for prompt in prompts if prompt["type"] == "system")
-    )
-    query_fewshots = next(
-        (prompt["content"] for prompt in prompts if prompt["type"] == "query_fewshots")
-    )
+    arguments = await _approach_arguments(usecasetype_id, index_id, category_id, chat)
 
     try:
-        async with aiohttp.ClientSession() as s:
-            openai.aiosession.set(s)
-            r = (
-                await approach.run(
-                    history=chat["history"],
-                    overrides=chat["overrides"],
-                    category_id=category_id,
-                    system_prompt=system_prompt,
-                    category_system_prompt=category_system_prompt,
-                    query_prompt_template=query_prompt,
-                    query_fewshots=json.loads(query_fewshots),
-                    follow_up_question=followup_prompt,
-                )
-                or {}
-            )
-            await ChatHistoryService.add_to_history(
-                user_id=current_app.config["user"]["oid"],
-                category_id=category_id,
-                conversation_id=chat_id,
-                history=[chat["history"][-1], r],
-            )
-            if conversation_new:
-                conversation_details = (
-                    await ChatHistoryService.get_conversation_details(
-                        user_id=current_app.config["user"]["oid"],
-                        category_id=category_id,
-                        conversation_id=chat_id,
-                    )
-                )
-                r["conversation_details"] = conversation_details
-                return jsonify(r)
-            else:
-                return jsonify(r)
+        r = await approach.run(**arguments) or {}
+        conversation_details = await _history_writer().add_to_history(
+            user_id=user_id,
+            category_id=category_id,
+            conversation_id=chat_id,
+            history=[chat["history"][-1], r],
+            new_conversation=_is_new_conversation(chat),
+        )
+        if conversation_new:
+            r["conversation_details"] = conversation_details
+            return jsonify(r)
+        else:
+            return jsonify(r)
     except Exception as e:
         raise InternalServerError(
             {
@@ -211,6 +236,79 @@ async def collect_chat_query_and_answer(usecasetype_id, index_id, category_id, c
         )
 
 
+@chatBP.route(
+    "/chat/<chat_id>/stream",
+    methods=["POST"],
+)
+@catch_and_return_http_code
+@require_auth
+@require_json
+async def stream_chat_query_and_answer(usecasetype_id, index_id, category_id, chat_id):
+    """Streaming variant of collect_chat_query_and_answer.
+
+    Responds with newline delimited json (application/x-ndjson), or with server-sent events if the client
+    accepts text/event-stream. The first frame holds the data points and thoughts, the following frames hold
+    chunks of the answer ({"answer": "..."}). The last frame is {"done": true}, extended by the conversation
+    details for a new conversation. The assembled answer is added to the chat history once the completion is
+    finished. Errors after the stream started are sent as an {"error": {...}} frame.
+    """
+    user_id = current_user_id()
+    request_json: dict = await request.get_json()
+    conversation_new = request_json.get("new_conversation")
+    chat = request_json
+    approach: ChatReadRetrieveReadApproach | StandardChatApproach = current_app.config[
+        CONFIG_CHAT_APPROACHES
+    ].get(chat["approach"])
+    if approach is None:
+        raise NotFoundError(f"Unknown approach {chat['approach']}", 404)
+    arguments = await _approach_arguments(usecasetype_id, index_id, category_id, chat)
+    use_sse = "text/event-stream" in request.headers.get("Accept", "")
+
+    def frame(data: Dict[str, Any]) -> str:
+        payload = current_app.json.dumps(data)
+        return f"data: {payload}\n\n" if use_sse else f"{payload}\n"
+
+    @stream_with_context
+    async def generate() -> AsyncGenerator[str, None]:
+        r: Dict[str, Any] = {}
+        answer: List[str] = []
+        try:
+            async for chunk in approach.run_stream(**arguments):
+                if "answer" in chunk:
+                    answer.append(chunk["answer"])
+                else:
+                    r.update(chunk)
+                yield frame(chunk)
+            r["answer"] = "".join(answer)
+            conversation_details = await _history_writer().add_to_history(
+                user_id=user_id,
+                category_id=category_id,
+                conversation_id=chat_id,
+                history=[chat["history"][-1], r],
+                new_conversation=_is_new_conversation(chat),
+            )
+            done: Dict[str, Any] = {"done": True}
+            if conversation_new:
+                done["conversation_details"] = conversation_details
+            yield frame(done)
+        except Exception as e:
+            logging.exception("Streaming the chat answer failed")
+            yield frame(
+                {
+                    "error": {
+                        "code": "Something went wrong",
+                        "description": f"We encountered an error: {e}",
+                    }
+                }
+            )
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream" if use_sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @chatBP.route(
     "/chat/<chat_id>",
     methods=["DELETE"],
@@ -218,6 +316,7 @@ async def collect_chat_query_and_answer(usecasetype_id, index_id, category_id, c
 @catch_and_return_http_code
 @require_auth
 async def delete_chat_conversation(usecasetype_id, index_id, category_id, chat_id):
-    user_id = current_app.config["user"]["oid"]
+    user_id = current_user_id()
+    await _history_writer().flushed(user_id)
     await ChatHistoryService.delete_conversation(user_id, category_id, chat_id)
     return jsonify({"message": "success"}), 200
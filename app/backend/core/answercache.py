@@ -0,0 +1,200 @@
+import hashlib
+import json
+import re
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from core.cache import LRUCache
+
+
+def category_version(category: Dict[str, Any]) -> str:
+    """Hash over the parts of a category of the usecase definition its answers depend on: the ids of its files and
+    its system prompt. Changes to other categories of the same definition leave it unchanged."""
+    return hashlib.sha256(
+        json.dumps(
+            {
+                "files": sorted(file["id"] for file in category.get("files", [])),
+                "system_prompt": category.get("system_prompt"),
+            },
+            sort_keys=True,
+        ).encode("utf-8")
+    ).hexdigest()
+
+
+@dataclass(frozen=True)
+class AnswerCacheKey:
+    """
+    Identifies an answer: the category it was retrieved from, the normalized generated search query and a context
+    hash over everything else the answer depends on (overrides, prompt versions, the version of the category and the
+    previous turns of the conversation). Follow-up questions are therefore only served from the cache within the same conversation
+    history, first questions across all users.
+    """
+
+    category_id: str
+    query: str
+    context: str
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        query = re.sub(r"\s+", " ", query.strip().lower())
+        return query.strip(" \"'?!.")
+
+    @classmethod
+    def create(
+        cls,
+        category_id: str,
+        query: str,
+        overrides: Dict[str, Any],
+        prompt_version: str,
+        previous_turns: Optional[List[Dict[str, str]]] = None,
+        category_version: Optional[str] = None,
+    ) -> "AnswerCacheKey":
+        context = hashlib.sha256(
+            json.dumps(
+                {
+                    "overrides": overrides,
+                    "prompt_version": prompt_version,
+                    "previous_turns": previous_turns or [],
+                    "category_version": category_version,
+                },
+                sort_keys=True,
+                default=str,
+            ).encode("utf-8")
+        ).hexdigest()
+        return cls(category_id=category_id, query=cls.normalize(query), context=context)
+
+
+class AbstractAnswerCache(ABC):
+    """Interface of the answer caches used by ChatReadRetrieveReadApproach"""
+
+    @abstractmethod
+    async def get(
+        self, key: AnswerCacheKey, embedding: Optional[List[float]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Returns a cached answer for the key or, if an embedding is given, for a similar query"""
+        ...
+
+    @abstractmethod
+    async def set(
+        self,
+        key: AnswerCacheKey,
+        answer: Dict[str, Any],
+        embedding: Optional[List[float]] = None,
+    ) -> None:
+        ...
+
+    @abstractmethod
+    async def invalidate_category(self, category_id: str) -> None:
+        ...
+
+    @abstractmethod
+    def metrics(self) -> Dict[str, Any]:
+        ...
+
+
+class InMemoryAnswerCache(AbstractAnswerCache):
+    """
+    In-process answer cache with LRU eviction and a ttl.
+
+    invalidate_category only clears the cache of the worker process that changed the category. The other workers
+    stop serving the answers of the previous version once their UsecaseDefinitionCache reads the changed definition,
+    as the version of the category is part of the key (see category_version), so after at most the ttl of that
+    cache.
+
+    Exact lookups go by key. If a similarity threshold is configured and the query embedding is known, a miss falls
+    back to the cached query of the same category and context with the highest cosine similarity, provided it
+    reaches the threshold.
+
+    Attributes:
+        maxsize (int): maximum number of cached answers
+        ttl (float | None): seconds an answer is served from the cache
+        similarity_threshold (float | None): minimum cosine similarity of a near-duplicate query. None disables
+            the similarity lookup.
+    """
+
+    DEFAULT_MAXSIZE = 2048
+    DEFAULT_TTL = 3600
+
+    def __init__(
+        self,
+        maxsize: int = DEFAULT_MAXSIZE,
+        ttl: Optional[float] = DEFAULT_TTL,
+        similarity_threshold: Optional[float] = None,
+    ):
+        self.similarity_threshold = similarity_threshold
+        self._answers: LRUCache[AnswerCacheKey, Dict[str, Any]] = LRUCache(
+            maxsize=maxsize, ttl=ttl
+        )
+        # (category_id, context) -> keys and unit vectors of the cached queries
+        self._vectors: Dict[Tuple[str, str], Tuple[List[AnswerCacheKey], np.ndarray]] = {}
+        self.similar_hits = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _unit(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    async def get(
+        self, key: AnswerCacheKey, embedding: Optional[List[float]] = None
+    ) -> Optional[Dict[str, Any]]:
+        answer = self._answers.get(key)
+        if answer is not None or self.similarity_threshold is None or embedding is None:
+            return answer
+        group = self._vectors.get((key.category_id, key.context))
+        if group is None:
+            return None
+        keys, vectors = group
+        similarities = vectors @ self._unit(embedding)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+        answer = self._answers.get(keys[best])
+        if answer is not None:
+            self.similar_hits += 1
+        return answer
+
+    async def set(
+        self,
+        key: AnswerCacheKey,
+        answer: Dict[str, Any],
+        embedding: Optional[List[float]] = None,
+    ) -> None:
+        self._answers.set(key, answer)
+        if self.similarity_threshold is None or embedding is None:
+            return
+        group_key = (key.category_id, key.context)
+        keys, vectors = self._vectors.get(
+            group_key, ([], np.empty((0, len(embedding)), dtype=np.float32))
+        )
+        # drop the vectors of evicted or expired answers and of the previous entry of this key
+        alive = [i for i, k in enumerate(keys) if k != key and k in self._answers]
+        keys = [keys[i] for i in alive] + [key]
+        vectors = np.vstack([vectors[alive], self._unit(embedding)])
+        self._vectors[group_key] = (keys, vectors)
+        # every context, e.g. every conversation history, gets its own group. At most maxsize groups have cached
+        # answers, the others are dropped once there are twice as many, so the sweep runs every maxsize new groups
+        if len(self._vectors) > 2 * self._answers.maxsize:
+            self._vectors = {
+                g: group
+                for g, group in self._vectors.items()
+                if any(k in self._answers for k in group[0])
+            }
+
+    async def invalidate_category(self, category_id: str) -> None:
+        for key in [k for k in self._answers.keys() if k.category_id == category_id]:
+            self._answers.pop(key)
+        for group_key in [g for g in self._vectors if g[0] == category_id]:
+            del self._vectors[group_key]
+        self.invalidations += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            **self._answers.metrics(),
+            "similar_hits": self.similar_hits,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,85 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+_T = TypeVar("_T")
+
+
+class CPUExecutor:
+    """
+    Runs CPU-bound work (pdf splitting, text conversion and splitting of ingested documents) in a process pool that
+    lives as long as the app, so it never blocks the event loop that serves the chat requests.
+
+    Functions and their arguments are pickled, so only module-level functions can be offloaded. The pool uses the
+    spawn start method: forking a process that runs an event loop and client sessions is not safe. With
+    `max_workers=0` the work runs in the default thread pool of the loop instead, which keeps the loop responsive
+    for work that releases the GIL and needs no extra processes.
+
+    Example:
+        ```python
+        cpu_executor = CPUExecutor(max_workers=2)
+        cpu_executor.start()
+        paths = await cpu_executor.run(split_pdf_to_files, "/tmp/doc.pdf", "/tmp/pages")
+        await cpu_executor.stop()
+        ```
+    """
+
+    # per process: every gunicorn worker starts its own pool, each pool process imports the dependencies of the app
+    DEFAULT_MAX_WORKERS = 1
+
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS):
+        self.max_workers = max_workers
+        self._pool: Optional[Executor] = None
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.pending = 0
+        self.max_pending = 0
+        # time from submission to result, queueing included
+        self.total_seconds = 0.0
+
+    def start(self) -> None:
+        if self.max_workers > 0 and self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+    async def stop(self) -> None:
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await asyncio.to_thread(pool.shutdown, wait=True, cancel_futures=True)
+
+    async def run(self, fn: Callable[..., _T], *args: Any) -> _T:
+        """Runs fn(*args) in the pool and returns its result"""
+        self.submitted += 1
+        self.pending += 1
+        self.max_pending = max(self.max_pending, self.pending)
+        start = time.perf_counter()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                self._pool, fn, *args
+            )
+        except Exception:
+            self.failed += 1
+            raise
+        else:
+            self.completed += 1
+            return result
+        finally:
+            self.pending -= 1
+            self.total_seconds += time.perf_counter() - start
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "workers": self.max_workers,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            # submitted tasks that are queued or running
+            "queue_depth": self.pending,
+            "max_queue_depth": self.max_pending,
+            "total_seconds": round(self.total_seconds, 3),
+        }
@@ -0,0 +1,129 @@
+import os
+from types import SimpleNamespace
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+
+class HTTPSessionPool:
+    """
+    An app-lifetime aiohttp session with a tunable connection pool.
+
+    Reusing one session keeps TLS connections and DNS lookups alive across requests instead of paying for a new
+    handshake on every OpenAI call. The pool is opened in setup_clients and closed in teardown_client.
+
+    Attributes:
+        limit (int): maximum number of simultaneous connections
+        limit_per_host (int): maximum number of simultaneous connections to the same endpoint
+        keepalive_timeout (float): seconds an idle connection is kept open for reuse
+        ttl_dns_cache (int): seconds resolved addresses are cached
+    """
+
+    DEFAULT_LIMIT = 100
+    DEFAULT_LIMIT_PER_HOST = 50
+    DEFAULT_KEEPALIVE_TIMEOUT = 60
+    DEFAULT_TTL_DNS_CACHE = 300
+    DEFAULT_TIMEOUT = 300
+
+    def __init__(
+        self,
+        limit: int = DEFAULT_LIMIT,
+        limit_per_host: int = DEFAULT_LIMIT_PER_HOST,
+        keepalive_timeout: float = DEFAULT_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache: int = DEFAULT_TTL_DNS_CACHE,
+        timeout: float = DEFAULT_TIMEOUT,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.ttl_dns_cache = ttl_dns_cache
+        self.timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.requests = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.dns_cache_hits = 0
+        self.dns_cache_misses = 0
+
+    @classmethod
+    def from_env(cls, prefix: str) -> "HTTPSessionPool":
+        """Creates a pool configured by the environment variables <prefix>_LIMIT, <prefix>_LIMIT_PER_HOST,
+        <prefix>_KEEPALIVE_TIMEOUT, <prefix>_TTL_DNS_CACHE and <prefix>_TIMEOUT"""
+        return cls(
+            limit=int(os.getenv(f"{prefix}_LIMIT", cls.DEFAULT_LIMIT)),
+            limit_per_host=int(
+                os.getenv(f"{prefix}_LIMIT_PER_HOST", cls.DEFAULT_LIMIT_PER_HOST)
+            ),
+            keepalive_timeout=float(
+                os.getenv(f"{prefix}_KEEPALIVE_TIMEOUT", cls.DEFAULT_KEEPALIVE_TIMEOUT)
+            ),
+            ttl_dns_cache=int(
+                os.getenv(f"{prefix}_TTL_DNS_CACHE", cls.DEFAULT_TTL_DNS_CACHE)
+            ),
+            timeout=float(os.getenv(f"{prefix}_TIMEOUT", cls.DEFAULT_TIMEOUT)),
+        )
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            raise RuntimeError("The HTTPSessionPool is not open")
+        return self._session
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx: SimpleNamespace, params):
+            self.requests += 1
+
+        async def on_connection_create_end(session, ctx: SimpleNamespace, params):
+            self.connections_created += 1
+
+        async def on_connection_reuseconn(session, ctx: SimpleNamespace, params):
+            self.connections_reused += 1
+
+        async def on_dns_cache_hit(session, ctx: SimpleNamespace, params):
+            self.dns_cache_hits += 1
+
+        async def on_dns_cache_miss(session, ctx: SimpleNamespace, params):
+            self.dns_cache_misses += 1
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace_config.on_dns_cache_hit.append(on_dns_cache_hit)
+        trace_config.on_dns_cache_miss.append(on_dns_cache_miss)
+        return trace_config
+
+    async def open(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.ttl_dns_cache,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                trace_configs=[self._trace_config()],
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def metrics(self) -> Dict[str, Any]:
+        connections = self.connections_created + self.connections_reused
+        return {
+            "requests": self.requests,
+            "connections_created": self.connections_created,
+            "connections_reused": self.connections_reused,
+            "reuse_ratio": self.connections_reused / connections
+            if connections
+            else 0.0,
+            "dns_cache_hits": self.dns_cache_hits,
+            "dns_cache_misses": self.dns_cache_misses,
+            "open": self._session is not None and not self._session.closed,
+        }
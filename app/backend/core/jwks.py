@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+import aiohttp
+from jose import jwk
+from jose.backends.base import Key
+
+from customerrors import KeyNotFoundError
+
+
+class JWKSKeyStore:
+    """
+    Async, in-process cache for the signing keys published at a JWKS endpoint.
+
+    Keys are fetched once, parsed into RSA key objects once and then served from memory until the TTL expires.
+    A token signed with an unknown ``kid`` (e.g. after a key rollover) triggers an early refresh, rate limited by
+    ``min_refresh_interval``. Concurrent callers share a single in-flight refresh, so at most one request to the
+    JWKS endpoint is running at any time.
+
+    Example:
+        ```python
+        keystore = JWKSKeyStore(jwks_uri="https://login.microsoftonline.com/<tenant>/discovery/v2.0/keys")
+        key = await keystore.get_key(jwt.get_unverified_headers(token)["kid"])
+        payload = jwt.decode(token, key=key, algorithms=["RS256"], ...)
+        ```
+    """
+
+    DEFAULT_TTL = 60 * 60
+    DEFAULT_MIN_REFRESH_INTERVAL = 60
+    DEFAULT_REQUEST_TIMEOUT = 10
+    ALGORITHM = "RS256"
+
+    def __init__(
+        self,
+        jwks_uri: str,
+        ttl: float = DEFAULT_TTL,
+        min_refresh_interval: float = DEFAULT_MIN_REFRESH_INTERVAL,
+        request_timeout: float = DEFAULT_REQUEST_TIMEOUT,
+    ):
+        self.jwks_uri = jwks_uri
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.request_timeout = request_timeout
+        self._keys: Dict[str, Key] = {}
+        self._fetched_at: Optional[float] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.fetch_count = 0
+
+    @property
+    def is_expired(self) -> bool:
+        return self._fetched_at is None or time.monotonic() - self._fetched_at > self.ttl
+
+    def _may_refresh_early(self) -> bool:
+        return (
+            self._fetched_at is None
+            or time.monotonic() - self._fetched_at > self.min_refresh_interval
+        )
+
+    async def get_key(self, kid: str) -> Key:
+        """Returns the parsed signing key for the given key id.
+
+        Args:
+            kid (str): key id taken from the (unverified) JWT header
+
+        Raises:
+            KeyNotFoundError: the JWKS endpoint does not publish a key with this id
+
+        Returns:
+            Key: key object that can be passed directly to jose.jwt.decode
+        """
+        key = self._keys.get(kid)
+        if key is not None and not self.is_expired:
+            return key
+        if key is None and not self.is_expired and not self._may_refresh_early():
+            raise KeyNotFoundError(f"No signing key with kid {kid}")
+        try:
+            await self.refresh()
+        except Exception:
+            if key is None:
+                raise
+            # Serve the stale key rather than rejecting every request while the endpoint is unavailable
+            logging.exception("Refreshing the JWKS failed, using cached signing keys")
+            return key
+        key = self._keys.get(kid)
+        if key is None:
+            raise KeyNotFoundError(f"No signing key with kid {kid}")
+        return key
+
+    async def refresh(self) -> None:
+        """Refreshes the keys. If a refresh is already running, waits for it instead of starting a second one."""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._fetch())
+        # shield the shared task, so a cancelled request does not cancel the refresh for everybody else
+        await asyncio.shield(self._refresh_task)
+
+    async def _fetch(self) -> None:
+        timeout = aiohttp.ClientTimeout(total=self.request_timeout)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.get(self.jwks_uri) as response:
+                response.raise_for_status()
+                jwks = await response.json(content_type=None)
+        self.fetch_count += 1
+        self._keys = self.parse_keys(jwks)
+        self._fetched_at = time.monotonic()
+
+    @classmethod
+    def parse_keys(cls, jwks: Dict[str, Any]) -> Dict[str, Key]:
+        """Parses all RSA signing keys of a JWKS document
+
+        Args:
+            jwks (Dict[str, Any]): JWKS document in the form {"keys": [{"kid": ..., "kty": "RSA", "n": ..., "e": ...}]}
+
+        Returns:
+            Dict[str, Key]: parsed keys by kid
+        """
+        keys: Dict[str, Key] = {}
+        for key in jwks.get("keys", []):
+            if key.get("kty") != "RSA" or key.get("use", "sig") != "sig":
+                continue
+            keys[key["kid"]] = jwk.construct(
+                {
+                    "kty": key["kty"],
+                    "kid": key["kid"],
+                    "use": key.get("use", "sig"),
+                    "n": key["n"],
+                    "e": key["e"],
+                },
+                algorithm=cls.ALGORITHM,
+            )
+        return keys
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "keys": len(self._keys),
+            "fetches": self.fetch_count,
+            "expired": self.is_expired,
+        }
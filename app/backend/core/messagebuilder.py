@@ -1,25 +1,88 @@
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional
+
 from .modelhelper import num_tokens_from_messages
+from .tokencounter import token_counter
 
 
 class MessageBuilder:
     """
       A class for building and managing messages in a chat conversation.
+
+      The conversation is kept in three segments: the leading messages after the system message (e.g. few-shots),
+      the history, which grows towards the front as older turns are added, and the trailing messages (e.g. the latest
+      user question). Every segment is only appended to at its open end, so assembling a conversation is linear in
+      its length instead of quadratic.
       Attributes:
-          message (list): A list of dictionaries representing chat messages.
+          messages (list): A list of dictionaries representing chat messages.
           model (str): The name of the ChatGPT model.
-          token_count (int): The total number of tokens in the conversation.
+          token_length (int): The total number of tokens in the conversation.
       Methods:
           __init__(self, system_content: str, chatgpt_model: str): Initializes the MessageBuilder instance.
-          append_message(self, role: str, content: str, index: int = 1): Appends a new message to the conversation.
+          append_leading(self, role: str, content: str): Appends a message after the previous leading messages.
+          append_trailing(self, role: str, content: str): Appends a message at the end of the conversation.
+          build(self, history: Iterable[List[dict]], max_tokens: int): Adds history turns, newest first, while they
+              fit into max_tokens and returns the messages.
+          append_message(self, role: str, content: str, index: int = 1): Inserts a new message at a position.
       """
 
     def __init__(self, system_content: str, chatgpt_model: str):
-        self.messages = [{'role': 'system', 'content': system_content}]
+        self.system_message = {'role': 'system', 'content': system_content}
         self.model = chatgpt_model
+        self._leading: List[Dict[str, str]] = []
+        self._history: Deque[Dict[str, str]] = deque()
+        self._trailing: List[Dict[str, str]] = []
         self.token_length = num_tokens_from_messages(
-            self.messages[-1], self.model)
+            self.system_message, self.model)
+
+    @property
+    def messages(self) -> List[Dict[str, str]]:
+        return [self.system_message, *self._leading, *self._history, *self._trailing]
+
+    def _count(self, message: Dict[str, str], token_count: Optional[int]) -> None:
+        if token_count is None:
+            token_count = num_tokens_from_messages(message, self.model)
+        self.token_length += token_count
+
+    def append_leading(self, role: str, content: str, token_count: Optional[int] = None):
+        message = {'role': role, 'content': content}
+        self._leading.append(message)
+        self._count(message, token_count)
+
+    def append_trailing(self, role: str, content: str, token_count: Optional[int] = None):
+        message = {'role': role, 'content': content}
+        self._trailing.append(message)
+        self._count(message, token_count)
+
+    def build(self, history: Iterable[List[Dict[str, str]]], max_tokens: int) -> List[Dict[str, str]]:
+        """
+        Adds turns of history between the leading and the trailing messages, newest turn first, and stops at the
+        first turn that does not fit into max_tokens anymore. All turns are counted in one batch.
+        Args:
+            history (Iterable[List[dict]]): turns, newest first. Each turn is a list of messages in chronological order.
+            max_tokens (int): token budget of the whole conversation.
+        Returns:
+            list: The messages of the conversation.
+        """
+        turns = list(history)
+        counts = iter(token_counter.count_messages(
+            [message for turn in turns for message in turn], self.model))
+        for turn in turns:
+            turn_counts = [next(counts) for _ in turn]
+            if self.token_length + sum(turn_counts) > max_tokens:
+                break
+            for message in reversed(turn):
+                self._history.appendleft(message)
+            self.token_length += sum(turn_counts)
+        return self.messages
 
-    def append_message(self, role: str, content: str, index: int = 1):
-        self.messages.insert(index, {'role': role, 'content': content})
-        self.token_length += num_tokens_from_messages(
-            self.messages[index], self.model)
+    def append_message(self, role: str, content: str, index: int = 1, token_count: Optional[int] = None):
+        """
+        Inserts a message at a position of messages, e.g. index 1 is right after the system message. Prefer
+        append_leading, append_trailing and build, which do not have to move the other messages.
+        """
+        messages = self.messages[1:]
+        message = {'role': role, 'content': content}
+        messages.insert(index - 1, message)
+        self._leading, self._history, self._trailing = messages, deque(), []
+        self._count(message, token_count)
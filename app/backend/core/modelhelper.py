@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-import tiktoken
+from core.tokencounter import token_counter
 
 MODELS_2_TOKEN_LIMITS = {
     "gpt-35-turbo": 4000,
@@ -37,11 +37,7 @@ def num_tokens_from_messages(message: dict[str, str], model: str) -> int:
         num_tokens_from_messages(message, model)
         output: 11
     """
-    encoding = tiktoken.encoding_for_model(get_oai_chatmodel_tiktok(model))
-    num_tokens = 2  # For "role" and "content" keys
-    for key, value in message.items():
-        num_tokens += len(encoding.encode(value))
-    return num_tokens
+    return token_counter.count_message(message, model)
 
 
 def get_oai_chatmodel_tiktok(aoaimodel: str) -> str:
@@ -0,0 +1,86 @@
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from core.cache import LRUCache
+
+
+class QueryRewriteCache:
+    """
+    Caches the search queries generated from chat histories (STEP 1 of ChatReadRetrieveReadApproach), so the same
+    question in the same context does not cost another GPT call.
+
+    Queries are keyed by the last user message, a hash of the last `history_turns` turns before it and the version
+    of the query prompt. With `skip_single_turn`, the rewrite of first-turn questions is skipped altogether and the
+    question itself is used as search query.
+
+    Attributes:
+        maxsize (int): maximum number of cached queries
+        ttl (float | None): seconds a query is served from the cache
+        history_turns (int): number of turns before the last user message that are part of the key
+        skip_single_turn (bool): use the question of a single-turn conversation as search query without rewriting it
+    """
+
+    DEFAULT_MAXSIZE = 4096
+    DEFAULT_TTL = 3600
+    DEFAULT_HISTORY_TURNS = 3
+
+    def __init__(
+        self,
+        maxsize: int = DEFAULT_MAXSIZE,
+        ttl: Optional[float] = DEFAULT_TTL,
+        history_turns: int = DEFAULT_HISTORY_TURNS,
+        skip_single_turn: bool = False,
+    ):
+        self.history_turns = history_turns
+        self.skip_single_turn = skip_single_turn
+        self._queries: LRUCache[str, str] = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.rewrites = 0
+        self.skipped_single_turn = 0
+
+    def key(self, history: List[Dict[str, str]], prompt_version: str) -> str:
+        recent = history[-1 - self.history_turns : -1] if self.history_turns else []
+        history_hash = hashlib.sha256(
+            json.dumps(recent, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        return hashlib.sha256(
+            json.dumps([history[-1]["user"], history_hash, prompt_version]).encode(
+                "utf-8"
+            )
+        ).hexdigest()
+
+    async def get_or_rewrite(
+        self,
+        history: List[Dict[str, str]],
+        prompt_version: str,
+        rewrite: Callable[[], Awaitable[str]],
+    ) -> str:
+        """Returns the search query for the last user message of the history
+
+        Args:
+            history (List[Dict[str, str]]): the chat history, the last entry holds the current question
+            prompt_version (str): version of the query prompt and its few-shots
+            rewrite (Callable[[], Awaitable[str]]): generates the search query if it is not cached
+
+        Returns:
+            str: the search query
+        """
+        if self.skip_single_turn and len(history) == 1:
+            self.skipped_single_turn += 1
+            return history[-1]["user"]
+        key = self.key(history, prompt_version)
+        query = self._queries.get(key)
+        if query is None:
+            self.rewrites += 1
+            query = await rewrite()
+            self._queries.set(key, query)
+        return query
+
+    def metrics(self) -> Dict[str, Any]:
+        cache_metrics = self._queries.metrics()
+        return {
+            **cache_metrics,
+            "rewrites": self.rewrites,
+            "skipped_single_turn": self.skipped_single_turn,
+            "llm_calls_saved": cache_metrics["hits"] + self.skipped_single_turn,
+        }
@@ -0,0 +1,37 @@
+from typing import Callable, Dict
+
+from tenacity import RetryCallState
+
+# Retry-After of HTTP in seconds, as sent by Azure OpenAI
+RETRY_AFTER_SECONDS = {"Retry-After": 1.0, "retry-after": 1.0}
+# x-ms-retry-after-ms of Cosmos DB in milliseconds
+RETRY_AFTER_MILLISECONDS = {"x-ms-retry-after-ms": 0.001}
+
+
+def wait_retry_after_or_exponential(
+    fallback: Callable[[RetryCallState], float],
+    headers: Dict[str, float] = RETRY_AFTER_SECONDS,
+) -> Callable[[RetryCallState], float]:
+    """Returns a tenacity wait that waits as long as a rate limited response asks for, otherwise uses fallback
+
+    Args:
+        fallback (Callable[[RetryCallState], float]): wait for errors without a retry header, e.g. wait_random_exponential
+        headers (Dict[str, float]): the headers to look for, in order, with the seconds per unit of their value
+
+    Returns:
+        Callable[[RetryCallState], float]: the wait in seconds
+    """
+
+    def wait(retry_state: RetryCallState) -> float:
+        exception = retry_state.outcome.exception() if retry_state.outcome else None
+        response_headers = getattr(exception, "headers", None) or {}
+        for header, seconds in headers.items():
+            value = response_headers.get(header)
+            if value is not None:
+                try:
+                    return float(value) * seconds
+                except ValueError:
+                    pass
+        return fallback(retry_state)
+
+    return wait
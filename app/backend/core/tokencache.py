@@ -0,0 +1,40 @@
+import hashlib
+import time
+from typing import Any, Dict, Optional
+
+from core.cache import LRUCache
+
+
+class VerifiedTokenCache:
+    """
+    Caches the payloads of already verified JWTs, so repeated requests with the same bearer token skip the
+    signature verification. Entries are keyed by a SHA-256 hash of the token (the token itself is never stored)
+    and expire together with the token (exp claim).
+    """
+
+    DEFAULT_MAXSIZE = 4096
+
+    def __init__(self, maxsize: int = DEFAULT_MAXSIZE):
+        self._cache: LRUCache[str, Dict[str, Any]] = LRUCache(maxsize=maxsize)
+
+    @staticmethod
+    def key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        return self._cache.get(self.key(token))
+
+    def set(self, token: str, payload: Dict[str, Any]) -> None:
+        """Stores a verified payload. Tokens without an exp claim are not cached.
+
+        Args:
+            token (str): the raw JWT
+            payload (Dict[str, Any]): the payload as returned by jose.jwt.decode
+        """
+        expires_at = payload.get("exp")
+        if expires_at is None or expires_at <= time.time():
+            return
+        self._cache.set(self.key(token), payload, expires_at=float(expires_at))
+
+    def metrics(self) -> Dict[str, Any]:
+        return self._cache.metrics()
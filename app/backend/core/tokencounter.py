@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import hashlib
+from functools import lru_cache
+from typing import Any, Iterable
+
+import tiktoken
+
+from core.cache import LRUCache
+
+# For "role" and "content" keys
+MESSAGE_OVERHEAD = 2
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str) -> tiktoken.Encoding:
+    """Returns the tiktoken encoding of an (Azure) OpenAI chat model. Resolved once per model."""
+    from core.modelhelper import get_oai_chatmodel_tiktok
+
+    return tiktoken.encoding_for_model(get_oai_chatmodel_tiktok(model))
+
+
+class TokenCounter:
+    """
+    Counts tokens of texts and chat messages with memoized encoders and a bounded cache of token counts.
+
+    Counts are cached per encoding and content hash, so the same history walked on every chat turn is only
+    encoded once. Uncached texts of a batch are encoded together with `Encoding.encode_batch`.
+
+    Example:
+        ```python
+        counter = TokenCounter()
+        counter.count("Hello, how are you?", "gpt-35-turbo")
+        counter.count_messages([{"role": "user", "content": "Hello"}], "gpt-35-turbo")
+        ```
+    """
+
+    DEFAULT_MAXSIZE = 16384
+
+    def __init__(self, maxsize: int = DEFAULT_MAXSIZE):
+        self._cache: LRUCache[tuple[str, bytes], int] = LRUCache(maxsize=maxsize)
+
+    @staticmethod
+    def key(encoding: tiktoken.Encoding, text: str) -> tuple[str, bytes]:
+        return (
+            encoding.name,
+            hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest(),
+        )
+
+    def count(self, text: str, model: str) -> int:
+        return self.count_batch([text], model)[0]
+
+    def count_batch(self, texts: Iterable[str], model: str) -> list[int]:
+        """Counts the tokens of several texts, encoding only the ones not cached yet
+
+        Args:
+            texts (Iterable[str]): texts to count
+            model (str): name of the model whose encoding is used
+
+        Returns:
+            List[int]: token count per text, in the order of texts
+        """
+        encoding = get_encoding(model)
+        texts = list(texts)
+        keys = [self.key(encoding, text) for text in texts]
+        counts: list[int | None] = [self._cache.get(key) for key in keys]
+        missing = [i for i, count in enumerate(counts) if count is None]
+        if missing:
+            # identical texts within one batch are encoded once
+            unique = {keys[i]: texts[i] for i in missing}
+            encoded = encoding.encode_batch(list(unique.values()))
+            unique_counts = {
+                key: len(tokens) for key, tokens in zip(unique.keys(), encoded)
+            }
+            for key, count in unique_counts.items():
+                self._cache.set(key, count)
+            for i in missing:
+                counts[i] = unique_counts[keys[i]]
+        return counts  # type: ignore
+
+    def count_message(self, message: dict[str, str], model: str) -> int:
+        return self.count_messages([message], model)[0]
+
+    def count_messages(self, messages: list[dict[str, str]], model: str) -> list[int]:
+        """Counts the tokens required to encode each of the messages, see num_tokens_from_messages"""
+        values = [value for message in messages for value in message.values()]
+        value_counts = iter(self.count_batch(values, model))
+        return [
+            MESSAGE_OVERHEAD + sum(next(value_counts) for _ in message)
+            for message in messages
+        ]
+
+    def metrics(self) -> dict[str, Any]:
+        return self._cache.metrics()
+
+
+token_counter = TokenCounter()
@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import weakref
+from typing import IO, Optional
+
+
+class UploadedFile:
+    """
+    A file of a multipart upload, spooled to disk in chunks so its content is never held in memory as a whole.
+
+    Consumers open their own read handles with open(), so the blob upload and the form recognizer analysis can read
+    the same file concurrently. A spooled file is removed when the object is garbage collected, unless it was moved
+    somewhere else with move_to().
+
+    Example:
+        ```python
+        upload = UploadedFile.spool(file_storage.stream)
+        with upload.open() as f:
+            first_kb = f.read(1024)
+        ```
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, path: str, delete: bool = True):
+        self.path = path
+        self._finalizer: Optional[weakref.finalize] = (
+            weakref.finalize(self, UploadedFile._remove, path) if delete else None
+        )
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @classmethod
+    def spool(cls, stream: IO[bytes], directory: Optional[str] = None) -> "UploadedFile":
+        """Copies a stream to a temporary file, CHUNK_SIZE bytes at a time"""
+        with tempfile.NamedTemporaryFile(
+            dir=directory, prefix="upload-", delete=False
+        ) as f:
+            shutil.copyfileobj(stream, f, cls.CHUNK_SIZE)
+        return cls(f.name)
+
+    @property
+    def size(self) -> int:
+        return os.path.getsize(self.path)
+
+    def open(self) -> IO[bytes]:
+        return open(self.path, "rb")
+
+    def read(self) -> bytes:
+        with self.open() as f:
+            return f.read()
+
+    def move_to(self, path: str) -> None:
+        """Moves the file to path and hands over its cleanup to the caller"""
+        shutil.move(self.path, path)
+        if self._finalizer is not None:
+            self._finalizer.detach()
+            self._finalizer = None
+        self.path = path
+
+    def remove(self) -> None:
+        if self._finalizer is not None:
+            self._finalizer()
+        else:
+            UploadedFile._remove(self.path)
+
+    def __deepcopy__(self, memo) -> "UploadedFile":
+        # dataclasses.asdict deep-copies field values, the file on disk must not be duplicated
+        return self
+
+    def __repr__(self) -> str:
+        return f"UploadedFile({self.path!r})"
@@ -47,3 +47,19 @@ class InternalServerError(Exception):
 
 class ConversationNotFoundError(Exception):
     ...
+
+
+class KeyNotFoundError(Exception):
+    ...
+
+
+class PreconditionFailedError(Exception):
+    def __init__(self, message, code):
+        self.error = message
+        self.status_code = code
+
+
+class InvalidQueryParameterError(Exception):
+    def __init__(self, message, code):
+        self.error = message
+        self.status_code = code
@@ -1,4 +1,5 @@
 import multiprocessing
+import os
 
 max_requests = 1000
 max_requests_jitter = 50
@@ -8,6 +9,11 @@ bind = "0.0.0.0"
 timeout = 500
 # https://learn.microsoft.com/en-us/troubleshoot/azure/app-service/web-apps-performance-faqs#why-does-my-request-time-out-after-230-seconds
 
+# a stopping worker (also after max_requests) lets its running ingestion jobs finish (INGESTION_JOB_STOP_TIMEOUT,
+# 60 seconds) and writes the queued chat history (20 seconds) before it exits
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 90))
+
 num_cpus = multiprocessing.cpu_count()
-workers = (num_cpus * 2) + 1
+# The user identity is request scoped, so a single worker can serve many concurrent requests
+workers = int(os.getenv("GUNICORN_WORKERS", (num_cpus * 2) + 1))
 worker_class = "uvicorn.workers.UvicornWorker"
@@ -1,7 +1,8 @@
 from dataclasses import dataclass, field
 import io
-from typing import Any, Dict, Generic, List, Optional, TypeVar, Union
+from typing import IO, Any, Dict, Generic, Iterable, List, Optional, TypeVar, Union
 from models.BaseModels import BaseModel
+from core.uploadedfile import UploadedFile
 
 
 """
@@ -36,7 +37,7 @@ class PageCosmosDBModel(BaseModel):
 
 @dataclass
 class PageBlobStorageModel(BaseModel):
-    data: bytes
+    data: Union[bytes, IO[bytes]]
     path: str
     metadata: Optional[Dict[str, str]] = field(default_factory=dict)
     tags: Optional[Dict[str, str]] = field(default_factory=dict)
@@ -46,7 +47,7 @@ class PageBlobStorageModel(BaseModel):
 FileModels
 """
 
-F = TypeVar("F", bytes, str)
+F = TypeVar("F", bytes, str, UploadedFile)
 
 
 @dataclass
@@ -58,9 +59,9 @@ class FileModel(BaseModel, Generic[F]):
 
 @dataclass
 class FileBlobStorageModel(BaseModel):
-    data: bytes
+    data: Union[bytes, IO[bytes]]
     path: str
-    pages: List[PageBlobStorageModel]
+    pages: Iterable[PageBlobStorageModel]
     metadata: Optional[Dict[str, str]] = field(default_factory=dict)
     tags: Optional[Dict[str, str]] = field(default_factory=dict)
 
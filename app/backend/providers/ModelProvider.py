@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+import asyncio
 from enum import Enum
 import json
 from typing import TypeVar
@@ -7,6 +8,7 @@ from werkzeug.datastructures import MultiDict
 
 from quart import Request
 from models.Models import FileModel, IndexModel, CategoryModel, UsecaseTypeModel
+from core.uploadedfile import UploadedFile
 from utils import create_dataclass_from_dict
 
 _T = TypeVar("_T", IndexModel, CategoryModel, UsecaseTypeModel)
@@ -51,7 +53,7 @@ class IndexModelFactory(AbstractIndexModelFactory):
         for category in files.keys():
             category_id = category.split("<")[1].split(">")[0]
             for file in files.getlist(category):
-                data = file.read()
+                data = UploadedFile.spool(file.stream)
                 files_.add(
                     category_id,
                     [
@@ -117,9 +119,9 @@ class CategoryModelFactory(AbstractCategoryModelFactory):
         files_ = []
         for file in files.getlist(list(files.keys())[0]):
             if file.filename:
-                data = file.read()
+                data = UploadedFile.spool(file.stream)
                 files_.append(
-                    FileModel[bytes](
+                    FileModel[UploadedFile](
                         id=str(uuid.uuid1()), data=data, name=file.filename
                     ).jsonify()
                 )
@@ -214,5 +216,8 @@ class ModelProvider:
     ) -> _T:
         files = await request.files
         form = await request.form
-        model = model_factory.create_bytes_model(files=files, form=form)
+        # uploaded files are spooled to disk instead of being read into memory, off the event loop
+        model = await asyncio.to_thread(
+            model_factory.create_bytes_model, files=files, form=form
+        )
         return model
@@ -1,6 +1,10 @@
 from abc import ABC, abstractmethod
 from typing import Dict, List, Union
 
+from quart import current_app
+
+from services.UsecaseDefinitionService import UsecaseDefinitionCache
+
 """
 COSMOSDB_DATABASE_DEMO = "Demo"
 COSMOSDB_CONTAINER_USECASEDEFINITION = "UseCaseDefinition"
@@ -8,6 +12,7 @@ COSMOSDB_CONTAINER_USECASEDEFINITION = "UseCaseDefinition"
 AZURE_STORAGE_CONTAINER = "content"
 AZURE_COSMOS_DB = "Demo"
 AZURE_COSMOS_CONTAINER = "UseCaseDefinition"
+CONFIG_USECASE_DEFINITION_CACHE = "usecase_definition_cache"
 
 
 class AbstractUsecaseService(ABC):
@@ -63,3 +68,7 @@ class UsecaseService(AbstractUsecaseService):
     @_STORAGE_CONTAINER.setter
     def _STORAGE_CONTAINER(self):
         raise Exception("You are not allowed to set the Storage Container")
+
+    @property
+    def _definitions(self) -> UsecaseDefinitionCache:
+        return current_app.config[CONFIG_USECASE_DEFINITION_CACHE]
@@ -1,11 +1,10 @@
-from typing import Dict, List, Tuple, Union
+from typing import IO, Dict, List, Tuple, Union
 from quart import current_app
 from services.ABCAzureService import AbstractAzureService
 from azure.storage.blob.aio import BlobServiceClient, ContainerClient, BlobClient
 from azure.storage.blob import ContainerProperties, FilteredBlob
-import io
 from functools import singledispatchmethod
-from models.Models import FileBlobStorageModel
+from models.Models import FileBlobStorageModel, PageBlobStorageModel
 import asyncio
 
 CONFIG_BLOB_CLIENT = "blob_client"
@@ -13,6 +12,8 @@ CONFIG_BLOB_CLIENT = "blob_client"
 
 class BlobService(AbstractAzureService):
     MAX_NUMBER_OF_DELETE_BLOBS = 256
+    # pages are split while they are uploaded, so this also bounds the pages held in memory per file
+    MAX_CONCURRENT_PAGE_UPLOADS = 8
 
     @property
     def client(self) -> BlobServiceClient:
@@ -38,7 +39,7 @@ class BlobService(AbstractAzureService):
         self,
         container: Union[ContainerProperties, str],
         name: str,
-        data: Union[bytes, io.BytesIO],
+        data: Union[bytes, IO[bytes]],
         metadata: Dict[str, str] | None = None,
         tags: Dict[str, str] | None = None,
     ) -> BlobClient:
@@ -70,21 +71,40 @@ class BlobService(AbstractAzureService):
                 )
             )
             page_infos: List[asyncio.Task[BlobClient]] = []
-            for page in files.pages:
+            slots = asyncio.Semaphore(self.MAX_CONCURRENT_PAGE_UPLOADS)
+            pages = iter(files.pages)
+            while True:
+                # the next page is only taken from files.pages once an upload slot is free
+                await slots.acquire()
+                page = next(pages, None)
+                if page is None:
+                    slots.release()
+                    break
                 page_info = tg.create_task(
-                    self.upload(
-                        container=container,
-                        name=page.path,
-                        data=page.data,
-                        metadata=page.metadata,
-                        tags=page.tags,
-                    )
+                    self.__upload_page(container=container, page=page, slots=slots)
                 )
                 page_infos.append(page_info)
         file_info_result = file_info.result()
         page_infos_result = [_page_info.result() for _page_info in page_infos]
         return (file_info_result, page_infos_result)
 
+    async def __upload_page(
+        self,
+        container: Union[ContainerProperties, str],
+        page: PageBlobStorageModel,
+        slots: asyncio.Semaphore,
+    ) -> BlobClient:
+        try:
+            return await self.upload(
+                container=container,
+                name=page.path,
+                data=page.data,
+                metadata=page.metadata,
+                tags=page.tags,
+            )
+        finally:
+            slots.release()
+
     async def batch_upload(self):
         raise NotImplementedError("Not yet implemented")
 
@@ -1,14 +1,14 @@
 from abc import ABC, abstractmethod
 import asyncio
+from contextlib import ExitStack
 import os
-from typing import Any, Dict, List, Tuple, Union
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
 import uuid
-import openai
 from quart import current_app
 
-from tenacity import retry, stop_after_attempt, wait_random_exponential
 from services.ChatHistoryService import ChatHistoryService
 from strategies.CognitiveSearchIndexStrategy import (
+    CognitiveSearchIndexContext,
     CognitiveSearchIndexStrategyProvider,
 )
 
@@ -20,31 +20,56 @@ from models.Models import (
     FileCosmosDBModel,
     PageCosmosDBModel,
     CategoryCosmosDBModel,
-    IndexCosmosDBModel,
 )
 
 from services.ABCUsecaseService import (
     UsecaseService,
 )
+from services.UsecaseDefinitionService import UsecaseDefinition
 
 from azure.storage.blob.aio import BlobClient
 
 from services.BlobService import BlobService
-from services.FileManagementService import (
-    FileManagementService,
-    ByteFileManagementStrategy,
-    StrFileManagementStrategy,
-)
+from services.FileManagementService import FileManagementService
 from services.FormRecognizerService import FormRecognizerService, PREBUILTLAYOUT
-from services.TextManagementService import FormRecognizerTextManagementService
+from services.TextManagementService import analyze_result_to_sections
+from core.cpuexecutor import CPUExecutor
 from services.CognitiveSearchService import CognitiveSearchService
 from services.CosmosDBService import CosmosDBService
+from services.EmbeddingService import DocumentEmbeddingService
+from services.IngestionJobService import (
+    Attachments,
+    IngestionJob,
+    IngestionJobService,
+)
 
+from azure.cosmos.exceptions import CosmosAccessConditionFailedError
+from customerrors import PreconditionFailedError
 from utils import create_dataclass_from_dict
 
 
+CONFIG_ANSWER_CACHE = "answer_cache"
+CONFIG_DOCUMENT_EMBEDDING_SERVICE = "document_embedding_service"
+CONFIG_INGESTION_JOB_SERVICE = "ingestion_job_service"
+CONFIG_CPU_EXECUTOR = "cpu_executor"
+
+JOB_POST_CATEGORY = "category.post"
+JOB_PUT_CATEGORY = "category.put"
+
+Progress = Optional[Callable[[str], Awaitable[None]]]
+
+
 class CategoryService(UsecaseService):
     MAX_DB_PATCH_OPERATIONS = 10
+    # stages of post and put as reported to the progress callback, in order
+    INGESTION_STAGES = [
+        "delete_files",
+        "upload_and_analyze",
+        "split",
+        "embed",
+        "index",
+        "update_fields",
+    ]
 
     @property
     def fields(self):
@@ -60,48 +85,43 @@ class CategoryService(UsecaseService):
             "files",
         ]
 
-    async def __query_categories_from_db(
-        self, usecasetype_id: str, index_id: str
-    ) -> List[Dict[str, Any]]:
-        items = await CosmosDBService(
-            database=self._DATABASE, container=self._CONTAINER
-        ).query(
-            query=f"Select c.{',c.'.join(self.fields)} FROM {self._CONTAINER} d JOIN t in d.indices JOIN c in t.categories where d.id=@usecasetypeid and t.id=@indexid",
-            params=[
-                {"name": "@usecasetypeid", "value": usecasetype_id},
-                {"name": "@indexid", "value": index_id},
-            ],
-        )
-        return items
+    @property
+    def __cpu_executor(self) -> CPUExecutor:
+        return current_app.config[CONFIG_CPU_EXECUTOR]
 
-    async def __get_index_by_idx(
-        self, usecasetype_id: str, index_idx: int
-    ) -> IndexCosmosDBModel:
-        cdb_service = CosmosDBService(
-            database=self._DATABASE, container=self._CONTAINER
-        )
-        items = await cdb_service.query(
-            query=f"Select * from {self._CONTAINER} d where d.id=@id",
-            params=[{"name": "@id", "value": usecasetype_id}],
+    @property
+    def __index_context(self) -> CognitiveSearchIndexContext:
+        return CognitiveSearchIndexStrategyProvider.get_context(
+            current_app.config["AZURE_SEARCH_INDEX"]
         )
-        indices = [
-            create_dataclass_from_dict(IndexCosmosDBModel, item)
-            for item in items[0]["indices"]
+
+    @staticmethod
+    async def __report(progress: Progress, stage: str) -> None:
+        if progress is not None:
+            await progress(stage)
+
+    async def __invalidate_answers(self, category_id: str) -> None:
+        answer_cache = current_app.config.get(CONFIG_ANSWER_CACHE)
+        if answer_cache is not None:
+            await answer_cache.invalidate_category(category_id)
+
+    def __categories_of_index(
+        self, definition: UsecaseDefinition, index_id: str
+    ) -> List[CategoryCosmosDBModel]:
+        return [
+            create_dataclass_from_dict(CategoryCosmosDBModel, item)
+            for item in definition.get_index(index_id).get("categories", [])
         ]
-        return indices[index_idx]
 
     async def __find_current_category(
-        self, id: str, usecasetype_id: str, index_idx: int
+        self, id: str, usecasetype_id: str, index_id: str
     ) -> Tuple[int, CategoryCosmosDBModel]:
-        index = await self.__get_index_by_idx(
-            usecasetype_id=usecasetype_id, index_idx=index_idx
+        definition = await self._definitions.get(usecasetype_id, refresh=True)
+        _, category_idx = definition.category_position(index_id, id)
+        category = create_dataclass_from_dict(
+            CategoryCosmosDBModel, definition.get_category(index_id, id)
         )
-        current_category_idx = next(
-            ((i, item) for i, item in enumerate(index.categories) if item.id == id), None  # type: ignore
-        )
-        if current_category_idx is None:
-            raise Exception(f"Could not find category with id: {id}")
-        return current_category_idx
+        return category_idx, category
 
     async def __delete_from_blob(
         self, files: Union[List[FileCosmosDBModel], List[str]]
@@ -142,97 +162,121 @@ class CategoryService(UsecaseService):
                 break
 
     async def __delete_cat_from_db(
-        self, usecasetype_id: str, index_idx: int, category_idx: int
-    ) -> Dict[str, Any]:
-        patch = [
-            {
-                "op": "remove",
-                "path": f"/indices/{index_idx}/categories/{category_idx}",
-            }
-        ]
-        items = await self.__patch_db(usecasetype_id=usecasetype_id, patch=patch)
-        return items
+        self, usecasetype_id: str, index_id: str, category_id: str
+    ) -> UsecaseDefinition:
+        return await self.__patch_category(
+            usecasetype_id=usecasetype_id,
+            index_id=index_id,
+            category_id=category_id,
+            build_patch=lambda definition, index_idx, category_idx: [
+                {
+                    "op": "remove",
+                    "path": f"/indices/{index_idx}/categories/{category_idx}",
+                }
+            ],
+        )
 
     async def __delete_files_from_db(
         self,
         usecasetype_id: str,
-        index_idx: int,
-        category_idx: int,
-        file_idxs: List[int],
-    ):
-        patch = [
-            {
-                "op": "remove",
-                "path": f"/indices/{index_idx}/categories/{category_idx}/files/{file_idx}",
-            }
-            for file_idx in file_idxs
-        ]
-        items = await self.__patch_db(usecasetype_id=usecasetype_id, patch=patch)
-        return items
+        index_id: str,
+        category_id: str,
+        file_ids: List[str],
+    ) -> UsecaseDefinition:
+        def build_patch(definition: UsecaseDefinition, index_idx: int, category_idx: int):
+            category = create_dataclass_from_dict(
+                CategoryCosmosDBModel, definition.get_category(index_id, category_id)
+            )
+            file_idxs = self.__get_file_idxs_from_ids(category=category, ids=file_ids)
+            return [
+                {
+                    "op": "remove",
+                    "path": f"/indices/{index_idx}/categories/{category_idx}/files/{file_idx}",
+                }
+                for file_idx in file_idxs
+            ]
+
+        return await self.__patch_category(
+            usecasetype_id=usecasetype_id,
+            index_id=index_id,
+            category_id=category_id,
+            build_patch=build_patch,
+        )
+
+    async def __patch_category(
+        self,
+        usecasetype_id: str,
+        index_id: str,
+        category_id: str,
+        build_patch: Callable[[UsecaseDefinition, int, int], List[Dict[str, Any]]],
+    ) -> UsecaseDefinition:
+        """
+        Resolves the array positions of a category right before patching and guards the patch with the etag of the
+        document the positions were read from, so a concurrent change can never make us patch the wrong category.
+        """
+        definition = await self._definitions.get(usecasetype_id, refresh=True)
+        index_idx, category_idx = definition.category_position(index_id, category_id)
+        patch = build_patch(definition, index_idx, category_idx)
+        return await self.__patch_db(
+            usecasetype_id=usecasetype_id, patch=patch, etag=definition.etag
+        )
 
     # TODO: Have a look if this can be done more elegantly
     async def __patch_db(
-        self, usecasetype_id: str, patch: List[Dict[str, Any]]
-    ) -> Dict[str, Any]:
+        self,
+        usecasetype_id: str,
+        patch: List[Dict[str, Any]],
+        etag: Union[str, None] = None,
+    ) -> UsecaseDefinition:
         cdb_service = CosmosDBService(
             database=self._DATABASE, container=self._CONTAINER
         )
-        if len(patch) > self.MAX_DB_PATCH_OPERATIONS:
-            indices = await cdb_service.batch_patch(
-                item_id=usecasetype_id,
-                partition_key=usecasetype_id,
-                patch_operations=patch,
-            )
-        else:
-            indices = await cdb_service.patch(
-                item_id=usecasetype_id, partition_key=usecasetype_id, patch=patch
+        try:
+            if len(patch) > self.MAX_DB_PATCH_OPERATIONS:
+                item = await cdb_service.batch_patch(
+                    item_id=usecasetype_id,
+                    partition_key=usecasetype_id,
+                    patch_operations=patch,
+                    etag=etag,
+                )
+            else:
+                item = await cdb_service.patch(
+                    item_id=usecasetype_id,
+                    partition_key=usecasetype_id,
+                    patch=patch,
+                    etag=etag,
+                )
+        except CosmosAccessConditionFailedError:
+            self._definitions.invalidate(usecasetype_id)
+            raise PreconditionFailedError(
+                {
+                    "code": "concurrent modification",
+                    "description": "The usecase definition was modified concurrently, please retry",
+                },
+                412,
             )
-        return indices
+        return self._definitions.store(item)
 
     async def get(
         self, usecasetype_id: str, index_id: str
     ) -> List[CategoryCosmosDBModel]:
-        items = await self.__query_categories_from_db(
-            usecasetype_id=usecasetype_id, index_id=index_id
-        )
-        categories = [
-            create_dataclass_from_dict(CategoryCosmosDBModel, item) for item in items
-        ]
-        return categories
+        definition = await self._definitions.get(usecasetype_id, refresh=True)
+        return self.__categories_of_index(definition, index_id)
 
     async def delete(
-        self, id: str, usecasetype_id: str, index_idx: int
+        self, id: str, usecasetype_id: str, index_id: str
     ) -> List[CategoryCosmosDBModel]:
-        idx, category = await self.__find_current_category(
-            id=id, usecasetype_id=usecasetype_id, index_idx=index_idx
+        _, category = await self.__find_current_category(
+            id=id, usecasetype_id=usecasetype_id, index_id=index_id
         )
         await self.__delete_from_blob(category.files)
         await self.__delete_cat_from_cog_search(category_id=id)
         await ChatHistoryService.delete_chat_history_by_category(id)
-        indices = await self.__delete_cat_from_db(
-            usecasetype_id=usecasetype_id, index_idx=index_idx, category_idx=idx
+        definition = await self.__delete_cat_from_db(
+            usecasetype_id=usecasetype_id, index_id=index_id, category_id=id
         )
-        categories = [
-            create_dataclass_from_dict(CategoryCosmosDBModel, item)
-            for item in indices["indices"][index_idx]["categories"]
-        ]
-        return categories
-
-    # TODO: Refactor this
-    @retry(wait=wait_random_exponential(min=1, max=5), stop=stop_after_attempt(6))
-    async def __create_embeddings(self, input: str) -> List[float]:
-        AZURE_OPENAI_EMB_DEPLOYMENT = os.getenv(
-            "AZURE_OPENAI_EMB_DEPLOYMENT", "embedding"
-        )
-        AZURE_OPENAI_EMB_MODEL = os.getenv(
-            "AZURE_OPENAI_EMB_MODEL", "text-embedding-ada-002"
-        )
-        r = await openai.Embedding.acreate(
-            deployment_id=AZURE_OPENAI_EMB_DEPLOYMENT,
-            model=AZURE_OPENAI_EMB_MODEL,
-            input=input,
-        )
-        return r["data"][0]["embedding"]  # type: ignore
+        await self.__invalidate_answers(id)
+        return self.__categories_of_index(definition, index_id)
 
     def __get_file_idxs_from_ids(
         self, category: CategoryCosmosDBModel, ids: List[str]
@@ -257,25 +301,23 @@ class CategoryService(UsecaseService):
         category: CategoryModel,
         usecasetype_id: str,
         index_id: str,
-        index_idx: int,
+        progress: Progress = None,
     ) -> List[CategoryCosmosDBModel]:
-        current_cat_idx, current_cat = await self.__find_current_category(
-            id=category.id, usecasetype_id=usecasetype_id, index_idx=index_idx
+        _, current_cat = await self.__find_current_category(
+            id=category.id, usecasetype_id=usecasetype_id, index_id=index_id
         )
         # 1. Step: Remove files:
         if category.filesToDelete:
+            await self.__report(progress, "delete_files")
             files_to_delete_ids = [file.id for file in category.filesToDelete]
-            file_idxs = self.__get_file_idxs_from_ids(
-                category=current_cat, ids=files_to_delete_ids
-            )
             async with asyncio.TaskGroup() as tg:
                 tg.create_task(self.__delete_from_blob(files=files_to_delete_ids))
                 tg.create_task(
                     self.__delete_files_from_db(
                         usecasetype_id=usecasetype_id,
-                        index_idx=index_idx,
-                        category_idx=current_cat_idx,
-                        file_idxs=file_idxs,
+                        index_id=index_id,
+                        category_id=category.id,
+                        file_ids=files_to_delete_ids,
                     )
                 )
                 for file_to_delete_id in files_to_delete_ids:
@@ -292,60 +334,65 @@ class CategoryService(UsecaseService):
             )  # set(a) & set(b) -> A n B; set(a) - set(b) -> A / B
             if new_file_ids:
                 new_files = [file for file in category.files if file.id in new_file_ids]
+                await self.__report(progress, "upload_and_analyze")
                 # TODO: Refactor. exactly the same code as post
                 fr_service = FormRecognizerService()
                 blob_service = BlobService()
-                async with asyncio.TaskGroup() as tg:
-                    blob_uploads: List[
-                        asyncio.Task[Tuple[BlobClient, List[BlobClient]]]
-                    ] = []
-                    fr_analyzes: List[asyncio.Task[PREBUILTLAYOUT]] = []
-                    file_ids: List[str] = []
-                    file_names: List[str] = []
-                    for file in new_files:
-                        file_names.append(file.name)
-                        if isinstance(file.data, str):
-                            filemanagement_service = FileManagementService(
-                                strategy=StrFileManagementStrategy()
-                            )
-                        else:
-                            filemanagement_service = FileManagementService(
-                                strategy=ByteFileManagementStrategy()
+                # the file handles of blob uploads and analyzes are closed once both are done
+                with ExitStack() as file_handles:
+                    async with asyncio.TaskGroup() as tg:
+                        blob_uploads: List[
+                            asyncio.Task[Tuple[BlobClient, List[BlobClient]]]
+                        ] = []
+                        fr_analyzes: List[asyncio.Task[PREBUILTLAYOUT]] = []
+                        file_ids: List[str] = []
+                        file_names: List[str] = []
+                        for file in new_files:
+                            file_names.append(file.name)
+                            filemanagement_service = FileManagementService.for_file(file)
+                            filesttart_instance = file_handles.enter_context(
+                                await filemanagement_service.process_file_offloaded(
+                                    file, self.__cpu_executor
+                                )
                             )
-                        filesttart_instance = filemanagement_service.process_file(file)
-                        file_ids.append(filesttart_instance.file_id)
+                            file_ids.append(filesttart_instance.file_id)
 
-                        files_for_blob_upload = filesttart_instance._to_model(
-                            index_id, category.id
-                        )
-                        blob_upload: asyncio.Task[
-                            Tuple[BlobClient, List[BlobClient]]
-                        ] = tg.create_task(
-                            blob_service.bulk_upload(
-                                files_for_blob_upload, container=self._STORAGE_CONTAINER
+                            files_for_blob_upload = filesttart_instance._to_model(
+                                index_id, category.id
                             )
-                        )
-                        fr_analyze: asyncio.Task[PREBUILTLAYOUT] = tg.create_task(
-                            fr_service.analyze_document(
-                                PREBUILTLAYOUT, filesttart_instance.file_bytes
+                            blob_upload: asyncio.Task[
+                                Tuple[BlobClient, List[BlobClient]]
+                            ] = tg.create_task(
+                                blob_service.bulk_upload(
+                                    files_for_blob_upload,
+                                    container=self._STORAGE_CONTAINER,
+                                )
                             )
-                        )
-                        blob_uploads.append(blob_upload)
-                        fr_analyzes.append(fr_analyze)
+                            fr_analyze: asyncio.Task[PREBUILTLAYOUT] = tg.create_task(
+                                fr_service.analyze_document(
+                                    PREBUILTLAYOUT, filesttart_instance.open_file()
+                                )
+                            )
+                            blob_uploads.append(blob_upload)
+                            fr_analyzes.append(fr_analyze)
                 blob_upload_result = [
                     _blob_upload.result() for _blob_upload in blob_uploads
                 ]
                 fr_analyze_result = [
                     _fr_analyze.result() for _fr_analyze in fr_analyzes
                 ]
-                page_maps: List[List[Tuple[int, int, str]]] = [
-                    FormRecognizerTextManagementService.convert_text(fr_analyze_result_)
-                    for fr_analyze_result_ in fr_analyze_result
-                ]
-                files_as_sections: List[List[Tuple[str, int]]] = [
-                    FormRecognizerTextManagementService.split_text(page_map)
-                    for page_map in page_maps
-                ]
+                await self.__report(progress, "split")
+                files_as_sections: List[List[Tuple[str, int]]] = await asyncio.gather(
+                    *(
+                        self.__cpu_executor.run(
+                            analyze_result_to_sections,
+                            fr_analyze_result_,
+                            self.__index_context.section_splitter,
+                        )
+                        for fr_analyze_result_ in fr_analyze_result
+                    )
+                )
+                await self.__report(progress, "embed")
                 files_sections = await self.__create_cognitivesearch_document(
                     files_as_sections=files_as_sections,
                     file_names=file_names,
@@ -367,98 +414,107 @@ class CategoryService(UsecaseService):
                         zip(file_ids, file_names, blob_upload_result, pages)
                     )
                 ]
-                patch_operation = [
-                    {
-                        "op": "add",
-                        "path": f"/indices/{index_idx}/categories/{current_cat_idx}/files/-",
-                        "value": file.jsonify(),
-                    }
-                    for file in files
-                ]
+                await self.__report(progress, "index")
                 async with asyncio.TaskGroup() as tg:
                     tg.create_task(CognitiveSearchService().batch_index(files_sections))
                     tg.create_task(
-                        CosmosDBService(
-                            database=self._DATABASE, container=self._CONTAINER
-                        ).batch_patch(
-                            item_id=usecasetype_id,
-                            partition_key=usecasetype_id,
-                            patch_operations=patch_operation,
+                        self.__patch_category(
+                            usecasetype_id=usecasetype_id,
+                            index_id=index_id,
+                            category_id=category.id,
+                            build_patch=lambda definition, index_idx, category_idx: [
+                                {
+                                    "op": "add",
+                                    "path": f"/indices/{index_idx}/categories/{category_idx}/files/-",
+                                    "value": file.jsonify(),
+                                }
+                                for file in files
+                            ],
                         )
                     )
         # 3. Step: update fields:
-        patch_operation = [
-            {
-                "op": "set",
-                "path": f"/indices/{index_idx}/categories/{current_cat_idx}/name_de",
-                "value": category.name_de,
-            },
-            {
-                "op": "set",
-                "path": f"/indices/{index_idx}/categories/{current_cat_idx}/name_en",
-                "value": category.name_en,
-            },
-            {
-                "op": "set",
-                "path": f"/indices/{index_idx}/categories/{current_cat_idx}/description_de",
-                "value": category.description_de,
-            },
-            {
-                "op": "set",
-                "path": f"/indices/{index_idx}/categories/{current_cat_idx}/description_en",
-                "value": category.description_en,
-            },
-            {
-                "op": "set",
-                "path": f"/indices/{index_idx}/categories/{current_cat_idx}/system_prompt",
-                "value": category.system_prompt,
-            },
-            {
-                "op": "set",
-                "path": f"/indices/{index_idx}/categories/{current_cat_idx}/temperature",
-                "value": category.temperature,
-            },
-            {
-                "op": "set",
-                "path": f"/indices/{index_idx}/categories/{current_cat_idx}/model",
-                "value": category.model,
-            },
-        ]
-        patched_items = await self.__patch_db(
-            usecasetype_id=usecasetype_id, patch=patch_operation
+        def build_field_patch(
+            definition: UsecaseDefinition, index_idx: int, current_cat_idx: int
+        ) -> List[Dict[str, Any]]:
+            return [
+                {
+                    "op": "set",
+                    "path": f"/indices/{index_idx}/categories/{current_cat_idx}/name_de",
+                    "value": category.name_de,
+                },
+                {
+                    "op": "set",
+                    "path": f"/indices/{index_idx}/categories/{current_cat_idx}/name_en",
+                    "value": category.name_en,
+                },
+                {
+                    "op": "set",
+                    "path": f"/indices/{index_idx}/categories/{current_cat_idx}/description_de",
+                    "value": category.description_de,
+                },
+                {
+                    "op": "set",
+                    "path": f"/indices/{index_idx}/categories/{current_cat_idx}/description_en",
+                    "value": category.description_en,
+                },
+                {
+                    "op": "set",
+                    "path": f"/indices/{index_idx}/categories/{current_cat_idx}/system_prompt",
+                    "value": category.system_prompt,
+                },
+                {
+                    "op": "set",
+                    "path": f"/indices/{index_idx}/categories/{current_cat_idx}/temperature",
+                    "value": category.temperature,
+                },
+                {
+                    "op": "set",
+                    "path": f"/indices/{index_idx}/categories/{current_cat_idx}/model",
+                    "value": category.model,
+                },
+            ]
+
+        await self.__report(progress, "update_fields")
+        definition = await self.__patch_category(
+            usecasetype_id=usecasetype_id,
+            index_id=index_id,
+            category_id=category.id,
+            build_patch=build_field_patch,
         )
-        categories = [
-            create_dataclass_from_dict(CategoryCosmosDBModel, item)
-            for item in patched_items["indices"][index_idx]["categories"]
-        ]
-        return categories
+        # files, prompts or the model may have changed
+        await self.__invalidate_answers(category.id)
+        return self.__categories_of_index(definition, index_id)
 
     async def __create_cognitivesearch_document(
         self, files_as_sections, file_names, file_ids, category_id
     ):
+        sections = [
+            (i, content, page_num)
+            for i, file_as_sections in enumerate(files_as_sections)
+            for content, page_num in file_as_sections
+        ]
+        embeddings: List[Union[List[float], None]] = [None] * len(sections)
+        if current_app.config["USE_EMBEDDINGS"]:
+            document_embedding_service: DocumentEmbeddingService = current_app.config[
+                CONFIG_DOCUMENT_EMBEDDING_SERVICE
+            ]
+            embeddings = await document_embedding_service.embed(
+                [content for _, content, _ in sections]
+            )  # type: ignore
+        ctx = self.__index_context
         files_sections: List[Dict] = []
-        for i, file_as_sections in enumerate(files_as_sections):
-            file_sections: List[Dict] = []
-            for content, page_num in file_as_sections:
-                file_name = file_names[i]
-                file_id = file_ids[i]
-                embd: Union[List[float], None] = None
-                if current_app.config["USE_EMBEDDINGS"]:
-                    embd = await self.__create_embeddings(input=content)
-                ctx = CognitiveSearchIndexStrategyProvider.get_context(
-                    current_app.config["AZURE_SEARCH_INDEX"]
-                )
-                model = ctx.create_index_model(
-                    id=f"{file_id}-page-{page_num}-{str(uuid.uuid1())}",
-                    content=content,
-                    category_id=category_id,
-                    sourcepage=f"{os.path.splitext(os.path.basename(file_name))[0]}-{page_num}.pdf",
-                    sourcefile=file_name,
-                    embedding=embd,
-                )
-                single_section = model.jsonify()
-                file_sections.append(single_section)
-            files_sections.extend(file_sections)
+        for (i, content, page_num), embd in zip(sections, embeddings):
+            file_name = file_names[i]
+            file_id = file_ids[i]
+            model = ctx.create_index_model(
+                id=f"{file_id}-page-{page_num}-{str(uuid.uuid1())}",
+                content=content,
+                category_id=category_id,
+                sourcepage=f"{os.path.splitext(os.path.basename(file_name))[0]}-{page_num}.pdf",
+                sourcefile=file_name,
+                embedding=embd,
+            )
+            files_sections.append(model.jsonify())
         return files_sections
 
     async def post(
@@ -466,56 +522,62 @@ class CategoryService(UsecaseService):
         category: CategoryModel,
         usecasetype_id: str,
         index_id: str,
-        index_idx: int,
+        progress: Progress = None,
     ) -> List[CategoryCosmosDBModel]:
+        await self.__report(progress, "upload_and_analyze")
         fr_service = FormRecognizerService()
         blob_service = BlobService()
-        async with asyncio.TaskGroup() as tg:
-            blob_uploads: List[asyncio.Task[Tuple[BlobClient, List[BlobClient]]]] = []
-            fr_analyzes: List[asyncio.Task[PREBUILTLAYOUT]] = []
-            file_ids: List[str] = []
-            file_names: List[str] = []
-            for file in category.files:
-                file_names.append(file.name)
-                if isinstance(file.data, str):
-                    filemanagement_service = FileManagementService(
-                        StrFileManagementStrategy()
-                    )
-                else:
-                    filemanagement_service = FileManagementService(
-                        ByteFileManagementStrategy()
+        # the file handles of blob uploads and analyzes are closed once both are done
+        with ExitStack() as file_handles:
+            async with asyncio.TaskGroup() as tg:
+                blob_uploads: List[
+                    asyncio.Task[Tuple[BlobClient, List[BlobClient]]]
+                ] = []
+                fr_analyzes: List[asyncio.Task[PREBUILTLAYOUT]] = []
+                file_ids: List[str] = []
+                file_names: List[str] = []
+                for file in category.files:
+                    file_names.append(file.name)
+                    filemanagement_service = FileManagementService.for_file(file)
+                    filestrat_instance = file_handles.enter_context(
+                        await filemanagement_service.process_file_offloaded(
+                            file, self.__cpu_executor
+                        )
                     )
-                filestrat_instance = filemanagement_service.process_file(file)
-                file_ids.append(filestrat_instance.file_id)
+                    file_ids.append(filestrat_instance.file_id)
 
-                files_for_blob_upload = filestrat_instance._to_model(
-                    index_id, category.id
-                )
-                blob_upload: asyncio.Task[
-                    Tuple[BlobClient, List[BlobClient]]
-                ] = tg.create_task(
-                    blob_service.bulk_upload(
-                        files_for_blob_upload, container=self._STORAGE_CONTAINER
+                    files_for_blob_upload = filestrat_instance._to_model(
+                        index_id, category.id
                     )
-                )
-                fr_analyze: asyncio.Task[PREBUILTLAYOUT] = tg.create_task(
-                    fr_service.analyze_document(
-                        PREBUILTLAYOUT, filestrat_instance.file_bytes
+                    blob_upload: asyncio.Task[
+                        Tuple[BlobClient, List[BlobClient]]
+                    ] = tg.create_task(
+                        blob_service.bulk_upload(
+                            files_for_blob_upload, container=self._STORAGE_CONTAINER
+                        )
                     )
-                )
-                blob_uploads.append(blob_upload)
-                fr_analyzes.append(fr_analyze)
+                    fr_analyze: asyncio.Task[PREBUILTLAYOUT] = tg.create_task(
+                        fr_service.analyze_document(
+                            PREBUILTLAYOUT, filestrat_instance.open_file()
+                        )
+                    )
+                    blob_uploads.append(blob_upload)
+                    fr_analyzes.append(fr_analyze)
         blob_upload_result = [_blob_upload.result() for _blob_upload in blob_uploads]
         fr_analyze_result = [_fr_analyze.result() for _fr_analyze in fr_analyzes]
-        page_maps: List[List[Tuple[int, int, str]]] = [
-            FormRecognizerTextManagementService.convert_text(fr_analyze_result_)
-            for fr_analyze_result_ in fr_analyze_result
-        ]
-        files_as_sections: List[List[Tuple[str, int]]] = [
-            FormRecognizerTextManagementService.split_text(page_map)
-            for page_map in page_maps
-        ]
+        await self.__report(progress, "split")
+        files_as_sections: List[List[Tuple[str, int]]] = await asyncio.gather(
+            *(
+                self.__cpu_executor.run(
+                    analyze_result_to_sections,
+                    fr_analyze_result_,
+                    self.__index_context.section_splitter,
+                )
+                for fr_analyze_result_ in fr_analyze_result
+            )
+        )
 
+        await self.__report(progress, "embed")
         files_sections = await self.__create_cognitivesearch_document(
             files_as_sections=files_as_sections,
             file_names=file_names,
@@ -549,27 +611,95 @@ class CategoryService(UsecaseService):
             model=category.model,
             files=files,
         )
+        await self.__report(progress, "index")
+        # Appending is not guarded by the etag: concurrent category posts to the same index all append safely.
+        # The index position is resolved from a fresh read right before the patch instead.
+        definition = await self._definitions.get(usecasetype_id, refresh=True)
         patch_operation = [
             {
                 "op": "add",
-                "path": f"/indices/{index_idx}/categories/-",
+                "path": f"/indices/{definition.index_position(index_id)}/categories/-",
                 "value": category_model.jsonify(),
             }
         ]
         async with asyncio.TaskGroup() as tg:
             tg.create_task(CognitiveSearchService().batch_index(files_sections))
-            patched_item = tg.create_task(
-                CosmosDBService(
-                    database=self._DATABASE, container=self._CONTAINER
-                ).patch(
-                    item_id=usecasetype_id,
-                    partition_key=usecasetype_id,
-                    patch=patch_operation,
+            patched_definition = tg.create_task(
+                self.__patch_db(usecasetype_id=usecasetype_id, patch=patch_operation)
+            )
+        return self.__categories_of_index(patched_definition.result(), index_id)
+
+    async def submit(
+        self,
+        kind: str,
+        category: CategoryModel,
+        usecasetype_id: str,
+        index_id: str,
+        owner: str,
+    ) -> IngestionJob:
+        """Queues a post or put of a category as ingestion job. The file contents are stored as attachments of
+        the job, the rest of the category as its payload.
+
+        Raises:
+            NotFoundError: the index of a post or the category of a put does not exist. No job is created then.
+        """
+        definition = await self._definitions.get(usecasetype_id, refresh=True)
+        if kind == JOB_POST_CATEGORY:
+            definition.index_position(index_id)
+        else:
+            definition.category_position(index_id, category.id)
+        job_service: IngestionJobService = current_app.config[CONFIG_INGESTION_JOB_SERVICE]
+        category_dict = category.jsonify()
+        attachments: Attachments = {}
+        for file in category_dict["files"]:
+            attachments[file["id"]] = file.pop("data")
+        return await job_service.submit(
+            kind=kind,
+            owner=owner,
+            payload={
+                "usecasetype_id": usecasetype_id,
+                "index_id": index_id,
+                "category": category_dict,
+            },
+            attachments=attachments,
+            stages=self.INGESTION_STAGES,
+        )
+
+    @classmethod
+    async def run_job(
+        cls,
+        kind: str,
+        payload: Dict[str, Any],
+        attachments: Attachments,
+        progress: Progress,
+    ) -> List[Dict[str, Any]]:
+        """Runs a category ingestion job queued by submit and returns the categories of the index"""
+        category_dict = payload["category"]
+        for file in category_dict["files"]:
+            file["data"] = attachments[file["id"]]
+        category = create_dataclass_from_dict(CategoryModel, category_dict)
+        service = cls()
+        if kind == JOB_POST_CATEGORY:
+            definition = await service._definitions.get(
+                payload["usecasetype_id"], refresh=True
+            )
+            if definition.has_category(payload["index_id"], category.id):
+                # an earlier attempt got through before the job was interrupted
+                categories = service.__categories_of_index(
+                    definition, payload["index_id"]
+                )
+            else:
+                categories = await service.post(
+                    category=category,
+                    usecasetype_id=payload["usecasetype_id"],
+                    index_id=payload["index_id"],
+                    progress=progress,
                 )
+        else:
+            categories = await service.put(
+                category=category,
+                usecasetype_id=payload["usecasetype_id"],
+                index_id=payload["index_id"],
+                progress=progress,
             )
-        patched_items = patched_item.result()
-        categories = [
-            create_dataclass_from_dict(CategoryCosmosDBModel, item)
-            for item in patched_items["indices"][index_idx]["categories"]
-        ]
-        return categories
+        return [c.jsonify() for c in categories]
@@ -1,12 +1,23 @@
+import asyncio
+import logging
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Any, Dict, List, NewType
-import uuid
-from customerrors import ConversationNotFoundError
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from azure.cosmos.exceptions import (
+    CosmosHttpResponseError,
+    CosmosResourceExistsError,
+    CosmosResourceNotFoundError,
+)
+from customerrors import ConversationNotFoundError, InvalidQueryParameterError
 
 from services.CosmosDBService import CosmosDBService
 from utils import create_dataclass_from_dict
 
+ITEM_TYPE_CONVERSATION = "conversation"
+ITEM_TYPE_TURN = "turn"
+
 
 @dataclass
 class ConversationModel:
@@ -19,10 +30,51 @@ class ChatHistoryService:
     """
     For interacting with the ChatHistory.
 
+    The chat histories are stored in a container partitioned by `userId`, with one item per conversation and one
+    item per turn, so reading, appending to or listing the conversations of a user never touches the other
+    conversations and no item grows with the number of conversations:
+
+    ```python
+    {
+        "id": "<category_id>_<conversation_id>",
+        "type": "conversation",
+        "userId": "...",
+        "category_id": "...",
+        "conversation_id": "...",
+        "topic": "first question",
+        "timestamp": 1690000000,  # creation time in seconds
+    }
+    {
+        "id": "<category_id>_<conversation_id>_<created>",
+        "type": "turn",
+        "userId": "...",
+        "category_id": "...",
+        "conversation_id": "...",
+        "created": 1690000000000000000,  # creation time in nanoseconds, orders the turns
+        "history": [{"user": "some question?"}, {"answer": "some answer", ...}],
+    }
+    ```
+
+    setup/cosmos/migrate_chat_history.py migrates the previous layout of one document per user and category.
     """
 
     _DATABASE = "User"
-    _CONTAINER = "ChatHistory"
+    _CONTAINER = "Conversations"
+
+    @staticmethod
+    def _service() -> CosmosDBService:
+        return CosmosDBService(
+            ChatHistoryService._DATABASE, ChatHistoryService._CONTAINER
+        )
+
+    @staticmethod
+    def conversation_item_id(category_id: str, conversation_id: str) -> str:
+        return f"{category_id}_{conversation_id}"
+
+    @staticmethod
+    def turn_item_id(category_id: str, conversation_id: str, created: int) -> str:
+        # zero padded, so the ids of the turns of a conversation sort like their creation
+        return f"{ChatHistoryService.conversation_item_id(category_id, conversation_id)}_{created:020d}"
 
     @staticmethod
     def to_chat_history_model(items: List[Dict]) -> List[ConversationModel]:
@@ -51,27 +103,38 @@ class ChatHistoryService:
         return [create_dataclass_from_dict(ConversationModel, item) for item in items]
 
     @staticmethod
-    async def delete_chat_history_by_category(category_id: str):
-        """Deletes a chathistory document from the cosmosdb by a given category_id (reference_id)
+    async def delete_chat_history_by_category(
+        category_id: str, progress: Optional[Callable[[int, int], None]] = None
+    ) -> int:
+        """Deletes the conversations and turns of all users in a category. Only the ids and partition keys of the
+        items are queried, the deletes run with bounded concurrency (see CosmosDBService@bulk_delete).
 
         Args:
             category_id (str): the category_id
+            progress (Callable[[int, int], None], optional): called with the number of deleted items and the total
+                number of items after every deleted item
+
+        Returns:
+            int: the number of deleted items
         """
-        cdb_service = CosmosDBService(
-            ChatHistoryService._DATABASE, ChatHistoryService._CONTAINER
-        )
+        cdb_service = ChatHistoryService._service()
         items = await cdb_service.query(
-            query=f"Select * from {ChatHistoryService._CONTAINER} c where c.category_id = @category_id",
+            query=f"SELECT c.id, c.userId FROM {ChatHistoryService._CONTAINER} c where c.category_id = @category_id",
             params=[{"name": "@category_id", "value": category_id}],
         )
-        item_ids = list(map(lambda item: item["id"], items))
-        partition_keys = item_ids
-        await cdb_service.bulk_delete(item_ids=item_ids, partition_keys=partition_keys)
+        deleted = await cdb_service.bulk_delete(
+            item_ids=[item["id"] for item in items],
+            partition_keys=[item["userId"] for item in items],
+            progress=progress,
+        )
+        logging.info(f"Deleted {deleted} chat history items of category {category_id}")
+        return deleted
 
     @staticmethod
     async def delete_conversation(user_id: str, category_id: str, conversation_id: str):
         """
-        Deletes a conversation in a cosmosdb chathistory document. The documents are filtered by user_id, category_id and conversation_id.
+        Deletes a conversation and its turns. The conversation is identified by user_id, category_id and
+        conversation_id.
 
         Args:
             user_id (str): id of the user
@@ -81,41 +144,30 @@ class ChatHistoryService:
         Raises:
             ConversationNotFoundError: Conversation could not be found
         """
-        cdb_service = CosmosDBService(
-            ChatHistoryService._DATABASE, ChatHistoryService._CONTAINER
+        cdb_service = ChatHistoryService._service()
+        conversation_item_id = ChatHistoryService.conversation_item_id(
+            category_id, conversation_id
         )
-        items = await cdb_service.query(
-            query=f"SELECT * from {ChatHistoryService._CONTAINER} c where c.userId = @user_id and c.category_id = @category_id",
+        try:
+            await cdb_service.read(item_id=conversation_item_id, partition_key=user_id)
+        except CosmosResourceNotFoundError:
+            raise ConversationNotFoundError(
+                f"Conversation with id {conversation_id} does not exist"
+            )
+        turns = await cdb_service.query(
+            query=f"SELECT c.id FROM {ChatHistoryService._CONTAINER} c where c.type = '{ITEM_TYPE_TURN}' and c.category_id = @category_id and c.conversation_id = @conversation_id",
             params=[
-                {"name": "@user_id", "value": user_id},
                 {"name": "@category_id", "value": category_id},
+                {"name": "@conversation_id", "value": conversation_id},
             ],
+            partition_key=user_id,
         )
-        if not items or items is None:
-            raise ConversationNotFoundError(
-                f"Could not find conversation with id {conversation_id}"
-            )
-        item = items[0]
-        item_id = item["id"]
-        partition_key = item["id"]
-        conversation_idx, conversation = next(
-            (
-                (i, itm)
-                for i, itm in enumerate(item["histories"])
-                if itm["conversation_id"] == conversation_id
-            ),
-            (None, None),
+        # the conversation goes first, so a partly deleted conversation is no longer listed
+        await cdb_service.delete(item_id=conversation_item_id, partition_key=user_id)
+        await cdb_service.bulk_delete(
+            item_ids=[turn["id"] for turn in turns],
+            partition_keys=[user_id] * len(turns),
         )
-        if conversation_idx is not None:
-            await cdb_service.patch(
-                item_id=item_id,
-                partition_key=partition_key,
-                patch=[{"op": "remove", "path": f"/histories/{conversation_idx}"}],
-            )
-        else:
-            raise ConversationNotFoundError(
-                f"Conversation with id {conversation_id} does not exist"
-            )
 
     @staticmethod
     async def get_conversation(
@@ -144,22 +196,19 @@ class ChatHistoryService:
                 }
             ```
         """
-        cdb_service = CosmosDBService(
-            ChatHistoryService._DATABASE, ChatHistoryService._CONTAINER
-        )
-        items = await cdb_service.query(
-            query=f"SELECT t.history FROM {ChatHistoryService._CONTAINER} c JOIN t in c.histories where c.userId = @user_id and c.category_id = @category_id and t.conversation_id = @conversation_id ",
+        turns = await ChatHistoryService._service().query(
+            query=f"SELECT c.history FROM {ChatHistoryService._CONTAINER} c where c.type = '{ITEM_TYPE_TURN}' and c.category_id = @category_id and c.conversation_id = @conversation_id ORDER BY c.created",
             params=[
-                {"name": "@user_id", "value": user_id},
                 {"name": "@category_id", "value": category_id},
                 {"name": "@conversation_id", "value": conversation_id},
             ],
+            partition_key=user_id,
         )
-        if not items or items is None:
+        if not turns:
             raise ConversationNotFoundError(
                 f"Could not find conversation with id: {conversation_id}"
             )
-        return items[0]
+        return {"history": [entry for turn in turns for entry in turn["history"]]}
 
     @staticmethod
     async def get_conversation_details(
@@ -175,61 +224,106 @@ class ChatHistoryService:
         Returns:
             ConversationModel:
         """
-        cdb_service = CosmosDBService(
-            ChatHistoryService._DATABASE, ChatHistoryService._CONTAINER
-        )
-        items = await cdb_service.query(
-            query=f"SELECT t.conversation_id, t.topic, t.timestamp FROM {ChatHistoryService._CONTAINER} c JOIN t in c.histories where c.userId = @user_id and c.category_id = @category_id and t.conversation_id = @conversation_id ",
-            params=[
-                {"name": "@user_id", "value": user_id},
-                {"name": "@category_id", "value": category_id},
-                {"name": "@conversation_id", "value": conversation_id},
-            ],
+        item = await ChatHistoryService._service().read(
+            item_id=ChatHistoryService.conversation_item_id(
+                category_id, conversation_id
+            ),
+            partition_key=user_id,
         )
-        return ChatHistoryService.to_chat_history_model(items)[0]
+        return ChatHistoryService.to_chat_history_model([item])[0]
+
+    @staticmethod
+    def _histories_query(newest_first: bool) -> str:
+        order = "DESC" if newest_first else "ASC"
+        return f"SELECT c.conversation_id, c.timestamp, c.topic from {ChatHistoryService._CONTAINER} c where c.type = '{ITEM_TYPE_CONVERSATION}' and c.category_id = @category_id ORDER BY c.timestamp {order}"
 
     @staticmethod
     async def get_all_histories(
-        user_id: str, category_id: str
+        user_id: str, category_id: str, newest_first: bool = False
     ) -> List[ConversationModel]:
-        """Retrieves all chathistories from cosmosdb, filtered by user and category
+        """Retrieves all chathistories from cosmosdb, filtered by user and category.
+        Only the conversation items of the partition of the user are read, and only the listed fields of them.
 
         Args:
             user_id (str): id of the user
             category_id (str): id of the category
+            newest_first (bool): newest conversation first instead of oldest first
 
         Returns:
-            List[ConversationModel]:
+            List[ConversationModel]: sorted by timestamp
         """
-        cdb_service = CosmosDBService(
-            ChatHistoryService._DATABASE, ChatHistoryService._CONTAINER
-        )
-        items = await cdb_service.query(
-            query=f"SELECT c.histories from {ChatHistoryService._CONTAINER} c where c.userId = @user_id and c.category_id = @category_id",
-            params=[
-                {"name": "@user_id", "value": user_id},
-                {"name": "@category_id", "value": category_id},
-            ],
+        items = await ChatHistoryService._service().query(
+            query=ChatHistoryService._histories_query(newest_first),
+            params=[{"name": "@category_id", "value": category_id}],
+            partition_key=user_id,
         )
-        if items:
-            chat_history_models = ChatHistoryService.to_chat_history_model(
-                items[0]["histories"]
+        return ChatHistoryService.to_chat_history_model(items)
+
+    @staticmethod
+    async def get_histories_page(
+        user_id: str,
+        category_id: str,
+        limit: int,
+        continuation_token: Optional[str] = None,
+        newest_first: bool = False,
+    ) -> Tuple[List[ConversationModel], Optional[str]]:
+        """Retrieves a page of the chathistories of get_all_histories. Only the page is read, so the cost depends on
+        `limit` and not on the number of conversations of the user.
+
+        Args:
+            user_id (str): id of the user
+            category_id (str): id of the category
+            limit (int): maximum number of conversations of the page
+            continuation_token (Optional[str]): token of the previous page, None for the first page
+            newest_first (bool): newest conversation first instead of oldest first, the same for all pages
+
+        Returns:
+            Tuple[List[ConversationModel], Optional[str]]: the conversations and the continuation token of the next
+            page, None for the last page
+
+        Raises:
+            InvalidQueryParameterError: the continuation token was not issued for this listing
+        """
+        try:
+            items, next_token = await ChatHistoryService._service().query_page(
+                query=ChatHistoryService._histories_query(newest_first),
+                max_item_count=limit,
+                params=[{"name": "@category_id", "value": category_id}],
+                partition_key=user_id,
+                continuation_token=continuation_token,
+            )
+        except CosmosHttpResponseError as e:
+            if continuation_token is None or e.status_code != 400:
+                raise
+            raise InvalidQueryParameterError(
+                f"Invalid continuation token: {continuation_token}", 400
             )
-        else:
-            chat_history_models = []
-        return chat_history_models
+        return ChatHistoryService.to_chat_history_model(items), next_token
 
     @staticmethod
     async def add_to_history(
-        user_id: str, category_id: str, conversation_id: str, history: List[Dict]
-    ) -> None:
-        """Adds a history to a conversation.
+        user_id: str,
+        category_id: str,
+        conversation_id: str,
+        history: List[Dict],
+        new_conversation: bool = False,
+    ) -> Optional[ConversationModel]:
+        """Adds a history to a conversation as a new turn.
+
+        Appending a turn is a single create of the turn item: turns never modify a shared item, so concurrent turns
+        need no concurrency control and cannot conflict. For a new conversation the conversation item is created at
+        the same time, in a second request that runs concurrently, and its details are returned from the response of
+        that create.
 
         Args:
             user_id (str): user id
             category_id (str): category id
             conversation_id (str): conversation id
             history (List[Dict]): history in the format as given in the example. It might be different as well, based on the usecase but keep in mind that the frontend expects this kind of format
+            new_conversation (bool): whether this is the first turn of the conversation, which creates the conversation
+
+        Returns:
+            Optional[ConversationModel]: the details of a new conversation, None otherwise
 
         Example:
             ```python
@@ -246,158 +340,93 @@ class ChatHistoryService:
             ChatHistoryService.add_to_history(user_id, category_id, conversation_id, history)
             ```
         """
-        item = await ChatHistoryService.get_user_history_document(
-            user_id=user_id, category_id=category_id
-        )
-        if not item:
-            item = await ChatHistoryService.create_new_user_history_document(
-                user_id=user_id,
-                category_id=category_id,
-                conversation_id=conversation_id,
-                history=history,
+        add_turn = ChatHistoryService._service().create_item(
+            body=ChatHistoryService.turn_item(
+                user_id, category_id, conversation_id, history
             )
-            return
-        item = item[0]
-        id = item["id"]
-        partition_key = item["id"]  # item["userId"]
-
-        conversation_idx, conversation = next(
-            (
-                (i, itm)
-                for i, itm in enumerate(item["histories"])
-                if itm["conversation_id"] == conversation_id
-            ),
-            (None, None),
-        )
-
-        if conversation_idx is None:
-            await ChatHistoryService.create_new_conversation(
-                item_id=id,
-                partition_key=partition_key,
-                conversation_id=conversation_id,
-                history=history,
-            )
-            return
-
-        cdb_service = CosmosDBService(
-            ChatHistoryService._DATABASE, ChatHistoryService._CONTAINER
         )
-        item = await cdb_service.patch(
-            item_id=id,
-            partition_key=partition_key,
-            patch=[
-                {
-                    "op": "add",
-                    "path": f"/histories/{conversation_idx}/history/-",
-                    "value": history_entry,
-                }
-                for history_entry in history
-            ],
+        if not new_conversation:
+            await add_turn
+            return None
+        _, conversation = await asyncio.gather(
+            add_turn,
+            ChatHistoryService.create_conversation(
+                ChatHistoryService.conversation_item(
+                    user_id, category_id, conversation_id, history
+                )
+            ),
         )
-        return
+        return ChatHistoryService.to_chat_history_model([conversation])[0]
 
     @staticmethod
-    async def get_user_history_document(
-        user_id: str, category_id: str
-    ) -> List[Dict[str, Any]]:
-        """Gets all ChatHIstories from cosmosdb filtered by user_id and category_id
-
-        Args:
-            user_id (str): user id
-            category_id (str): category id
-
-        Returns:
-            List[Dict[str, Any]]:
-        """
-        cdb_service = CosmosDBService(
-            ChatHistoryService._DATABASE, ChatHistoryService._CONTAINER
-        )
-        item = await cdb_service.query(
-            query=f"Select * from {ChatHistoryService._CONTAINER} c where c.userId = @user_id and c.category_id = @category_id",
-            params=[
-                {"name": "@user_id", "value": user_id},
-                {"name": "@category_id", "value": category_id},
-            ],
-        )
-        return item
+    def turn_item(
+        user_id: str,
+        category_id: str,
+        conversation_id: str,
+        history: List[Dict],
+        created: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """Builds the turn item of a history, created now unless `created` (in nanoseconds) is given"""
+        if created is None:
+            created = time.time_ns()
+        return {
+            "id": ChatHistoryService.turn_item_id(
+                category_id, conversation_id, created
+            ),
+            "type": ITEM_TYPE_TURN,
+            "userId": user_id,
+            "category_id": category_id,
+            "conversation_id": conversation_id,
+            "created": created,
+            "history": history,
+        }
 
     @staticmethod
-    async def create_new_user_history_document(
+    def conversation_item(
         user_id: str, category_id: str, conversation_id: str, history: List[Dict]
-    ) -> Dict:
-        """Creates a new entry in a specific ChatHistory document in cosmosdb.
+    ) -> Dict[str, Any]:
+        """Builds the conversation item of a conversation that starts with history, created now"""
+        return {
+            "id": ChatHistoryService.conversation_item_id(category_id, conversation_id),
+            "type": ITEM_TYPE_CONVERSATION,
+            "userId": user_id,
+            "category_id": category_id,
+            "conversation_id": conversation_id,
+            "topic": ChatHistoryService.generate_topic(
+                history
+            ),  # TODO: Replace with dynamically generated topic
+            "timestamp": int(datetime.now().timestamp()),
+        }
+
+    @staticmethod
+    async def create_conversation(conversation: Dict[str, Any]) -> Dict[str, Any]:
+        """Creates a conversation item, unless the conversation exists already (e.g. for a repeated first turn).
 
         Args:
-            user_id (str): user id
-            category_id (str): category id
-            conversation_id (str): conversation id
-            history (List[Dict]): history (same as in ChatHistoryService@add_to_history)
+            conversation (Dict[str, Any]): the item, see ChatHistoryService@conversation_item
 
         Returns:
-            Dict:
+            Dict[str, Any]: the stored conversation item
         """
-        cdb_service = CosmosDBService(
-            ChatHistoryService._DATABASE, ChatHistoryService._CONTAINER
-        )
-        new_item = await cdb_service.create_item(
-            body={
-                "id": str(uuid.uuid4()),
-                "userId": user_id,
-                "category_id": category_id,
-                "histories": [
-                    {
-                        "conversation_id": conversation_id,
-                        "topic": ChatHistoryService.generate_topic(
-                            history
-                        ),  # TODO: Replace with dynamically generated topic
-                        "timestamp": int(datetime.now().timestamp()),
-                        "history": history,
-                    }
-                ],
-            }
-        )
-        return new_item
+        cdb_service = ChatHistoryService._service()
+        try:
+            return await cdb_service.create_item(body=conversation)
+        except CosmosResourceExistsError:
+            return await cdb_service.read(
+                item_id=conversation["id"], partition_key=conversation["userId"]
+            )
 
     @staticmethod
-    async def create_new_conversation(
-        item_id: str,
-        partition_key: str,
-        conversation_id: str,
-        history: List[Dict],
-    ) -> Dict[str, Any]:
-        """Creates a new conversation in a specific ChatHistory document in cosmosdb
+    async def create_turn(turn: Dict[str, Any]) -> None:
+        """Creates a turn item. A turn that exists already was created by an earlier attempt and is kept.
 
         Args:
-            item_id (str): id of document in cosmosdb
-            partition_key (str): partitionkey of document in cosmosdb
-            conversation_id (str): conversation id
-            history (List[Dict]): history (same as in ChatHistory@add_to_history)
-
-        Returns:
-            Dict[str, Any]:
+            turn (Dict[str, Any]): the item, see ChatHistoryService@turn_item
         """
-        cdb_service = CosmosDBService(
-            ChatHistoryService._DATABASE, ChatHistoryService._CONTAINER
-        )
-        item = await cdb_service.patch(
-            item_id=item_id,
-            partition_key=partition_key,
-            patch=[
-                {
-                    "op": "add",
-                    "path": f"/histories/-",
-                    "value": {
-                        "conversation_id": conversation_id,
-                        "topic": ChatHistoryService.generate_topic(
-                            history
-                        ),  # TODO: Replace with dynamically generated topic
-                        "timestamp": int(datetime.now().timestamp()),
-                        "history": history,
-                    },
-                }
-            ],
-        )
-        return item
+        try:
+            await ChatHistoryService._service().create_item(body=turn)
+        except CosmosResourceExistsError:
+            pass
 
     @staticmethod
     def generate_topic(history: List[Dict]):
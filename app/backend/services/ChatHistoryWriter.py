@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from tenacity import (
+    AsyncRetrying,
+    RetryCallState,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+
+from core.retryafter import (
+    RETRY_AFTER_MILLISECONDS,
+    wait_retry_after_or_exponential,
+)
+from services.ChatHistoryService import ChatHistoryService, ConversationModel
+from services.CosmosDBService import is_transient
+
+
+class ChatHistoryWriter:
+    """
+    Writes the turns of the chat history behind the answer (write-behind), so the latency of cosmos db does not add
+    to the latency of the chat endpoints.
+
+    add_to_history queues the turn item and returns right away. The first turn of a new conversation creates the
+    conversation item before that, so the conversation details in the response always belong to a stored
+    conversation, and a turn is only queued once its conversation exists. The turns are queued per user, the
+    partition they are stored in, and one writer task per user writes everything queued for that user as a batch,
+    then the next batch. Within a batch, the turns of one conversation are written one after the other in the order
+    they were added, different conversations concurrently. Transient errors are retried after the time a throttled
+    response asks for or with exponential backoff, turns that still cannot be written are logged and dropped.
+
+    At most `max_pending` turns are queued at a time, add_to_history waits for a free place beyond that
+    (backpressure). stop() writes the queued turns before the worker exits, for at most `stop_timeout` seconds, which
+    has to be shorter than the graceful timeout of gunicorn.
+
+    The queue lives in the worker process. flushed(user_id) makes a user read their own writes within that
+    process, but a request served by another gunicorn worker may miss the turns that are still queued here, for
+    about the time of one write. Turns still queued when a worker crashes or is killed are lost; conversations are
+    not, as they are written before the answer is returned.
+
+    Example:
+        ```python
+        writer = ChatHistoryWriter()
+        await writer.start(app)
+        details = await writer.add_to_history(user_id, category_id, conversation_id, history, new_conversation=True)
+        await writer.stop()
+        ```
+    """
+
+    DEFAULT_MAX_PENDING = 1000
+    DEFAULT_CONCURRENCY = 8
+    DEFAULT_MAX_ATTEMPTS = 5
+    DEFAULT_MAX_WAIT = 10.0
+    # below the default graceful timeout of gunicorn (30 seconds)
+    DEFAULT_STOP_TIMEOUT = 20.0
+
+    def __init__(
+        self,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        max_wait: float = DEFAULT_MAX_WAIT,
+        stop_timeout: float = DEFAULT_STOP_TIMEOUT,
+    ):
+        self.max_pending = max_pending
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.max_wait = max_wait
+        self.stop_timeout = stop_timeout
+        self._queued: Dict[str, List[Dict[str, Any]]] = {}
+        self._writers: Dict[str, asyncio.Task] = {}
+        self._places = asyncio.Semaphore(max_pending)
+        self._app = None
+        self._stopped = False
+        self.pending = 0
+        self.peak_pending = 0
+        self.throttled = 0
+        self.submitted = 0
+        self.batches = 0
+        self.written = 0
+        self.retries = 0
+        self.failed = 0
+        self.write_seconds = 0.0
+
+    async def start(self, app=None) -> None:
+        """Items are written within an app context of `app`, if given."""
+        self._app = app
+        self._stopped = False
+
+    async def stop(self) -> None:
+        """Writes the queued items, waiting at most `stop_timeout` seconds. Later turns are written directly."""
+        self._stopped = True
+        writers = list(self._writers.values())
+        if not writers:
+            return
+        _, unfinished = await asyncio.wait(writers, timeout=self.stop_timeout)
+        for writer in unfinished:
+            writer.cancel()
+        if unfinished:
+            logging.error(
+                f"Gave up writing the chat history of {len(unfinished)} users, {self.pending} turns are lost"
+            )
+        await asyncio.gather(*writers, return_exceptions=True)
+
+    async def add_to_history(
+        self,
+        user_id: str,
+        category_id: str,
+        conversation_id: str,
+        history: List[Dict],
+        new_conversation: bool = False,
+    ) -> Optional[ConversationModel]:
+        """Queues a turn for ChatHistoryService@add_to_history and returns without waiting for it to be written.
+        For a new conversation, the conversation item is created first.
+
+        Returns:
+            Optional[ConversationModel]: the details of a new conversation, None otherwise. For a repeated first turn
+            these are the details of the stored conversation.
+        """
+        if self._stopped:
+            return await ChatHistoryService.add_to_history(
+                user_id, category_id, conversation_id, history, new_conversation
+            )
+        turn = ChatHistoryService.turn_item(
+            user_id, category_id, conversation_id, history
+        )
+        details = None
+        if new_conversation:
+            async for attempt in self._retrying():
+                with attempt:
+                    conversation = await ChatHistoryService.create_conversation(
+                        ChatHistoryService.conversation_item(
+                            user_id, category_id, conversation_id, history
+                        )
+                    )
+            details = ChatHistoryService.to_chat_history_model([conversation])[0]
+        if self._places.locked():
+            self.throttled += 1
+        await self._places.acquire()
+        self._queued.setdefault(user_id, []).append(turn)
+        self.submitted += 1
+        self.pending += 1
+        self.peak_pending = max(self.peak_pending, self.pending)
+        if user_id not in self._writers:
+            self._writers[user_id] = asyncio.create_task(self._write(user_id))
+        return details
+
+    async def flushed(self, user_id: str) -> None:
+        """Waits until the turns queued for a user so far are written"""
+        writer = self._writers.get(user_id)
+        if writer is not None:
+            await asyncio.shield(writer)
+
+    async def _write(self, user_id: str) -> None:
+        try:
+            # no await between the check for queued turns and the removal of the writer, so no turn is left behind
+            while self._queued.get(user_id):
+                batch = self._queued.pop(user_id)
+                self.batches += 1
+                start = time.perf_counter()
+                try:
+                    if self._app is not None:
+                        async with self._app.app_context():
+                            await self._write_batch(batch)
+                    else:
+                        await self._write_batch(batch)
+                finally:
+                    self.write_seconds += time.perf_counter() - start
+                    self.pending -= len(batch)
+                    for _ in batch:
+                        self._places.release()
+        finally:
+            del self._writers[user_id]
+
+    async def _write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        conversations: Dict[str, List[Dict[str, Any]]] = {}
+        for turn in batch:
+            key = ChatHistoryService.conversation_item_id(
+                turn["category_id"], turn["conversation_id"]
+            )
+            conversations.setdefault(key, []).append(turn)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def write_conversation(turns: List[Dict[str, Any]]) -> None:
+            async with semaphore:
+                for turn in turns:
+                    await self._write_turn(turn)
+
+        await asyncio.gather(
+            *(write_conversation(items) for items in conversations.values())
+        )
+
+    async def _write_turn(self, turn: Dict[str, Any]) -> None:
+        try:
+            async for attempt in self._retrying():
+                with attempt:
+                    await ChatHistoryService.create_turn(turn)
+        except Exception:
+            self.failed += 1
+            logging.exception(
+                f"Writing the chat history turn {turn['id']} of user {turn['userId']} failed"
+            )
+        else:
+            self.written += 1
+
+    def _retrying(self) -> AsyncRetrying:
+        return AsyncRetrying(
+            retry=retry_if_exception(is_transient),
+            wait=wait_retry_after_or_exponential(
+                wait_random_exponential(min=0.1, max=self.max_wait),
+                RETRY_AFTER_MILLISECONDS,
+            ),
+            stop=stop_after_attempt(self.max_attempts),
+            before_sleep=self._count_retry,
+            reraise=True,
+        )
+
+    def _count_retry(self, retry_state: RetryCallState) -> None:
+        self.retries += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "pending": self.pending,
+            "peak_pending": self.peak_pending,
+            "max_pending": self.max_pending,
+            "throttled": self.throttled,
+            "writers": len(self._writers),
+            "submitted": self.submitted,
+            "batches": self.batches,
+            "written": self.written,
+            "retries": self.retries,
+            "failed": self.failed,
+            "turns_per_batch": self.submitted / self.batches if self.batches else 0.0,
+            "seconds_per_batch": (
+                self.write_seconds / self.batches if self.batches else 0.0
+            ),
+        }
@@ -1,12 +1,43 @@
 import asyncio
-from typing import Any, Dict, List, Union
+from itertools import zip_longest
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
+from azure.core import MatchConditions
+from azure.core.exceptions import AzureError
+from azure.cosmos.exceptions import (
+    CosmosHttpResponseError,
+    CosmosResourceNotFoundError,
+)
 from quart import current_app
 from azure.cosmos.aio import CosmosClient
+from tenacity import (
+    AsyncRetrying,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+from core.retryafter import (
+    RETRY_AFTER_MILLISECONDS,
+    wait_retry_after_or_exponential,
+)
 from services.ABCAzureService import AbstractAzureService
 
 CONFIG_COSMOSDB_CLIENT = "cosmosdb_client"
 
+DEFAULT_DELETE_CONCURRENCY = 16
+DEFAULT_DELETE_ATTEMPTS = 5
+DEFAULT_MAX_WAIT = 10.0
+# status codes of cosmos db responses that may succeed when sent again
+TRANSIENT_STATUS_CODES = {408, 429, 449, 500, 502, 503, 504}
+
+
+def is_transient(exception: BaseException) -> bool:
+    """Whether a failed request to cosmos db is worth another attempt"""
+    if isinstance(exception, CosmosHttpResponseError):
+        return exception.status_code in TRANSIENT_STATUS_CODES
+    # connection errors and timeouts of the transport
+    return isinstance(exception, (AzureError, asyncio.TimeoutError))
+
 
 class CosmosDBService(AbstractAzureService):
     @property
@@ -28,24 +59,96 @@ class CosmosDBService(AbstractAzureService):
         self,
         query: str,
         params: Union[List[Dict[str, str]], None] = None,
+        partition_key: Union[str, None] = None,
     ):
-        aitems = self.container.query_items(query=query, parameters=params)
+        """
+        Runs a query, within a single partition if a partition key is given, otherwise across all partitions.
+        """
+        kwargs: Dict[str, Any] = {}
+        if partition_key is not None:
+            kwargs["partition_key"] = partition_key
+        aitems = self.container.query_items(query=query, parameters=params, **kwargs)
         items = [item async for item in aitems]
         return items
 
-    def read(self):
-        ...
+    async def query_page(
+        self,
+        query: str,
+        max_item_count: int,
+        params: Union[List[Dict[str, str]], None] = None,
+        partition_key: Union[str, None] = None,
+        continuation_token: Optional[str] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Runs a query like query(), but returns a single page of at most `max_item_count` results. Only that page is
+        requested from cosmos db.
+
+        Args:
+            query (str): the query
+            max_item_count (int): maximum number of results of the page
+            params (List[Dict[str, str]], optional): parameters of the query
+            partition_key (str, optional): runs the query within this partition
+            continuation_token (str, optional): continues after the page that returned this token
+
+        Returns:
+            Tuple[List[Dict[str, Any]], Optional[str]]: the results and the continuation token of the next page,
+            None for the last page
+        """
+        kwargs: Dict[str, Any] = {}
+        if partition_key is not None:
+            kwargs["partition_key"] = partition_key
+        pages = self.container.query_items(
+            query=query, parameters=params, max_item_count=max_item_count, **kwargs
+        ).by_page(continuation_token)
+        try:
+            page = await pages.__anext__()
+        except StopAsyncIteration:
+            return [], None
+        items = [item async for item in page]
+        return items, pages.continuation_token
+
+    async def read(self, item_id: str, partition_key: str, **kwargs) -> Dict[str, Any]:
+        """
+        Point read of a single item. Much cheaper than a query for the same item.
+
+        Args:
+            item_id (str): id of the item
+            partition_key (str): partition key of the item
+            kwargs: see ContainerProxy.read_item
+
+        Returns:
+            Dict[str, Any]: the item including its system properties (e.g. _etag)
+        """
+        item = await self.container.read_item(
+            item=item_id, partition_key=partition_key, **kwargs
+        )
+        return item
 
     async def patch(
-        self, item_id: str, partition_key: str, patch: List[Dict[str, Any]]
+        self,
+        item_id: str,
+        partition_key: str,
+        patch: List[Dict[str, Any]],
+        etag: Union[str, None] = None,
     ) -> Dict[str, Any]:
+        """
+        Patches an item. If an etag is given, the patch is only applied if the item has not been modified since,
+        otherwise azure.cosmos.exceptions.CosmosAccessConditionFailedError is raised.
+        """
+        kwargs: Dict[str, Any] = {}
+        if etag is not None:
+            kwargs = {"etag": etag, "match_condition": MatchConditions.IfNotModified}
         patched_item = await self.container.patch_item(
-            item=item_id, partition_key=partition_key, patch_operations=patch
+            item=item_id, partition_key=partition_key, patch_operations=patch, **kwargs
         )
         return patched_item
 
     async def batch_patch(
-        self, item_id: str, partition_key: str, patch_operations: List[Dict[str, Any]]
+        self,
+        item_id: str,
+        partition_key: str,
+        patch_operations: List[Dict[str, Any]],
+        etag: Union[str, None] = None,
     ) -> Dict[str, Any]:
         i = 0
         batch: List[Dict] = []
@@ -53,11 +156,15 @@ class CosmosDBService(AbstractAzureService):
             batch.append(patch_operation)
             i += 1
             if i % 10 == 0:
-                result = await self.patch(item_id, partition_key, patch=batch)
+                result = await self.patch(
+                    item_id, partition_key, patch=batch, etag=etag
+                )
+                # the following batches are only valid on top of the item we just produced
+                etag = result["_etag"] if etag is not None else None
                 batch = []
 
         if len(batch) > 0:
-            result = await self.patch(item_id, partition_key, patch=batch)
+            result = await self.patch(item_id, partition_key, patch=batch, etag=etag)
         return result  # type: ignore
 
     async def delete(self, item_id: str, partition_key: str, **kwargs):
@@ -66,14 +173,86 @@ class CosmosDBService(AbstractAzureService):
             item=item_id, partition_key=partition_key, **kwargs
         )
 
-    async def bulk_delete(self, item_ids: List[str], partition_keys: List[str]):
-        async with asyncio.TaskGroup() as tg:
+    async def bulk_delete(
+        self,
+        item_ids: List[str],
+        partition_keys: List[str],
+        concurrency: int = DEFAULT_DELETE_CONCURRENCY,
+        max_attempts: int = DEFAULT_DELETE_ATTEMPTS,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> int:
+        """
+        Deletes items, at most `concurrency` at a time. Throttled requests are sent again after the time cosmos db
+        asks for (x-ms-retry-after-ms), other transient errors after an exponential backoff, up to `max_attempts`
+        times. Items that do not exist (anymore) count as deleted, so an interrupted bulk delete can be repeated.
+        The items are taken from their partitions in turn, so the requests spread over the partitions instead of
+        throttling one after the other.
+
+        Args:
+            item_ids (List[str]): ids of the items
+            partition_keys (List[str]): partition key of each item
+            concurrency (int): maximum number of concurrent delete requests
+            max_attempts (int): attempts per item before the bulk delete fails
+            progress (Callable[[int, int], None], optional): called with the number of deleted items and the total
+                number of items after every deleted item
+
+        Returns:
+            int: the number of deleted items
+
+        Raises:
+            CosmosHttpResponseError: an item could not be deleted within `max_attempts` attempts, the remaining items
+                are not deleted
+        """
+        total = len(item_ids)
+        # interleaves the partitions, so consecutive requests go to different partitions
+        by_partition: Dict[str, List[str]] = {}
+        for item_id, partition_key in zip(item_ids, partition_keys):
+            by_partition.setdefault(partition_key, []).append(item_id)
+        items = iter(
             [
-                tg.create_task(
-                    self.delete(item_id=item_id, partition_key=partition_key)
-                )
-                for item_id, partition_key in list(zip(item_ids, partition_keys))
+                (item_id, partition_key)
+                for row in zip_longest(*by_partition.values())
+                for item_id, partition_key in zip(row, by_partition)
+                if item_id is not None
             ]
+        )
+        deleted = 0
+
+        async def delete_items() -> None:
+            nonlocal deleted
+            for item_id, partition_key in items:
+                async for attempt in AsyncRetrying(
+                    retry=retry_if_exception(is_transient),
+                    wait=wait_retry_after_or_exponential(
+                        wait_random_exponential(min=0.1, max=DEFAULT_MAX_WAIT),
+                        RETRY_AFTER_MILLISECONDS,
+                    ),
+                    stop=stop_after_attempt(max_attempts),
+                    reraise=True,
+                ):
+                    with attempt:
+                        try:
+                            await self.delete(
+                                item_id=item_id, partition_key=partition_key
+                            )
+                        except CosmosResourceNotFoundError:
+                            pass
+                deleted += 1
+                if progress is not None:
+                    progress(deleted, total)
+
+        workers = [
+            asyncio.create_task(delete_items()) for _ in range(min(concurrency, total))
+        ]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            # the other workers stop as well, the first error is raised as is
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            raise
+        return deleted
 
     async def create_item(self, body: Dict, **kwargs) -> Dict:
         """
@@ -0,0 +1,279 @@
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import openai
+from tenacity import (
+    AsyncRetrying,
+    RetryCallState,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+
+from core.cache import LRUCache
+from core.retryafter import wait_retry_after_or_exponential
+
+
+class EmbeddingService:
+    """
+    Creates embeddings with Azure OpenAI and caches them.
+
+    Vectors are kept as float32 arrays in an LRU cache keyed by a hash of deployment and text. Concurrent requests
+    for texts that are not cached are collected for `batch_window` seconds and sent as one batched
+    `Embedding.acreate` call, and requests for a text that is already being embedded wait for that call instead of
+    starting another one. If `persist_path` is set, the cache is loaded from it in start() and written to it in stop().
+
+    Example:
+        ```python
+        embedding_service = EmbeddingService("embedding", persist_path="/tmp/embeddings.npz")
+        await embedding_service.start()
+        vector = await embedding_service.embed("What are my health plans?")
+        await embedding_service.stop()
+        ```
+    """
+
+    DEFAULT_MAXSIZE = 10000
+    DEFAULT_BATCH_WINDOW = 0.01
+    # maximum number of inputs of one request to the Azure OpenAI embeddings API
+    DEFAULT_MAX_BATCH_SIZE = 16
+
+    def __init__(
+        self,
+        deployment: str,
+        maxsize: int = DEFAULT_MAXSIZE,
+        batch_window: float = DEFAULT_BATCH_WINDOW,
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        persist_path: Optional[str] = None,
+    ):
+        self.deployment = deployment
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.persist_path = persist_path
+        self._vectors: LRUCache[str, np.ndarray] = LRUCache(maxsize=maxsize)
+        self._pending: Dict[str, Tuple[str, asyncio.Future]] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_tasks: set = set()
+        self.api_calls = 0
+        self.embedded_texts = 0
+        self.coalesced = 0
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.deployment}\0{text}".encode()).hexdigest()
+
+    async def embed(self, text: str) -> List[float]:
+        """Returns the embedding of a text"""
+        return (await self.embed_array(text)).tolist()
+
+    async def embed_many(self, texts: List[str]) -> List[List[float]]:
+        """Returns the embeddings of several texts. Uncached texts are embedded in as few API calls as possible."""
+        vectors = await asyncio.gather(*(self.embed_array(text) for text in texts))
+        return [vector.tolist() for vector in vectors]
+
+    async def embed_array(self, text: str) -> np.ndarray:
+        key = self.key(text)
+        vector = self._vectors.get(key)
+        if vector is not None:
+            return vector
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[key] = future
+            self._pending[key] = (text, future)
+            self._schedule_flush()
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(future)
+
+    def _schedule_flush(self) -> None:
+        if len(self._pending) >= self.max_batch_size:
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+                self._flush_handle = None
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                self.batch_window, self._flush
+            )
+
+    def _flush(self) -> None:
+        self._flush_handle = None
+        pending, self._pending = self._pending, {}
+        items = list(pending.items())
+        for i in range(0, len(items), self.max_batch_size):
+            task = asyncio.create_task(
+                self._embed_batch(items[i : i + self.max_batch_size])
+            )
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_tasks.discard)
+
+    async def _embed_batch(
+        self, batch: List[Tuple[str, Tuple[str, asyncio.Future]]]
+    ) -> None:
+        try:
+            self.api_calls += 1
+            response = await openai.Embedding.acreate(
+                engine=self.deployment, input=[text for _, (text, _) in batch]
+            )
+            data = sorted(response["data"], key=lambda item: item["index"])
+            if len(data) != len(batch):
+                raise ValueError(
+                    f"Got {len(data)} embeddings for a batch of {len(batch)} texts"
+                )
+            for (key, (_, future)), item in zip(batch, data):
+                vector = np.asarray(item["embedding"], dtype=np.float32)
+                self._vectors.set(key, vector)
+                if not future.done():
+                    future.set_result(vector)
+            self.embedded_texts += len(batch)
+        except Exception as e:
+            for _, (_, future) in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            # nobody may wait forever, e.g. if the call was cancelled
+            for key, (_, future) in batch:
+                self._inflight.pop(key, None)
+                if not future.done():
+                    future.set_exception(
+                        RuntimeError("The embedding request ended without a result")
+                    )
+
+    async def start(self) -> None:
+        if self.persist_path and os.path.exists(self.persist_path):
+            try:
+                self.load(self.persist_path)
+            except Exception:
+                logging.exception("Loading the embedding cache failed")
+
+    async def stop(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush()
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+        if self.persist_path:
+            try:
+                self.save(self.persist_path)
+            except Exception:
+                logging.exception("Saving the embedding cache failed")
+
+    def load(self, path: str) -> None:
+        with np.load(path, allow_pickle=False) as data:
+            for key, vector in zip(data["keys"], data["vectors"]):
+                self._vectors.set(str(key), vector)
+
+    def save(self, path: str) -> None:
+        entries = self._vectors.items()
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                keys=np.array([key for key, _ in entries], dtype="U64"),
+                vectors=np.stack([vector for _, vector in entries])
+                if entries
+                else np.empty((0, 0), dtype=np.float32),
+            )
+        os.replace(tmp_path, path)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            **self._vectors.metrics(),
+            "api_calls": self.api_calls,
+            "embedded_texts": self.embedded_texts,
+            "coalesced": self.coalesced,
+            "texts_per_call": self.embedded_texts / self.api_calls
+            if self.api_calls
+            else 0.0,
+        }
+
+
+class DocumentEmbeddingService:
+    """
+    Embeds the sections of ingested documents.
+
+    Sections are sent in multi-input batches, with at most `concurrency` requests in flight. Rate limited or
+    failed requests are retried, waiting as long as the Retry-After header asks for or backing off exponentially.
+    The embeddings are returned in the order of the sections. Unlike EmbeddingService, nothing is cached: every
+    section is embedded exactly once.
+    """
+
+    DEFAULT_BATCH_SIZE = 16
+    DEFAULT_CONCURRENCY = 4
+    DEFAULT_MAX_ATTEMPTS = 6
+    RETRIED_ERRORS = (
+        openai.error.RateLimitError,
+        openai.error.ServiceUnavailableError,
+        openai.error.APIConnectionError,
+        openai.error.Timeout,
+        openai.error.TryAgain,
+        openai.error.APIError,
+    )
+
+    def __init__(
+        self,
+        deployment: str,
+        model: Optional[str] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        max_wait: float = 60,
+    ):
+        self.deployment = deployment
+        self.model = model
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.max_wait = max_wait
+        self.requests = 0
+        self.retries = 0
+        self.embedded_texts = 0
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """Returns the embeddings of the texts, in the order of the texts"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        batches = [
+            texts[i : i + self.batch_size] for i in range(0, len(texts), self.batch_size)
+        ]
+
+        async def embed_batch(batch: List[str]) -> List[List[float]]:
+            async with semaphore:
+                return await self._embed_batch(batch)
+
+        async with asyncio.TaskGroup() as tg:
+            tasks = [tg.create_task(embed_batch(batch)) for batch in batches]
+        return [vector for task in tasks for vector in task.result()]
+
+    async def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        async for attempt in AsyncRetrying(
+            retry=retry_if_exception_type(self.RETRIED_ERRORS),
+            wait=wait_retry_after_or_exponential(
+                wait_random_exponential(min=1, max=self.max_wait)
+            ),
+            stop=stop_after_attempt(self.max_attempts),
+            before_sleep=self._count_retry,
+            reraise=True,
+        ):
+            with attempt:
+                self.requests += 1
+                kwargs: Dict[str, Any] = {"deployment_id": self.deployment}
+                if self.model is not None:
+                    kwargs["model"] = self.model
+                response = await openai.Embedding.acreate(input=batch, **kwargs)
+        data = sorted(response["data"], key=lambda item: item["index"])
+        self.embedded_texts += len(batch)
+        return [item["embedding"] for item in data]
+
+    def _count_retry(self, retry_state: RetryCallState) -> None:
+        self.retries += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "embedded_texts": self.embedded_texts,
+        }
@@ -1,15 +1,19 @@
 import io
 import os
+import shutil
+import tempfile
 from abc import ABC, abstractmethod
-from typing import List, Union, TypeVar
+from typing import IO, Iterator, List, Union, TypeVar
 import uuid
+from core.cpuexecutor import CPUExecutor
+from core.uploadedfile import UploadedFile
 from models.Models import (
     PageBlobStorageModel,
     FileModel,
     FileBlobStorageModel,
 )
 from services.FileConverterService import FileConverterService
-from services.FileReaderService import FileReaderService
+from services.FileReaderService import FileReaderService, split_pdf_to_files
 
 
 # _T = TypeVar("_T", FileModel)
@@ -27,10 +31,24 @@ class FileManagementService:
     def strategy(self, strategy: "AbstractFileManagementStrategy"):
         self._strategy = strategy
 
+    @classmethod
+    def for_file(cls, file: FileModel) -> "FileManagementService":
+        """Returns a service with the strategy matching the type of the file data"""
+        if isinstance(file.data, UploadedFile):
+            return cls(UploadedFileManagementStrategy())
+        if isinstance(file.data, str):
+            return cls(StrFileManagementStrategy())
+        return cls(ByteFileManagementStrategy())
+
     def process_file(self, file: FileModel) -> "AbstractFileManagementStrategy":
         strat = self._strategy.process_file(file)
         return strat
 
+    async def process_file_offloaded(
+        self, file: FileModel, executor: CPUExecutor
+    ) -> "AbstractFileManagementStrategy":
+        return await self._strategy.process_file_offloaded(file, executor)
+
     def to_model(self, **kwargs) -> FileBlobStorageModel:
         return self._strategy._to_model(**kwargs)
 
@@ -38,7 +56,7 @@ class FileManagementService:
 class AbstractFileManagementStrategy(ABC):
     file_bytes: bytes
     file_name: str
-    pages_bytes: List[bytes]
+    page_count: int
     page_names: List[str]
 
     def process_file(self, file: FileModel):
@@ -49,35 +67,91 @@ class AbstractFileManagementStrategy(ABC):
         Args:
             file (_T): a file model
         """
+        self._prepare(file)
+        self._read_pages(self.open_file())
+        self._generate_names_for_pages(file.name, self.page_count)
+        return self
+
+    async def process_file_offloaded(
+        self, file: FileModel, executor: CPUExecutor
+    ) -> "AbstractFileManagementStrategy":
+        """
+        Like process_file, but the pages are split by a worker of the executor, which writes them to a temporary
+        directory. The event loop only opens the page files while they are uploaded.
+
+        Args:
+            file (_T): a file model
+            executor (CPUExecutor): runs the splitting
+        """
+        self._prepare(file)
+        self._pages_dir = tempfile.mkdtemp(prefix="pages-")
+        self._page_paths = await executor.run(
+            split_pdf_to_files, self._source_path(), self._pages_dir
+        )
+        self.page_count = len(self._page_paths)
+        self._generate_names_for_pages(file.name, self.page_count)
+        return self
+
+    def _prepare(self, file: FileModel) -> None:
         self.file = file
+        self._handles: List[IO[bytes]] = []
+        self._pages_dir: Union[str, None] = None
+        self._page_paths: Union[List[str], None] = None
         self.generate_file_id()
         self.transform_to_bytes(file)
-        self._bytes_to_io(self.file_bytes)
-        self._get_pages_from_file(self.file_io)
-        self._generate_names_for_pages(file.name, self.pages_bytes)
-        return self
+
+    def _source_path(self) -> str:
+        """Returns the path of the file, writing it to the pages directory first if it is in memory"""
+        path = os.path.join(self._pages_dir, "source")
+        with open(path, "wb") as f:
+            f.write(self.file_bytes)
+        return path
 
     @abstractmethod
     def transform_to_bytes(self, file: FileModel) -> bytes:
         ...
 
+    def open_file(self) -> IO[bytes]:
+        """Returns a new read handle of the file. Handles are closed by close() or when leaving the with block."""
+        handle = self._open()
+        self._handles.append(handle)
+        return handle
+
+    def _open(self) -> IO[bytes]:
+        return self._bytes_to_io(self.file_bytes)
+
+    def close(self) -> None:
+        for handle in self._handles:
+            handle.close()
+        self._handles = []
+        if self._pages_dir is not None:
+            shutil.rmtree(self._pages_dir, ignore_errors=True)
+            self._pages_dir = None
+
+    def __enter__(self) -> "AbstractFileManagementStrategy":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
     def _to_model(
         self, index_id, category_id
     ) -> (
         FileBlobStorageModel
     ):  # probably move this method to another service / to another position or make it more generic
         return FileBlobStorageModel(
-            data=self.file_bytes,
+            data=self.open_file(),
             path=f"{index_id}/{category_id}/{self.file.name}",
             tags={"id": self.file_id},
-            pages=[
+            # pages are split lazily, while the blob service uploads them
+            pages=(
                 PageBlobStorageModel(
                     data=page_data,
                     path=f"{index_id}/{category_id}/pages/{page_name}",
                     tags={"id": self.file_id},
                 )
-                for page_data, page_name in list(zip(self.pages_bytes, self.page_names))
-            ],
+                for page_data, page_name in zip(self.iter_pages(), self.page_names)
+            ),
         )
 
     def generate_file_id(self) -> str:
@@ -88,10 +162,22 @@ class AbstractFileManagementStrategy(ABC):
         self.file_io = io.BytesIO(bytes_)
         return self.file_io
 
-    def _get_pages_from_file(self, stream: io.BytesIO) -> List[bytes]:
-        filereader_service = FileReaderService(stream=stream)
-        self.pages_bytes = filereader_service.pages_to_bytes()
-        return self.pages_bytes
+    def _read_pages(self, stream: IO[bytes]) -> int:
+        # the reader parses the file once and is shared by the page count and iter_pages
+        self._reader = FileReaderService(stream=stream)
+        self.page_count = len(self._reader.pages)
+        return self.page_count
+
+    def iter_pages(self) -> Iterator[IO[bytes]]:
+        """Yields the pages of the file as single-page pdfs, one at a time"""
+        if self._page_paths is None:
+            yield from self._reader.iter_pages()
+            return
+        for path in self._page_paths:
+            # read one page at a time, so pages pulled by the uploads hold no file descriptors
+            with open(path, "rb") as f:
+                page = io.BytesIO(f.read())
+            yield page
 
     def _generate_names_for_pages(
         self, name: str, pages: Union[List[bytes], int]
@@ -118,6 +204,18 @@ class ByteFileManagementStrategy(AbstractFileManagementStrategy):
         return self.file_bytes
 
 
+class UploadedFileManagementStrategy(AbstractFileManagementStrategy):
+    def transform_to_bytes(self, file: FileModel[UploadedFile]) -> None:
+        # the content stays on disk and is streamed from there by every handle returned by open_file
+        self.uploaded_file = file.data
+
+    def _open(self) -> IO[bytes]:
+        return self.uploaded_file.open()
+
+    def _source_path(self) -> str:
+        return self.uploaded_file.path
+
+
 class StrFileManagementStrategy(AbstractFileManagementStrategy):
     def transform_to_bytes(self, file: FileModel[str]) -> bytes:
         if "base64" in file.data:
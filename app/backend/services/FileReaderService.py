@@ -1,5 +1,6 @@
 import base64
-from typing import List
+import os
+from typing import IO, Iterator, List, Optional, Union
 from pypdf import PdfReader, PdfWriter
 import io
 
@@ -8,17 +9,42 @@ class FileReaderService(PdfReader):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-    def pages_to_io(self) -> List[io.BytesIO]:
-        pages: List[io.BytesIO] = []
-        for i, page in enumerate(self.pages):
+    def iter_pages(self, start: int = 0, stop: Optional[int] = None) -> Iterator[io.BytesIO]:
+        """Yields the pages as single-page pdfs, one at a time. Every page is written once into its own buffer,
+        which is handed out as is, so only the pages the consumer still holds are kept in memory."""
+        for i in range(start, len(self.pages) if stop is None else stop):
             f = io.BytesIO()
+            # a writer cannot be reused: pypdf writes every object it ever added and cannot remove a page, so a shared
+            # writer would carry all previous pages into each file. Creating one is cheap next to cloning the page.
             writer = PdfWriter()
-            writer.add_page(page)
+            writer.add_page(self.pages[i])
             writer.write(f)
             f.seek(0)
-            pages.append(f)
-        return pages
+            yield f
+
+    def pages_to_io(self) -> List[io.BytesIO]:
+        return list(self.iter_pages())
 
     def pages_to_bytes(self) -> List[bytes]:
-        pages = self.pages_to_io()
-        return [page.getvalue() for page in pages]
+        return [page.getvalue() for page in self.iter_pages()]
+
+
+def split_pdf_to_files(
+    source: Union[str, IO[bytes]],
+    directory: str,
+    start: int = 0,
+    stop: Optional[int] = None,
+) -> List[str]:
+    """Writes pages start to stop of a pdf as single-page pdfs into directory and returns their paths.
+
+    Only paths cross the call boundary when source is a path, so large pdfs can be split in chunks of pages by the
+    workers of a process pool without pickling any page content.
+    """
+    reader = FileReaderService(source)
+    paths: List[str] = []
+    for i, page in enumerate(reader.iter_pages(start, stop), start=start):
+        path = os.path.join(directory, f"{i}.pdf")
+        with open(path, "wb") as f:
+            f.write(page.getbuffer())
+        paths.append(path)
+    return paths
@@ -1,6 +1,6 @@
 import asyncio
 import copy
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Tuple, Union
 from utils import create_dataclass_from_dict
 
 from models.Models import (
@@ -15,6 +15,10 @@ from services.ABCUsecaseService import (
 )
 from services.CosmosDBService import CosmosDBService
 from services.CategoryService import CategoryService
+from services.UsecaseDefinitionService import UsecaseDefinition
+
+from azure.cosmos.exceptions import CosmosAccessConditionFailedError
+from customerrors import PreconditionFailedError
 
 
 class IndexService(UsecaseService):
@@ -30,23 +34,44 @@ class IndexService(UsecaseService):
             "categories",
         ]
 
-    async def __query_indices_from_db(
-        self, usecasetype_id: str
-    ) -> List[Dict[str, Any]]:
-        items = await CosmosDBService(
+    def __indices_of_definition(
+        self, definition: UsecaseDefinition
+    ) -> List[IndexCosmosDBModel]:
+        return [
+            create_dataclass_from_dict(IndexCosmosDBModel, item)
+            for item in definition.indices
+        ]
+
+    async def __patch_db(
+        self,
+        usecasetype_id: str,
+        patch: List[Dict[str, Any]],
+        etag: Union[str, None] = None,
+    ) -> UsecaseDefinition:
+        cdb_service = CosmosDBService(
             database=self._DATABASE, container=self._CONTAINER
-        ).query(
-            query=f"Select t.{',t.'.join(self.fields)} from {self._CONTAINER} d JOIN t in d.indices where d.id=@usecasetypeid",
-            params=[{"name": "@usecasetypeid", "value": usecasetype_id}],
         )
-        return items
+        try:
+            item = await cdb_service.patch(
+                item_id=usecasetype_id,
+                partition_key=usecasetype_id,
+                patch=patch,
+                etag=etag,
+            )
+        except CosmosAccessConditionFailedError:
+            self._definitions.invalidate(usecasetype_id)
+            raise PreconditionFailedError(
+                {
+                    "code": "concurrent modification",
+                    "description": "The usecase definition was modified concurrently, please retry",
+                },
+                412,
+            )
+        return self._definitions.store(item)
 
     async def get(self, usecasetype_id: str):
-        items = await self.__query_indices_from_db(usecasetype_id=usecasetype_id)
-        indices = [
-            create_dataclass_from_dict(IndexCosmosDBModel, item) for item in items
-        ]
-        return indices
+        definition = await self._definitions.get(usecasetype_id, refresh=True)
+        return self.__indices_of_definition(definition)
 
     async def post(self, index: IndexModel, usecasetype_id: str):
         index_wo_cat = copy.deepcopy(index)
@@ -59,7 +84,6 @@ class IndexService(UsecaseService):
                 categories=index.categories,
                 usecasetype_id=usecasetype_id,
                 index_id=index.id,
-                index_idx=len(index_update) - 1,
             )
         return index_update
 
@@ -68,7 +92,6 @@ class IndexService(UsecaseService):
         categories: List[CategoryModel],
         usecasetype_id: str,
         index_id: str,
-        index_idx: int,
     ):
         async with asyncio.TaskGroup() as tg:
             for category in categories:
@@ -77,30 +100,19 @@ class IndexService(UsecaseService):
                         category,
                         usecasetype_id=usecasetype_id,
                         index_id=index_id,
-                        index_idx=index_idx,
                     )
                 )
 
     async def __upload_index(self, index: IndexModel, usecasetype_id: str):
-        cdb_service = CosmosDBService(
-            database=self._DATABASE, container=self._CONTAINER
-        )
         patch = [{"op": "add", "path": "/indices/-", "value": index.jsonify()}]
-        items = await cdb_service.patch(usecasetype_id, usecasetype_id, patch=patch)
-        indices = [
-            create_dataclass_from_dict(IndexCosmosDBModel, item)
-            for item in items["indices"]
-        ]
-        return indices
+        definition = await self.__patch_db(usecasetype_id=usecasetype_id, patch=patch)
+        return self.__indices_of_definition(definition)
 
     async def put(
         self, index: IndexModel, usecasetype_id: str
     ) -> List[IndexCosmosDBModel]:  # TODO: rename to singular update_item
-        current_index_idx, current_index = await self.get_current_index_and_idx(
-            id=index.id, usecasetype_id=usecasetype_id
-        )
-        if current_index_idx is None:
-            raise Exception("Something went wrong")
+        definition = await self._definitions.get(usecasetype_id, refresh=True)
+        current_index_idx = definition.index_position(index.id)
         patch = [
             {
                 "op": "set",
@@ -123,67 +135,49 @@ class IndexService(UsecaseService):
                 "value": index.description_de,
             },
         ]
-
-        cdb_service = CosmosDBService(
-            database=self._DATABASE, container=self._CONTAINER
-        )
-        items = await cdb_service.patch(
-            item_id=usecasetype_id, partition_key=usecasetype_id, patch=patch
+        definition = await self.__patch_db(
+            usecasetype_id=usecasetype_id, patch=patch, etag=definition.etag
         )
-        indices = [
-            create_dataclass_from_dict(IndexCosmosDBModel, item)
-            for item in items["indices"]
-        ]
-        return indices
+        return self.__indices_of_definition(definition)
 
     async def get_current_index_and_idx(
         self, id: str, usecasetype_id: str
     ) -> Tuple[int, IndexCosmosDBModel]:
-        items = await self.__query_indices_from_db(usecasetype_id=usecasetype_id)
-        indices = [
-            create_dataclass_from_dict(IndexCosmosDBModel, item) for item in items
-        ]
-        current_index_and_idx = next(
-            ((i, item) for i, item in enumerate(indices) if item.id == id), None
+        definition = await self._definitions.get(usecasetype_id)
+        idx = definition.index_position(id)
+        return idx, create_dataclass_from_dict(
+            IndexCosmosDBModel, definition.indices[idx]
         )
-        if current_index_and_idx is None:
-            raise Exception(f"Could not find index with id {id}")
-        else:
-            return current_index_and_idx
 
     async def delete(self, id: str, usecasetype_id: str) -> List[IndexCosmosDBModel]:
-        idx, index = await self.get_current_index_and_idx(
-            id=id, usecasetype_id=usecasetype_id
+        definition = await self._definitions.get(usecasetype_id, refresh=True)
+        index = create_dataclass_from_dict(
+            IndexCosmosDBModel, definition.get_index(id)
         )
         if index.categories:
             await self.__delete_categories(
                 categories=index.categories,
                 usecasetype_id=usecasetype_id,
-                index_idx=idx,
+                index_id=id,
             )
+            # deleting the categories changed the document
+            definition = await self._definitions.get(usecasetype_id, refresh=True)
 
-        patch = [{"op": "remove", "path": f"/indices/{idx}"}]
-        cdb_service = CosmosDBService(
-            database=self._DATABASE, container=self._CONTAINER
-        )
-        items = await cdb_service.patch(
-            item_id=usecasetype_id, partition_key=usecasetype_id, patch=patch
+        patch = [{"op": "remove", "path": f"/indices/{definition.index_position(id)}"}]
+        definition = await self.__patch_db(
+            usecasetype_id=usecasetype_id, patch=patch, etag=definition.etag
         )
-        indices = [
-            create_dataclass_from_dict(IndexCosmosDBModel, item)
-            for item in items["indices"]
-        ]
-        return indices
+        return self.__indices_of_definition(definition)
 
     async def __delete_categories(
         self,
         categories: List[CategoryCosmosDBModel],
         usecasetype_id: str,
-        index_idx: int,
+        index_id: str,
     ) -> None:
         for category in categories:
             await CategoryService().delete(
                 id=category.id,
                 usecasetype_id=usecasetype_id,
-                index_idx=index_idx,
+                index_id=index_id,
             )
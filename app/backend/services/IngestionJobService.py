@@ -0,0 +1,478 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+from core.uploadedfile import UploadedFile
+from models.BaseModels import BaseModel
+
+Attachments = Dict[str, Union[bytes, str, UploadedFile]]
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class StageStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    SKIPPED = "skipped"
+
+
+@dataclass
+class IngestionJob(BaseModel):
+    id: str
+    kind: str
+    status: str
+    owner: str
+    stages: List[Dict[str, Any]] = field(default_factory=list)
+    result: Any = None
+    error: Optional[str] = None
+    attempts: int = 0
+    created_at: float = 0.0
+    updated_at: float = 0.0
+
+    def to_response(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stages": self.stages,
+            "result": self.result,
+            "error": self.error,
+            "attempts": self.attempts,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class IngestionJobStore:
+    """
+    SQLite backed queue of ingestion jobs. Uploaded files are kept next to the database until their job has finished,
+    so queued and interrupted jobs survive restarts if the directory does. Every operation opens its own connection,
+    so the store can be used from worker threads and from several processes sharing the directory.
+    """
+
+    _DATABASE = "jobs.sqlite3"
+    _ATTACHMENTS = "attachments"
+
+    def __init__(self, directory: str, journal_mode: str = "WAL"):
+        self.directory = directory
+        self.path = os.path.join(directory, self._DATABASE)
+        os.makedirs(os.path.join(directory, self._ATTACHMENTS), exist_ok=True)
+        with self._connect() as con:
+            # WAL needs shared memory between the processes, use DELETE on network file systems
+            con.execute(f"PRAGMA journal_mode={journal_mode}")
+            con.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    owner TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    stages TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    heartbeat_at REAL
+                )"""
+            )
+            con.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        con.row_factory = sqlite3.Row
+        return con
+
+    def _attachment_dir(self, job_id: str) -> str:
+        return os.path.join(self.directory, self._ATTACHMENTS, job_id)
+
+    @staticmethod
+    def _to_job(row: sqlite3.Row) -> IngestionJob:
+        return IngestionJob(
+            id=row["id"],
+            kind=row["kind"],
+            status=row["status"],
+            owner=row["owner"],
+            stages=json.loads(row["stages"]),
+            result=json.loads(row["result"]) if row["result"] is not None else None,
+            error=row["error"],
+            attempts=row["attempts"],
+            created_at=row["created_at"],
+            updated_at=row["updated_at"],
+        )
+
+    def add(
+        self,
+        kind: str,
+        owner: str,
+        payload: Dict[str, Any],
+        attachments: Attachments,
+        stages: List[str],
+    ) -> IngestionJob:
+        job_id = str(uuid.uuid4())
+        attachment_dir = self._attachment_dir(job_id)
+        os.makedirs(attachment_dir)
+        manifest = {}
+        for i, (name, data) in enumerate(attachments.items()):
+            path = os.path.join(attachment_dir, str(i))
+            if isinstance(data, UploadedFile):
+                # spooled uploads are moved, not copied
+                data.move_to(path)
+                type_ = "file"
+            else:
+                with open(path, "wb") as f:
+                    f.write(data.encode("utf-8") if isinstance(data, str) else data)
+                type_ = "str" if isinstance(data, str) else "bytes"
+            manifest[name] = {"file": str(i), "type": type_}
+        now = time.time()
+        with self._connect() as con:
+            con.execute(
+                "INSERT INTO jobs (id, kind, status, owner, payload, stages, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_id,
+                    kind,
+                    JobStatus.QUEUED.value,
+                    owner,
+                    json.dumps({"payload": payload, "attachments": manifest}),
+                    json.dumps(
+                        [{"name": stage, "status": StageStatus.PENDING.value} for stage in stages]
+                    ),
+                    now,
+                    now,
+                ),
+            )
+        return self.get(job_id)  # type: ignore
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._connect() as con:
+            row = con.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_job(row) if row is not None else None
+
+    def claim(self) -> Optional[IngestionJob]:
+        """Marks the oldest queued job as running and returns it"""
+        now = time.time()
+        con = self._connect()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            row = con.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                (JobStatus.QUEUED.value,),
+            ).fetchone()
+            if row is None:
+                con.execute("COMMIT")
+                return None
+            con.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ?, heartbeat_at = ?"
+                " WHERE id = ?",
+                (JobStatus.RUNNING.value, now, now, row["id"]),
+            )
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+        return self.get(row["id"])
+
+    def load_payload(self, job_id: str) -> tuple[Dict[str, Any], Attachments]:
+        with self._connect() as con:
+            row = con.execute("SELECT payload FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        stored = json.loads(row["payload"])
+        attachments: Attachments = {}
+        for name, entry in stored["attachments"].items():
+            path = os.path.join(self._attachment_dir(job_id), entry["file"])
+            if entry["type"] == "file":
+                # removed together with the attachments of the job when it finishes
+                attachments[name] = UploadedFile(path, delete=False)
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            attachments[name] = data.decode("utf-8") if entry["type"] == "str" else data
+        return stored["payload"], attachments
+
+    def set_stage(self, job_id: str, stage: str) -> None:
+        """Marks a stage as running and the stage running before it as done"""
+        job = self.get(job_id)
+        if job is None:
+            return
+        now = time.time()
+        for entry in job.stages:
+            if entry["status"] == StageStatus.RUNNING.value:
+                entry["status"] = StageStatus.DONE.value
+                entry["finished_at"] = now
+            if entry["name"] == stage:
+                entry["status"] = StageStatus.RUNNING.value
+                entry["started_at"] = now
+        with self._connect() as con:
+            con.execute(
+                "UPDATE jobs SET stages = ?, updated_at = ?, heartbeat_at = ? WHERE id = ?",
+                (json.dumps(job.stages), now, now, job_id),
+            )
+
+    def heartbeat(self, job_id: str) -> None:
+        with self._connect() as con:
+            con.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (time.time(), job_id)
+            )
+
+    def finish(
+        self, job_id: str, status: JobStatus, result: Any = None, error: Optional[str] = None
+    ) -> None:
+        job = self.get(job_id)
+        if job is None:
+            return
+        now = time.time()
+        for entry in job.stages:
+            if entry["status"] == StageStatus.RUNNING.value:
+                entry["status"] = (
+                    StageStatus.DONE.value if status == JobStatus.SUCCEEDED else entry["status"]
+                )
+                entry["finished_at"] = now
+            elif entry["status"] == StageStatus.PENDING.value and status == JobStatus.SUCCEEDED:
+                entry["status"] = StageStatus.SKIPPED.value
+        with self._connect() as con:
+            con.execute(
+                "UPDATE jobs SET status = ?, stages = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+                (
+                    status.value,
+                    json.dumps(job.stages),
+                    json.dumps(result) if result is not None else None,
+                    error,
+                    now,
+                    job_id,
+                ),
+            )
+        shutil.rmtree(self._attachment_dir(job_id), ignore_errors=True)
+
+    def requeue_stale(self, stale_after: float, max_attempts: int) -> int:
+        """Requeues running jobs whose worker stopped sending heartbeats, e.g. because the process was restarted.
+        Jobs that already used up their attempts are failed."""
+        threshold = time.time() - stale_after
+        with self._connect() as con:
+            rows = con.execute(
+                "SELECT id, attempts FROM jobs WHERE status = ? AND heartbeat_at < ?",
+                (JobStatus.RUNNING.value, threshold),
+            ).fetchall()
+        requeued = 0
+        for row in rows:
+            if row["attempts"] >= max_attempts:
+                self.finish(
+                    row["id"], JobStatus.FAILED, error="The job was interrupted too often"
+                )
+                continue
+            with self._connect() as con:
+                con.execute(
+                    "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+                    (JobStatus.QUEUED.value, time.time(), row["id"], JobStatus.RUNNING.value),
+                )
+            requeued += 1
+        return requeued
+
+    def count_by_status(self) -> Dict[str, int]:
+        with self._connect() as con:
+            rows = con.execute(
+                "SELECT status, COUNT(*) AS count FROM jobs GROUP BY status"
+            ).fetchall()
+        return {row["status"]: row["count"] for row in rows}
+
+
+JobHandler = Callable[
+    [Dict[str, Any], Attachments, Callable[[str], Awaitable[None]]], Awaitable[Any]
+]
+
+
+class IngestionJobService:
+    """
+    Runs long ingestion work (blob upload, form recognizer, splitting, embeddings, indexing) outside of the request.
+
+    Requests submit a job and return its id right away. A pool of `concurrency` workers per process claims queued
+    jobs from the IngestionJobStore and runs the handler registered for the job's kind. Handlers report the stage
+    they are in, which is visible in the job status together with the result or the error. Jobs whose worker died
+    are requeued once their heartbeat is older than `stale_after` seconds; the workers of every process look for
+    them at that interval. stop() claims no more jobs and waits up to `stop_timeout` seconds for the running ones,
+    jobs that take longer are cancelled and run again after a restart.
+
+    Example:
+        ```python
+        jobs = IngestionJobService(directory="/tmp/ingestion")
+        jobs.register("category.post", handler)
+        await jobs.start()
+        job = await jobs.submit("category.post", owner=user_id, payload={...}, attachments={...}, stages=[...])
+        ```
+    """
+
+    DEFAULT_CONCURRENCY = 2
+    DEFAULT_POLL_INTERVAL = 1.0
+    DEFAULT_HEARTBEAT_INTERVAL = 15.0
+    DEFAULT_MAX_ATTEMPTS = 3
+    DEFAULT_STOP_TIMEOUT = 60.0
+
+    def __init__(
+        self,
+        directory: str,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        heartbeat_interval: float = DEFAULT_HEARTBEAT_INTERVAL,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        before_job: Optional[Callable[[], None]] = None,
+        stop_timeout: float = DEFAULT_STOP_TIMEOUT,
+        journal_mode: str = "WAL",
+    ):
+        self.store = IngestionJobStore(directory, journal_mode=journal_mode)
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = heartbeat_interval * 4
+        self.max_attempts = max_attempts
+        self.before_job = before_job
+        self.stop_timeout = stop_timeout
+        self._handlers: Dict[str, JobHandler] = {}
+        self._workers: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._app = None
+        self._stopping = False
+        self._requeued_at = 0.0
+        self.succeeded = 0
+        self.failed = 0
+
+    def register(self, kind: str, handler: JobHandler) -> None:
+        self._handlers[kind] = handler
+
+    async def submit(
+        self,
+        kind: str,
+        owner: str,
+        payload: Dict[str, Any],
+        attachments: Attachments,
+        stages: List[str],
+    ) -> IngestionJob:
+        if kind not in self._handlers:
+            raise ValueError(f"No handler registered for jobs of kind {kind}")
+        job = await asyncio.to_thread(
+            self.store.add, kind, owner, payload, attachments, stages
+        )
+        self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str) -> Optional[IngestionJob]:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def start(self, app=None) -> None:
+        """Starts the workers. Jobs run within an app context of `app`, if given."""
+        self._app = app
+        self._stopping = False
+        await self._requeue_stale()
+        self._workers = [
+            asyncio.create_task(self._work()) for _ in range(self.concurrency)
+        ]
+
+    async def stop(self) -> None:
+        """Claims no more jobs and waits up to `stop_timeout` seconds for the running ones"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._workers:
+            _, unfinished = await asyncio.wait(self._workers, timeout=self.stop_timeout)
+            if unfinished:
+                logging.warning(
+                    f"Cancelling {len(unfinished)} ingestion jobs, they run again after a restart"
+                )
+            for worker in unfinished:
+                worker.cancel()
+            await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _requeue_stale(self) -> None:
+        """Requeues the jobs of dead workers, also of other processes"""
+        self._requeued_at = time.monotonic()
+        try:
+            requeued = await asyncio.to_thread(
+                self.store.requeue_stale, self.stale_after, self.max_attempts
+            )
+        except Exception:
+            logging.exception("Requeuing interrupted ingestion jobs failed")
+            return
+        if requeued:
+            logging.info(f"Requeued {requeued} interrupted ingestion jobs")
+
+    async def _work(self) -> None:
+        while not self._stopping:
+            # one worker of the process checks at a time, the others see the new _requeued_at
+            if time.monotonic() - self._requeued_at >= self.stale_after:
+                await self._requeue_stale()
+            try:
+                job = await asyncio.to_thread(self.store.claim)
+            except Exception:
+                logging.exception("Claiming an ingestion job failed")
+                job = None
+            if job is None:
+                if self._stopping:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if self._app is not None:
+                async with self._app.app_context():
+                    await self._run(job)
+            else:
+                await self._run(job)
+
+    async def _heartbeat(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            await asyncio.to_thread(self.store.heartbeat, job_id)
+
+    async def _run(self, job: IngestionJob) -> None:
+        heartbeat = asyncio.create_task(self._heartbeat(job.id))
+
+        async def progress(stage: str) -> None:
+            await asyncio.to_thread(self.store.set_stage, job.id, stage)
+
+        try:
+            if self.before_job is not None:
+                self.before_job()
+            payload, attachments = await asyncio.to_thread(self.store.load_payload, job.id)
+            result = await self._handlers[job.kind](payload, attachments, progress)
+        except asyncio.CancelledError:
+            # the job stays running and is requeued after a restart
+            raise
+        except Exception as e:
+            logging.exception(f"Ingestion job {job.id} failed")
+            self.failed += 1
+            await asyncio.to_thread(
+                self.store.finish, job.id, JobStatus.FAILED, None, str(e)
+            )
+        else:
+            self.succeeded += 1
+            await asyncio.to_thread(
+                self.store.finish, job.id, JobStatus.SUCCEEDED, result
+            )
+        finally:
+            heartbeat.cancel()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "workers": len(self._workers),
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "jobs": self.store.count_by_status(),
+        }
@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from enum import Enum
+from typing import Any, Dict, List, Optional
+
+from models.Models import PromptModel
+from services.CosmosDBService import CosmosDBService
+
+
+class PromptTypes(Enum):
+    SYSTEM = "system"
+    QUERY = "query"
+    QUERY_FEWSHOTS = "query_fewshots"
+    FOLLOWUP = "followup"
+    EXAMPLE = "example"
+
+
+class PromptService:
+    """
+    In-memory registry of the prompts stored in the KeyData/Prompts container.
+
+    The prompts are loaded once in setup_clients and kept in a dict keyed by prompt type, with the query few-shots
+    already parsed. A background task reloads the container every `ttl` seconds, so prompt changes in cosmosdb are
+    picked up without putting a cosmosdb round-trip on the chat path.
+
+    Example:
+        ```python
+        prompt_service = PromptService(ttl=300)
+        await prompt_service.start()
+        prompt_service.get(PromptTypes.SYSTEM)
+        prompt_service.query_fewshots
+        ```
+    """
+
+    _DATABASE = "KeyData"
+    _CONTAINER = "Prompts"
+    DEFAULT_TTL = 300
+
+    def __init__(self, ttl: float = DEFAULT_TTL):
+        self.ttl = ttl
+        self._prompts: Dict[str, PromptModel] = {}
+        self._query_fewshots: List[Dict[str, str]] = []
+        self._version: str = ""
+        self._loaded_at: Optional[float] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.loads = 0
+        self.failed_loads = 0
+
+    async def load(self) -> None:
+        """Loads all prompts from cosmosdb and swaps them in at once"""
+        cdb_service = CosmosDBService(
+            database=self._DATABASE, container=self._CONTAINER
+        )
+        items = await cdb_service.query(
+            query=f"Select p.type, p.content from {self._CONTAINER} p"
+        )
+        prompts = {item["type"]: PromptModel(**item) for item in items}
+        fewshots = prompts.get(PromptTypes.QUERY_FEWSHOTS.value)
+        query_fewshots = json.loads(fewshots.content) if fewshots else []
+        self._prompts = prompts
+        self._query_fewshots = query_fewshots
+        self._version = self.compute_version(prompts)
+        self._loaded_at = time.monotonic()
+        self.loads += 1
+
+    @staticmethod
+    def compute_version(prompts: Dict[str, PromptModel]) -> str:
+        digest = hashlib.sha1()
+        for type_ in sorted(prompts):
+            digest.update(type_.encode("utf-8"))
+            digest.update(b"\0")
+            digest.update(prompts[type_].content.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()[:12]
+
+    async def start(self) -> None:
+        await self.load()
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.ttl)
+            try:
+                await self.load()
+            except Exception:
+                # keep serving the last known prompts
+                self.failed_loads += 1
+                logging.exception("Reloading the prompts failed")
+
+    def get(self, type_: PromptTypes | str) -> str:
+        """Returns the content of a prompt
+
+        Args:
+            type_ (PromptTypes | str): type of the prompt
+
+        Raises:
+            KeyError: there is no prompt of this type
+
+        Returns:
+            str: content of the prompt
+        """
+        key = type_.value if isinstance(type_, PromptTypes) else type_
+        return self._prompts[key].content
+
+    @property
+    def query_fewshots(self) -> List[Dict[str, str]]:
+        return self._query_fewshots
+
+    @property
+    def version(self) -> str:
+        """Short hash over all prompts. Changes whenever any prompt changes"""
+        return self._version
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "prompts": len(self._prompts),
+            "version": self._version,
+            "loads": self.loads,
+            "failed_loads": self.failed_loads,
+            "age": time.monotonic() - self._loaded_at
+            if self._loaded_at is not None
+            else None,
+        }
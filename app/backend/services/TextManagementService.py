@@ -1,8 +1,12 @@
 from abc import ABC, abstractmethod
+import bisect
 import html
-from azure.ai.formrecognizer import DocumentTable
-from typing import List, Tuple
+import itertools
+import re
+from azure.ai.formrecognizer import DocumentTable, DocumentTableCell
+from typing import Dict, List, Optional, Tuple
 from functools import singledispatchmethod
+from core.tokencounter import get_encoding
 from services.FormRecognizerService import (
     PREBUILTDOCUMENT,
     PREBUILTLAYOUT,
@@ -10,32 +14,222 @@ from services.FormRecognizerService import (
 )
 
 
-class AbstractTextManagementService(ABC):
-    ...
+class AbstractTextManagementService(ABC): ...
 
 
-class TextManagementService(AbstractTextManagementService):
-    ...
+class TextManagementService(AbstractTextManagementService): ...
 
 
-class AbstractFormRecognizerTextManagementService(AbstractTextManagementService):
-    ...
+class AbstractFormRecognizerTextManagementService(AbstractTextManagementService): ...
+
+
+class SectionSplitter:
+    """
+    Splits the text of a page map into overlapping sections that end at a sentence ending or, failing that, at a
+    word break, and never start with a table that the previous section left open.
+
+    The positions of all sentence endings and word breaks are collected once up front, so every boundary
+    is found with a binary search instead of scanning character by character, and the page of a section is found by
+    bisecting the page offsets. With the default parameters the sections are identical to those of the original
+    character-by-character implementation.
+
+    Args:
+        max_section_length (int): The length a section grows to before the search for its end starts.
+        sentence_search_limit (int): How many characters past max_section_length are searched for a sentence ending.
+        section_overlap (int): How many characters of a section are repeated at the start of the next one.
+    """
+
+    SENTENCE_ENDINGS = [".", "!", "?"]
+    WORDS_BREAKS = [",", ";", ":", " ", "(", ")", "[", "]", "{", "}", "\t", "\n"]
+
+    def __init__(
+        self,
+        max_section_length: int = 1000,
+        sentence_search_limit: int = 100,
+        section_overlap: int = 100,
+    ):
+        self.max_section_length = max_section_length
+        self.sentence_search_limit = sentence_search_limit
+        self.section_overlap = section_overlap
+
+    @staticmethod
+    def find_page(page_offsets: List[int], offset: int) -> int:
+        """Returns the index of the page that contains offset, or of the last page if no page does"""
+        page = bisect.bisect_right(page_offsets, offset) - 1
+        return page if page >= 0 else len(page_offsets) - 1
+
+    def split(self, page_map: List[Tuple[int, int, str]]) -> List[Tuple[str, int]]:
+        all_text = "".join(p[2] for p in page_map)
+        page_offsets = [p[1] for p in page_map]
+        endings = self._positions(all_text, self.SENTENCE_ENDINGS)
+        breaks = self._positions(all_text, self.WORDS_BREAKS)
+        units = self._units(all_text)
+        length = len(all_text)
+        start: int = 0
+        end = length
+        res: List[Tuple[str, int]] = []
+        while self._forward(units, start, self.section_overlap, length) < length:
+            end = self._find_end(all_text, endings, breaks, units, start)
+            start = self._find_start(all_text, endings, breaks, units, start, end)
+
+            section_text = all_text[start:end]
+            res.append((section_text, self.find_page(page_offsets, start)))
+
+            last_table_start = section_text.rfind("<table")
+            if (
+                last_table_start > 2 * self.sentence_search_limit
+                and last_table_start > section_text.rfind("</table")
+            ):
+                # If the section ends with an unclosed table, we need to start the next section with the table.
+                # If table starts inside SENTENCE_SEARCH_LIMIT, we ignore it, as that will cause an infinite loop for tables longer than MAX_SECTION_LENGTH
+                # If last table starts inside SECTION_OVERLAP, keep overlapping
+                start = min(
+                    self._backward(units, end, self.section_overlap),
+                    start + last_table_start,
+                )
+            else:
+                start = self._backward(units, end, self.section_overlap)
+
+        if self._forward(units, start, self.section_overlap, length) < end:
+            res.append((all_text[start:end], self.find_page(page_offsets, start)))
+        return res
+
+    @staticmethod
+    def _positions(text: str, characters: List[str]) -> List[int]:
+        pattern = "[" + "".join(re.escape(c) for c in characters) + "]"
+        return [m.start() for m in re.finditer(pattern, text)]
+
+    def _units(self, text: str) -> Optional[List[int]]:
+        """Returns the offsets at which the units that lengths are measured in start, followed by the length of the
+        text, or None if lengths are measured in characters"""
+        return None
+
+    @staticmethod
+    def _forward(
+        units: Optional[List[int]], position: int, amount: int, length: int
+    ) -> int:
+        if units is None:
+            return position + amount
+        i = bisect.bisect_right(units, position) - 1 + amount
+        return units[i] if i < len(units) else length
+
+    @staticmethod
+    def _backward(units: Optional[List[int]], position: int, amount: int) -> int:
+        if units is None:
+            return position - amount
+        i = bisect.bisect_right(units, position) - 1 - amount
+        return units[i] if i >= 0 else 0
+
+    def _find_end(
+        self,
+        text: str,
+        endings: List[int],
+        breaks: List[int],
+        units: Optional[List[int]],
+        start: int,
+    ) -> int:
+        length = len(text)
+        end = self._forward(units, start, self.max_section_length, length)
+        if end > length:
+            return length
+        # Try to find the end of the sentence within the search limit
+        limit = min(length, end + self.sentence_search_limit)
+        i = bisect.bisect_left(endings, end)
+        search_end = endings[i] if i < len(endings) and endings[i] < limit else limit
+        if search_end < length and text[search_end] not in self.SENTENCE_ENDINGS:
+            # Fall back to at least keeping a whole word
+            j = bisect.bisect_left(breaks, search_end) - 1
+            if j >= 0 and breaks[j] >= end and breaks[j] > 0:
+                search_end = breaks[j]
+        if search_end < length:
+            search_end += 1
+        return search_end
+
+    def _find_start(
+        self,
+        text: str,
+        endings: List[int],
+        breaks: List[int],
+        units: Optional[List[int]],
+        start: int,
+        end: int,
+    ) -> int:
+        # Try to find the start of the sentence or at least a whole word boundary
+        floor = max(
+            0,
+            self._backward(units, end, self.max_section_length)
+            - 2 * self.sentence_search_limit,
+        )
+        found = start
+        if start > floor:
+            i = bisect.bisect_right(endings, start) - 1
+            found = endings[i] if i >= 0 and endings[i] > floor else floor
+        if text[found] not in self.SENTENCE_ENDINGS:
+            j = bisect.bisect_right(breaks, found)
+            if j < len(breaks) and breaks[j] <= start and breaks[j] > 0:
+                found = breaks[j]
+        if found > 0:
+            found += 1
+        return found
+
+
+class TokenSectionSplitter(SectionSplitter):
+    """
+    Splits like SectionSplitter, but measures the section length and overlap in tokens of the encoding of a chat
+    model instead of in characters, so sections of table-heavy html fit the token budget of the prompts they are
+    packed into just like sections of plain text. The sentence search limit stays in characters, so a section may
+    exceed max_section_tokens by the tokens of up to three times that many characters.
+
+    The text is encoded once per split with the cached encoding of the model; all chat models supported by
+    core.modelhelper share the cl100k_base encoding.
+
+    Args:
+        max_section_tokens (int): The number of tokens a section grows to before the search for its end starts.
+        sentence_search_limit (int): How many characters past max_section_tokens are searched for a sentence ending.
+        section_overlap_tokens (int): How many tokens of a section are repeated at the start of the next one.
+        model (str): The chat model whose encoding is used.
+    """
+
+    # bytes that continue a multi-byte UTF-8 character
+    CONTINUATION_BYTES = bytes(range(0x80, 0xC0))
+
+    def __init__(
+        self,
+        max_section_tokens: int = 250,
+        sentence_search_limit: int = 100,
+        section_overlap_tokens: int = 25,
+        model: str = "gpt-35-turbo",
+    ):
+        super().__init__(
+            max_section_length=max_section_tokens,
+            sentence_search_limit=sentence_search_limit,
+            section_overlap=section_overlap_tokens,
+        )
+        self.model = model
+
+    def _units(self, text: str) -> Optional[List[int]]:
+        encoding = get_encoding(self.model)
+        token_bytes = encoding.decode_tokens_bytes(encoding.encode_ordinary(text))
+        # a token starts at the first character that starts within it
+        return list(
+            itertools.accumulate(
+                (len(b.translate(None, self.CONTINUATION_BYTES)) for b in token_bytes),
+                initial=0,
+            )
+        )
 
 
 class FormRecognizerTextManagementService(AbstractFormRecognizerTextManagementService):
     @staticmethod
     def table_to_html(table: DocumentTable) -> str:
-        table_html = "<table>"
-        rows = [
-            sorted(
-                [cell for cell in table.cells if cell.row_index == i],
-                key=lambda cell: cell.column_index,
-            )
-            for i in range(table.row_count)
-        ]
+        rows: List[List[DocumentTableCell]] = [[] for _ in range(table.row_count)]
+        for cell in table.cells:
+            if 0 <= cell.row_index < table.row_count:
+                rows[cell.row_index].append(cell)
+        parts = ["<table>"]
         for row_cells in rows:
-            table_html += "<tr>"
-            for cell in row_cells:
+            parts.append("<tr>")
+            for cell in sorted(row_cells, key=lambda cell: cell.column_index):
                 tag = (
                     "th"
                     if (cell.kind == "columnHeader" or cell.kind == "rowHeader")
@@ -48,10 +242,38 @@ class FormRecognizerTextManagementService(AbstractFormRecognizerTextManagementSe
                 if cell.row_span:
                     if cell.row_span > 1:
                         cell_spans += f" rowSpan={cell.row_span}"
-                table_html += f"<{tag}{cell_spans}>{html.escape(cell.content)}</{tag}>"
-            table_html += "</tr>"
-        table_html += "</table>"
-        return table_html
+                parts.append(f"<{tag}{cell_spans}>{html.escape(cell.content)}</{tag}>")
+            parts.append("</tr>")
+        parts.append("</table>")
+        return "".join(parts)
+
+    @staticmethod
+    def _table_owners(
+        tables: List[DocumentTable], page_offset: int, page_length: int
+    ) -> List[Tuple[int, int, int]]:
+        """
+        Splits a page into consecutive (start, end, table_id) segments, relative to the page. table_id is the
+        position of the table in tables, -1 marks text outside of tables. Where spans of several tables overlap,
+        the table that comes last owns the characters.
+        """
+        intervals: List[Tuple[int, int, int]] = []
+        for table_id, table in enumerate(tables):
+            for span in table.spans:
+                start = max(span.offset - page_offset, 0)
+                end = min(span.offset - page_offset + span.length, page_length)
+                if start < end:
+                    intervals.append((start, end, table_id))
+        bounds = sorted({0, page_length}.union(*((s, e) for s, e, _ in intervals)))
+        segments: List[Tuple[int, int, int]] = []
+        for start, end in zip(bounds, bounds[1:]):
+            owner = max(
+                (t for s, e, t in intervals if s <= start and end <= e), default=-1
+            )
+            if segments and segments[-1][2] == owner:
+                segments[-1] = (segments[-1][0], end, owner)
+            else:
+                segments.append((start, end, owner))
+        return segments
 
     @singledispatchmethod
     @staticmethod
@@ -62,51 +284,47 @@ class FormRecognizerTextManagementService(AbstractFormRecognizerTextManagementSe
     @staticmethod
     def _(text: PREBUILTLAYOUT) -> List[Tuple[int, int, str]]:
         """
-        This is still MSFT Code. We should double check if this is needed
+        Converts a layout result to page texts in which every table is replaced by its html, placed where the
+        first character of the table is. Works on span intervals, so the runtime grows with the number of
+        pages and table spans instead of with the number of characters.
 
         Args:
             text (PREBUILTLAYOUT): Text from AnalyzeResult
 
         Returns:
-            _type_: _description_
+            List[Tuple[int, int, str]]: page number, offset of the page in the concatenated text and page text
         """
+        tables_by_page: Dict[int, List[DocumentTable]] = {}
+        for table in text.tables or []:
+            tables_by_page.setdefault(table.bounding_regions[0].page_number, []).append(table)  # type: ignore
         offset = 0
         page_map: List[Tuple[int, int, str]] = []
         for page_num, page in enumerate(text.pages):
-            # mark all positions of the table spans in the page
             page_offset = page.spans[0].offset
             page_length = page.spans[0].length
+            tables_on_page = tables_by_page.get(page_num + 1, [])
 
-            page_text = ""
+            parts: List[str] = []
             added_tables = set()
-
-            table_chars = [-1] * page_length
-            if text.tables:
-                tables_on_page = [
-                    table
-                    for table in text.tables
-                    if table.bounding_regions[0].page_number == page_num + 1  # type: ignore
-                ]
-
-                for table_id, table in enumerate(tables_on_page):
-                    for span in table.spans:
-                        # replace all table spans with "table_id" in table_chars array
-                        for i in range(span.length):
-                            idx = span.offset - page_offset + i
-                            if idx >= 0 and idx < page_length:
-                                table_chars[idx] = table_id
-
-            # build page text by replacing charcters in table spans with table html
-            for idx, table_id in enumerate(table_chars):
+            for (
+                start,
+                end,
+                table_id,
+            ) in FormRecognizerTextManagementService._table_owners(
+                tables_on_page, page_offset, page_length
+            ):
                 if table_id == -1:
-                    page_text += text.content[page_offset + idx]
+                    parts.append(text.content[page_offset + start : page_offset + end])
                 elif table_id not in added_tables:
-                    page_text += FormRecognizerTextManagementService.table_to_html(
-                        tables_on_page[table_id]  # type: ignore
+                    parts.append(
+                        FormRecognizerTextManagementService.table_to_html(
+                            tables_on_page[table_id]
+                        )
                     )
                     added_tables.add(table_id)
+            parts.append(" ")
 
-            page_text += " "
+            page_text = "".join(parts)
             page_map.append((page_num, offset, page_text))
             offset += len(page_text)
         return page_map
@@ -123,79 +341,16 @@ class FormRecognizerTextManagementService(AbstractFormRecognizerTextManagementSe
 
     @staticmethod
     def split_text(page_map: List[Tuple[int, int, str]]) -> List[Tuple[str, int]]:
-        MAX_SECTION_LENGTH: int = 1000
-        SENTENCE_SEARCH_LIMIT: int = 100
-        SECTION_OVERLAP: int = 100
-        SENTENCE_ENDINGS = [".", "!", "?"]
-        WORDS_BREAKS = [",", ";", ":", " ", "(", ")", "[", "]", "{", "}", "\t", "\n"]
-
-        def find_page(offset: int) -> int:
-            num_pages = len(page_map)
-            for i in range(num_pages - 1):
-                if offset >= page_map[i][1] and offset < page_map[i + 1][1]:
-                    return i
-            return num_pages - 1
+        return SectionSplitter().split(page_map)
 
-        all_text = "".join(p[2] for p in page_map)
-        length = len(all_text)
-        start: int = 0
-        end = length
-        res: List[Tuple[str, int]] = []
-        while start + SECTION_OVERLAP < length:
-            last_word = -1
-            end = start + MAX_SECTION_LENGTH
-
-            if end > length:
-                end = length
-            else:
-                # Try to find the end of the sentence
-                while (
-                    end < length
-                    and (end - start - MAX_SECTION_LENGTH) < SENTENCE_SEARCH_LIMIT
-                    and all_text[end] not in SENTENCE_ENDINGS
-                ):
-                    if all_text[end] in WORDS_BREAKS:
-                        last_word = end
-                    end += 1
-                if (
-                    end < length
-                    and all_text[end] not in SENTENCE_ENDINGS
-                    and last_word > 0
-                ):
-                    end = last_word  # Fall back to at least keeping a whole word
-            if end < length:
-                end += 1
-
-            # Try to find the start of the sentence or at least a whole word boundary
-            last_word = -1
-            while (
-                start > 0
-                and start > end - MAX_SECTION_LENGTH - 2 * SENTENCE_SEARCH_LIMIT
-                and all_text[start] not in SENTENCE_ENDINGS
-            ):
-                if all_text[start] in WORDS_BREAKS:
-                    last_word = start
-                start -= 1
-            if all_text[start] not in SENTENCE_ENDINGS and last_word > 0:
-                start = last_word
-            if start > 0:
-                start += 1
-
-            section_text = all_text[start:end]
-            res.append((section_text, find_page(start)))
-
-            last_table_start = section_text.rfind("<table")
-            if (
-                last_table_start > 2 * SENTENCE_SEARCH_LIMIT
-                and last_table_start > section_text.rfind("</table")
-            ):
-                # If the section ends with an unclosed table, we need to start the next section with the table.
-                # If table starts inside SENTENCE_SEARCH_LIMIT, we ignore it, as that will cause an infinite loop for tables longer than MAX_SECTION_LENGTH
-                # If last table starts inside SECTION_OVERLAP, keep overlapping
-                start = min(end - SECTION_OVERLAP, start + last_table_start)
-            else:
-                start = end - SECTION_OVERLAP
 
-        if start + SECTION_OVERLAP < end:
-            res.append((all_text[start:end], find_page(start)))
-        return res
+def analyze_result_to_sections(
+    analyze_result: PREBUILTLAYOUT,
+    section_splitter: Optional[SectionSplitter] = None,
+) -> List[Tuple[str, int]]:
+    """Converts an analyzed document to text and splits it into sections, with the default SectionSplitter unless
+    another one is given. Module-level, so the CPU executor can run it in a worker process in one call."""
+    page_map = FormRecognizerTextManagementService.convert_text(analyze_result)
+    if section_splitter is None:
+        return FormRecognizerTextManagementService.split_text(page_map)
+    return section_splitter.split(page_map)
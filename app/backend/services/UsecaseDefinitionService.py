@@ -0,0 +1,119 @@
+import time
+from typing import Any, Dict, List, Tuple, Union
+
+from azure.cosmos.exceptions import CosmosResourceNotFoundError
+
+from customerrors import NotFoundError
+from services.CosmosDBService import CosmosDBService
+
+
+class UsecaseDefinition:
+    """
+    Indexed, read-only view of a UseCaseDefinition document.
+
+    Looks up indices and categories by id in O(1) and returns their positions in the indices/categories arrays,
+    which are needed to build cosmosdb patch paths. The etag is the one of the document the positions were
+    computed from, so patches built from them can be guarded with it.
+    """
+
+    def __init__(self, item: Dict[str, Any]):
+        self.id: str = item["id"]
+        self.etag: Union[str, None] = item.get("_etag")
+        self.item = item
+        self.indices: List[Dict[str, Any]] = item.get("indices", [])
+        self._index_positions: Dict[str, int] = {}
+        self._category_positions: Dict[Tuple[str, str], Tuple[int, int]] = {}
+        for index_idx, index in enumerate(self.indices):
+            self._index_positions[index["id"]] = index_idx
+            for category_idx, category in enumerate(index.get("categories", [])):
+                self._category_positions[(index["id"], category["id"])] = (
+                    index_idx,
+                    category_idx,
+                )
+
+    def index_position(self, index_id: str) -> int:
+        try:
+            return self._index_positions[index_id]
+        except KeyError:
+            raise NotFoundError(f"Could not find index with id {index_id}", 404)
+
+    def category_position(self, index_id: str, category_id: str) -> Tuple[int, int]:
+        try:
+            return self._category_positions[(index_id, category_id)]
+        except KeyError:
+            raise NotFoundError(f"Could not find category with id: {category_id}", 404)
+
+    def has_category(self, index_id: str, category_id: str) -> bool:
+        return (index_id, category_id) in self._category_positions
+
+    def get_index(self, index_id: str) -> Dict[str, Any]:
+        return self.indices[self.index_position(index_id)]
+
+    def get_category(self, index_id: str, category_id: str) -> Dict[str, Any]:
+        index_idx, category_idx = self.category_position(index_id, category_id)
+        return self.indices[index_idx]["categories"][category_idx]
+
+
+class UsecaseDefinitionCache:
+    """
+    In-process cache of the UseCaseDefinition documents, keyed by usecasetype id.
+
+    Reads on the chat path use the cached document for up to `ttl` seconds. Write paths read the document fresh
+    (a point read) right before patching, guard the patch with the document's etag and store the patched document
+    returned by cosmosdb, so this worker sees its own changes immediately. Other workers pick them up after the ttl.
+    """
+
+    _DATABASE = "Demo"
+    _CONTAINER = "UseCaseDefinition"
+    DEFAULT_TTL = 60
+
+    def __init__(self, ttl: float = DEFAULT_TTL):
+        self.ttl = ttl
+        self._definitions: Dict[str, Tuple[UsecaseDefinition, float]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, usecasetype_id: str, refresh: bool = False) -> UsecaseDefinition:
+        """Returns the definition of a usecasetype
+
+        Args:
+            usecasetype_id (str): id of the UseCaseDefinition document
+            refresh (bool, optional): bypass the cache and read the document from cosmosdb. Defaults to False.
+
+        Raises:
+            NotFoundError: the document does not exist
+
+        Returns:
+            UsecaseDefinition:
+        """
+        entry = self._definitions.get(usecasetype_id)
+        if not refresh and entry is not None and entry[1] > time.monotonic():
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        try:
+            item = await CosmosDBService(
+                database=self._DATABASE, container=self._CONTAINER
+            ).read(item_id=usecasetype_id, partition_key=usecasetype_id)
+        except CosmosResourceNotFoundError:
+            self.invalidate(usecasetype_id)
+            raise NotFoundError(
+                f"Could not find usecasetype with id {usecasetype_id}", 404
+            )
+        return self.store(item)
+
+    def store(self, item: Dict[str, Any]) -> UsecaseDefinition:
+        """Stores a document, e.g. the one returned by a patch, and returns its indexed view"""
+        definition = UsecaseDefinition(item)
+        self._definitions[definition.id] = (definition, time.monotonic() + self.ttl)
+        return definition
+
+    def invalidate(self, usecasetype_id: str) -> None:
+        self._definitions.pop(usecasetype_id, None)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "definitions": len(self._definitions),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -1,9 +1,10 @@
 from abc import ABC, abstractmethod
 from enum import Enum
-from typing import List, TypeVar, Generic
+from typing import List, Optional, TypeVar, Generic
 from collections.abc import Mapping
 
 from models.Models import CognitiveSearchEmbeddingModel, CognitiveSearchModel
+from services.TextManagementService import SectionSplitter, TokenSectionSplitter
 from strategies.ABCContext import AbstractContext
 
 
@@ -13,8 +14,18 @@ _CognitiveSearchModel = TypeVar(
 
 
 class CognitiveSearchIndexContext(AbstractContext):
-    def __init__(self, strategy: "AbstractCognitiveSearchIndexStrategy"):
+    def __init__(
+        self,
+        strategy: "AbstractCognitiveSearchIndexStrategy",
+        section_splitter: Optional[SectionSplitter] = None,
+    ):
         self._strategy = strategy
+        self._section_splitter = section_splitter or SectionSplitter()
+
+    @property
+    def section_splitter(self) -> SectionSplitter:
+        """Splits the documents ingested into the index into sections"""
+        return self._section_splitter
 
     def create_index_model(self, **kwargs) -> _CognitiveSearchModel:
         return self._strategy.create_index_model(**kwargs)
@@ -63,6 +74,8 @@ class CognitiveSearchIndexStandardStrategy(AbstractCognitiveSearchIndexStrategy)
 class Indices(Enum):
     GPTKBINDEX = "gptkbindex"
     GPTKBINDEX_WO_EMBD = "gptkbindex-woe"
+    # sections are measured in tokens instead of characters
+    GPTKBINDEX_WO_EMBD_TOKENS = "gptkbindex-woe-tokens"
 
 
 class IndexStrategyMapping(Mapping):
@@ -73,6 +86,10 @@ class IndexStrategyMapping(Mapping):
         Indices.GPTKBINDEX_WO_EMBD.value: CognitiveSearchIndexContext(
             strategy=CognitiveSearchIndexStandardStrategy()
         ),
+        Indices.GPTKBINDEX_WO_EMBD_TOKENS.value: CognitiveSearchIndexContext(
+            strategy=CognitiveSearchIndexStandardStrategy(),
+            section_splitter=TokenSectionSplitter(),
+        ),
     }
 
     def __getitem__(self, key):
@@ -9,8 +9,7 @@ from typing import (
     Type,
 )
 import openai
-from quart import request, current_app, jsonify
-import requests
+from quart import g, request, current_app, jsonify
 from jose import jwt
 import os
 import random
@@ -23,9 +22,59 @@ from customerrors import (
     AuthError,
     NotInJsonFormatError,
     NotAValidPostRequest,
+    NotFoundError,
+    PreconditionFailedError,
+    InvalidQueryParameterError,
 )
 
 from schemas.BaseSchemas import BaseSchema
+from core.jwks import JWKSKeyStore
+from core.tokencache import VerifiedTokenCache
+
+CONFIG_JWKS_KEYSTORE = "jwks_keystore"
+CONFIG_TOKEN_CACHE = "token_cache"
+
+
+async def verify_token(id_token: str) -> Dict[str, Any]:
+    """Verifies the signature and claims of a JWT against the signing keys of the JWKS key store
+
+    Args:
+        id_token (str): the bearer token
+
+    Raises:
+        AuthError: token can not be parsed or is not valid
+
+    Returns:
+        Dict[str, Any]: the verified payload
+    """
+    try:
+        jwt_header = jwt.get_unverified_headers(id_token)
+        keystore: JWKSKeyStore = current_app.config[CONFIG_JWKS_KEYSTORE]
+        rsa_key = await keystore.get_key(jwt_header["kid"])
+    except Exception:
+        raise AuthError(
+            {
+                "code": "invalid token",
+                "description": "Unable to parse authentication token",
+            },
+            401,
+        )
+    try:
+        payload = jwt.decode(
+            token=id_token,
+            key=rsa_key,
+            algorithms=["RS256"],
+            audience=os.getenv("AZURE_CLIENT_ID_AUTH"),
+            issuer="https://login.microsoftonline.com/{tenant_id}/v2.0".format(
+                tenant_id=os.getenv("AZURE_TENANT_ID_AUTH")
+            ),
+        )
+    except Exception as exc:
+        raise AuthError(
+            {"code": "Not Authorized", "description": "Provided token is wrong"},
+            401,
+        )
+    return payload
 
 
 def require_auth(func):
@@ -65,53 +114,42 @@ def require_auth(func):
                 {"code": "invalid header", "description": "No Token provided"}, 401
             )
         id_token = auth.token
-        try:
-            jwks = requests.get(
-                "https://login.microsoftonline.com/{tenant_id}/discovery/v2.0/keys".format(
-                    tenant_id=os.getenv("AZURE_TENANT_ID_AUTH")
-                )
-            ).json()  # TODO: Replace AZURE_TENANT_ID_AUTH with AZURE_TENANT_ID if AAD in Sandbox is set up
-            jwt_header = jwt.get_unverified_headers(id_token)
-            rsa_key = {}
-            for key in jwks["keys"]:
-                if key["kid"] == jwt_header["kid"]:
-                    rsa_key = {
-                        "kty": key["kty"],
-                        "kid": key["kid"],
-                        "use": key["use"],
-                        "n": key["n"],
-                        "e": key["e"],
-                    }
-        except Exception:
-            raise AuthError(
-                {
-                    "code": "invalid token",
-                    "description": "Unable to parse authentication token",
-                },
-                401,
-            )
-        try:
-            payload = jwt.decode(
-                token=id_token,
-                key=rsa_key,
-                algorithms=["RS256"],
-                audience=os.getenv("AZURE_CLIENT_ID_AUTH"),
-                issuer="https://login.microsoftonline.com/{tenant_id}/v2.0".format(
-                    tenant_id=os.getenv("AZURE_TENANT_ID_AUTH")
-                ),
-            )
-        except Exception as exc:
-            raise AuthError(
-                {"code": "Not Authorized", "description": "Provided token is wrong"},
-                401,
-            )
-        # TODO: Check if we need global/ user
-        current_app.config["user"] = payload
+        token_cache: VerifiedTokenCache = current_app.config[CONFIG_TOKEN_CACHE]
+        payload = token_cache.get(id_token)
+        if payload is None:
+            payload = await verify_token(id_token)
+            token_cache.set(id_token, payload)
+        # g is scoped to the current request, so concurrent requests never see each others identity
+        g.user = payload
         return await func(*args, **kwargs)
 
     return checkToken
 
 
+def current_user() -> Dict[str, Any]:
+    """Returns the verified token payload of the user of the current request. Only available in routes decorated
+    with require_auth.
+
+    Raises:
+        AuthError: no authenticated user in the current request context
+
+    Returns:
+        Dict[str, Any]: the token payload
+    """
+    user = g.get("user")
+    if user is None:
+        raise AuthError(
+            {"code": "Not Authorized", "description": "No authenticated user"},
+            401,
+        )
+    return user
+
+
+def current_user_id() -> str:
+    """Returns the object id (oid) of the user of the current request"""
+    return current_user()["oid"]
+
+
 def validate_json_request(schema: Type[BaseSchema]):
     def dec(func):
         @wraps(func)
@@ -175,6 +213,12 @@ def catch_and_return_http_code(f):
             return jsonify({"error": e.error}), e.status_code
         except AuthError as e:
             return jsonify({"error": e.error}), e.status_code
+        except (
+            NotFoundError,
+            PreconditionFailedError,
+            InvalidQueryParameterError,
+        ) as e:
+            return jsonify({"error": e.error}), e.status_code
         except Exception as e:
             return jsonify({"error": str(e), "traceback": traceback.format_exc()}), 500
 
@@ -3,6 +3,8 @@ import { useMsal, useMsalAuthentication } from "@azure/msal-react";
 import { useCallback } from "react";
 import { AuthenticationError, ServerError } from "../errors/errors";
 
+const JOB_POLL_INTERVAL = 2000;
+
 export const useFetchWithMsal = () => {
     const { instance, accounts } = useMsal();
 
@@ -22,29 +24,49 @@ export const useFetchWithMsal = () => {
         }
     };
 
-    const customFetch = (msalRequest: SilentRequest, endpoint: RequestInfo | URL, init: RequestInit) =>
-        catch_and_return(async () => {
-            const headers = new Headers(init.headers);
-            let idToken;
-            // User is logged in but potentially has no token yet
-            if (accounts.length > 0) {
-                if ("idToken" in accounts[0]) {
-                    // Token is acquired, use provided token
-                    idToken = accounts[0].idToken;
-                } else {
-                    // Token not yet acquired. acquire token silent
-                    const data: AuthenticationResult = await instance.acquireTokenSilent(msalRequest);
-                    idToken = data.idToken;
-                }
+    const authorizedFetch = async (msalRequest: SilentRequest, endpoint: RequestInfo | URL, init: RequestInit) => {
+        const headers = new Headers(init.headers);
+        let idToken;
+        // User is logged in but potentially has no token yet
+        if (accounts.length > 0) {
+            if ("idToken" in accounts[0]) {
+                // Token is acquired, use provided token
+                idToken = accounts[0].idToken;
+            } else {
+                // Token not yet acquired. acquire token silent
+                const data: AuthenticationResult = await instance.acquireTokenSilent(msalRequest);
+                idToken = data.idToken;
             }
-            const bearer = `Bearer ${idToken}`;
-            headers.append("Authorization", bearer);
-            return fetch(endpoint, {
-                ...init,
-                cache: "no-cache",
-                headers: headers
-            });
+        }
+        const bearer = `Bearer ${idToken}`;
+        headers.append("Authorization", bearer);
+        return fetch(endpoint, {
+            ...init,
+            cache: "no-cache",
+            headers: headers
         });
+    };
+
+    // Uploads are processed in the background: the server answers with 202 and the url of the job,
+    // which is polled until the job is done. The result of the job is returned like a direct response.
+    const waitForJob = async (msalRequest: SilentRequest, job: any) => {
+        while (job.status === "queued" || job.status === "running") {
+            await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL));
+            job = await catch_and_return(() => authorizedFetch(msalRequest, job.status_url, { method: "GET" }));
+        }
+        if (job.status === "failed") {
+            throw new ServerError(job.error);
+        }
+        return job.result;
+    };
+
+    const customFetch = async (msalRequest: SilentRequest, endpoint: RequestInfo | URL, init: RequestInit) => {
+        const data = await catch_and_return(() => authorizedFetch(msalRequest, endpoint, init));
+        if (data && data.job_id && data.status_url) {
+            return waitForJob(msalRequest, data);
+        }
+        return data;
+    };
 
     return { customFetch: useCallback(customFetch, []) };
 };
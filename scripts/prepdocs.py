@@ -1,5 +1,6 @@
 import argparse
 import base64
+import bisect
 import glob
 import html
 import io
@@ -193,56 +194,69 @@ def get_document_text(filename):
     return page_map
 
 
-def split_text(page_map):
-    SENTENCE_ENDINGS = [".", "!", "?"]
-    WORDS_BREAKS = [",", ";", ":", " ", "(", ")", "[", "]", "{", "}", "\t", "\n"]
+SENTENCE_ENDINGS = [".", "!", "?"]
+WORDS_BREAKS = [",", ";", ":", " ", "(", ")", "[", "]", "{", "}", "\t", "\n"]
+
+
+def character_positions(text, characters):
+    pattern = "[" + "".join(re.escape(c) for c in characters) + "]"
+    return [m.start() for m in re.finditer(pattern, text)]
+
+
+def split_text(
+    page_map,
+    max_section_length=MAX_SECTION_LENGTH,
+    sentence_search_limit=SENTENCE_SEARCH_LIMIT,
+    section_overlap=SECTION_OVERLAP,
+):
     if args.verbose:
         print(f"Splitting '{filename}' into sections")
 
+    page_offsets = [p[1] for p in page_map]
+
     def find_page(offset):
-        num_pages = len(page_map)
-        for i in range(num_pages - 1):
-            if offset >= page_map[i][1] and offset < page_map[i + 1][1]:
-                return i
-        return num_pages - 1
+        page = bisect.bisect_right(page_offsets, offset) - 1
+        return page if page >= 0 else len(page_map) - 1
 
     all_text = "".join(p[2] for p in page_map)
+    # Sentence endings and word breaks are looked up by binary search instead of scanning the text
+    endings = character_positions(all_text, SENTENCE_ENDINGS)
+    breaks = character_positions(all_text, WORDS_BREAKS)
     length = len(all_text)
     start = 0
     end = length
-    while start + SECTION_OVERLAP < length:
-        last_word = -1
-        end = start + MAX_SECTION_LENGTH
+    while start + section_overlap < length:
+        end = start + max_section_length
 
         if end > length:
             end = length
         else:
             # Try to find the end of the sentence
-            while (
-                end < length
-                and (end - start - MAX_SECTION_LENGTH) < SENTENCE_SEARCH_LIMIT
-                and all_text[end] not in SENTENCE_ENDINGS
-            ):
-                if all_text[end] in WORDS_BREAKS:
-                    last_word = end
-                end += 1
-            if end < length and all_text[end] not in SENTENCE_ENDINGS and last_word > 0:
-                end = last_word  # Fall back to at least keeping a whole word
+            limit = min(length, end + sentence_search_limit)
+            i = bisect.bisect_left(endings, end)
+            sentence_end = (
+                endings[i] if i < len(endings) and endings[i] < limit else limit
+            )
+            if sentence_end < length and all_text[sentence_end] not in SENTENCE_ENDINGS:
+                # Fall back to at least keeping a whole word
+                j = bisect.bisect_left(breaks, sentence_end) - 1
+                if j >= 0 and breaks[j] >= end and breaks[j] > 0:
+                    sentence_end = breaks[j]
+            end = sentence_end
         if end < length:
             end += 1
 
         # Try to find the start of the sentence or at least a whole word boundary
-        last_word = -1
-        while (
-            start > 0
-            and start > end - MAX_SECTION_LENGTH - 2 * SENTENCE_SEARCH_LIMIT
-            and all_text[start] not in SENTENCE_ENDINGS
-        ):
-            if all_text[start] in WORDS_BREAKS:
-                last_word = start
-            start -= 1
-        if all_text[start] not in SENTENCE_ENDINGS and last_word > 0:
-            start = last_word
+        floor = max(0, end - max_section_length - 2 * sentence_search_limit)
+        sentence_start = start
+        if start > floor:
+            i = bisect.bisect_right(endings, start) - 1
+            sentence_start = endings[i] if i >= 0 and endings[i] > floor else floor
+        if all_text[sentence_start] not in SENTENCE_ENDINGS:
+            j = bisect.bisect_right(breaks, sentence_start)
+            if j < len(breaks) and breaks[j] <= start and breaks[j] > 0:
+                sentence_start = breaks[j]
+        start = sentence_start
         if start > 0:
             start += 1
 
@@ -251,7 +265,7 @@ def split_text(page_map):
 
         last_table_start = section_text.rfind("<table")
         if (
-            last_table_start > 2 * SENTENCE_SEARCH_LIMIT
+            last_table_start > 2 * sentence_search_limit
             and last_table_start > section_text.rfind("</table")
         ):
             # If the section ends with an unclosed table, we need to start the next section with the table.
@@ -261,11 +275,11 @@ def split_text(page_map):
                 print(
                     f"Section ends with unclosed table, starting next section with the table at page {find_page(start)} offset {start} table start {last_table_start}"
                 )
-            start = min(end - SECTION_OVERLAP, start + last_table_start)
+            start = min(end - section_overlap, start + last_table_start)
         else:
-            start = end - SECTION_OVERLAP
+            start = end - section_overlap
 
-    if start + SECTION_OVERLAP < end:
+    if start + section_overlap < end:
         yield (all_text[start:end], find_page(start))
 
 
@@ -277,7 +291,13 @@ def filename_to_id(filename):
 
 def create_sections(filename, page_map, use_vectors):
     file_id = filename_to_id(filename)
-    for i, (content, pagenum) in enumerate(split_text(page_map)):
+    for i, (content, pagenum) in enumerate(
+        split_text(
+            page_map,
+            max_section_length=args.sectionlength,
+            section_overlap=args.sectionoverlap,
+        )
+    ):
         section = {
             "id": f"{file_id}-page-{i}",
             "content": content,
@@ -608,6 +628,18 @@ if __name__ == "__main__":
         "--openaideployment",
         help="Name of the Azure OpenAI model deployment for an embedding model ('text-embedding-ada-002' recommended)",
     )
+    parser.add_argument(
+        "--sectionlength",
+        type=int,
+        default=MAX_SECTION_LENGTH,
+        help="Length in characters a section grows to before it is ended at the next sentence ending",
+    )
+    parser.add_argument(
+        "--sectionoverlap",
+        type=int,
+        default=SECTION_OVERLAP,
+        help="Number of characters repeated at the start of the next section",
+    )
     parser.add_argument(
         "--novectors",
         action="store_true",
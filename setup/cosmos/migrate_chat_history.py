@@ -0,0 +1,139 @@
+import argparse
+import logging
+from typing import Any, Dict, List
+
+from azure.cosmos import CosmosClient, PartitionKey
+
+# Each call of the previous ChatHistoryService.add_to_history appended the question and the answer of one turn
+ENTRIES_PER_TURN = 2
+
+
+def conversation_item_id(category_id: str, conversation_id: str) -> str:
+    return f"{category_id}_{conversation_id}"
+
+
+def to_items(document: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Converts a chat history document of the previous layout, which held all conversations of a user in a category,
+    into one item per conversation and one item per turn, as stored by ChatHistoryService.
+
+    The previous layout only kept the creation time of a conversation, so the turns are ordered by adding their
+    position to it.
+
+    Args:
+        document (Dict[str, Any]): {"id", "userId", "category_id", "histories": [{"conversation_id", "topic",
+                                   "timestamp", "history": [...]}]}
+
+    Returns:
+        List[Dict[str, Any]]: the conversation item of every conversation, followed by its turn items
+    """
+    items = []
+    for conversation in document.get("histories", []):
+        item_id = conversation_item_id(
+            document["category_id"], conversation["conversation_id"]
+        )
+        history = conversation["history"]
+        turns = [
+            history[i : i + ENTRIES_PER_TURN]
+            for i in range(0, len(history), ENTRIES_PER_TURN)
+        ]
+        common = {
+            "userId": document["userId"],
+            "category_id": document["category_id"],
+            "conversation_id": conversation["conversation_id"],
+        }
+        items.append(
+            {
+                "id": item_id,
+                "type": "conversation",
+                **common,
+                "topic": conversation["topic"],
+                "timestamp": conversation["timestamp"],
+            }
+        )
+        for position, turn in enumerate(turns):
+            created = conversation["timestamp"] * 10**9 + position
+            items.append(
+                {
+                    "id": f"{item_id}_{created:020d}",
+                    "type": "turn",
+                    **common,
+                    "created": created,
+                    "history": turn,
+                }
+            )
+    return items
+
+
+def migrate_chat_history(args):
+    """
+    Script to migrate the chat histories from one document per user and category (container "ChatHistory",
+    partitioned by /id) to one item per conversation and turn (container "Conversations", partitioned by /userId).
+    The target container is created if it does not exist. Items are upserted, so the script can be run again after
+    an interruption. Migrated documents are only deleted from the source container with --deletesource.
+
+    Args:
+        args (_type_): --cosmosservice: Name of the CosmosDB service (must exist already), only the name, not the whole url of the endpoint
+                       --apikey: API Key of the Azure directory where to authenticate, to be found at https://portal.azure.com/
+                       --database, --source, --target: names of the database and of the source and target containers
+                       --deletesource: delete every document from the source container once it is migrated
+    """
+    cosmos_client = CosmosClient(
+        url=f"https://{args.cosmosservice}.documents.azure.com/",
+        credential=args.apikey,
+    )
+    database = cosmos_client.get_database_client(args.database)
+    source = database.get_container_client(args.source)
+    target = database.create_container_if_not_exists(
+        id=args.target, partition_key=PartitionKey(path="/userId")
+    )
+    migrated = 0
+    for document in source.query_items(
+        query="SELECT * FROM c", enable_cross_partition_query=True
+    ):
+        items = to_items(document)
+        for item in items:
+            target.upsert_item(item)
+        if args.deletesource:
+            source.delete_item(item=document["id"], partition_key=document["id"])
+        migrated += 1
+        logging.info(
+            f"Migrated document {document['id']} into {len(items)} items ({migrated} documents)"
+        )
+    print(f"Migrated {migrated} chat history documents")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--cosmosservice",
+        required=True,
+        help="Name of the CosmosDB service (must exist already)",
+    )
+    parser.add_argument(
+        "--apikey",
+        required=True,
+        help="Use this to define the Azure directory where to authenticate",
+    )
+    parser.add_argument("--database", default="User", help="Name of the database")
+    parser.add_argument(
+        "--source",
+        default="ChatHistory",
+        help="Container with one chat history document per user and category",
+    )
+    parser.add_argument(
+        "--target",
+        default="Conversations",
+        help="Container for one item per conversation and turn, created if missing",
+    )
+    parser.add_argument(
+        "--deletesource",
+        action="store_true",
+        help="Delete the migrated documents from the source container",
+    )
+
+    args = parser.parse_args()
+
+    migrate_chat_history(args)
@@ -0,0 +1,278 @@
+"""
+Request units and latency of the chat history operations, per storage layout.
+
+Compares the previous layout, one document per user and category holding all conversations, with the layout of
+ChatHistoryService, one item per conversation and per turn partitioned by user, for users with 10, 100 and 1000
+conversations. For every size, both layouts are seeded with the same conversations and every operation is timed
+`--repeat` times; the request charge is summed over all requests of an operation (x-ms-request-charge). The previous
+layout cannot store users whose document would exceed the 2 MB item limit of Cosmos DB; those rows are reported as
+such.
+
+Needs a Cosmos DB account. The database given by --database is created and deleted again. Run from the repository
+root:
+    PYTHONPATH=app/backend:. python tests/benchmark_chathistory.py --endpoint <url> --key <key>
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from azure.cosmos import PartitionKey
+from azure.cosmos.aio import CosmosClient
+from azure.cosmos.exceptions import CosmosHttpResponseError
+from quart import Quart
+from setup.cosmos.migrate_chat_history import to_items
+
+from services.ChatHistoryService import ChatHistoryService
+from services.CosmosDBService import CONFIG_COSMOSDB_CLIENT, CosmosDBService
+
+LEGACY_CONTAINER = "ChatHistory"
+OPERATIONS = ["list", "read", "append", "new"]
+
+
+class RequestCharge:
+    """Sums the request charges of all responses, as raw_response_hook of the client"""
+
+    def __init__(self):
+        self.total = 0.0
+
+    def __call__(self, response) -> None:
+        self.total += float(
+            response.http_response.headers.get("x-ms-request-charge", 0)
+        )
+
+
+class LegacyChatHistory:
+    """The calls of the previous ChatHistoryService, one document per user and category"""
+
+    def __init__(self, database: str):
+        self.cdb_service = CosmosDBService(database, LEGACY_CONTAINER)
+
+    async def get_all_histories(self, user_id: str, category_id: str):
+        items = await self.cdb_service.query(
+            query=f"SELECT c.histories from {LEGACY_CONTAINER} c where c.userId = @user_id and c.category_id = @category_id",
+            params=[
+                {"name": "@user_id", "value": user_id},
+                {"name": "@category_id", "value": category_id},
+            ],
+        )
+        return [
+            (h["conversation_id"], h["timestamp"], h["topic"])
+            for h in items[0]["histories"]
+        ]
+
+    async def get_conversation(
+        self, user_id: str, category_id: str, conversation_id: str
+    ):
+        items = await self.cdb_service.query(
+            query=f"SELECT t.history FROM {LEGACY_CONTAINER} c JOIN t in c.histories where c.userId = @user_id and c.category_id = @category_id and t.conversation_id = @conversation_id ",
+            params=[
+                {"name": "@user_id", "value": user_id},
+                {"name": "@category_id", "value": category_id},
+                {"name": "@conversation_id", "value": conversation_id},
+            ],
+        )
+        return items[0]
+
+    async def add_to_history(
+        self,
+        user_id: str,
+        category_id: str,
+        conversation_id: str,
+        history: List[Dict],
+        new_conversation: bool = False,
+    ) -> None:
+        items = await self.cdb_service.query(
+            query=f"Select * from {LEGACY_CONTAINER} c where c.userId = @user_id and c.category_id = @category_id",
+            params=[
+                {"name": "@user_id", "value": user_id},
+                {"name": "@category_id", "value": category_id},
+            ],
+        )
+        item = items[0]
+        conversation_idx = next(
+            (
+                i
+                for i, itm in enumerate(item["histories"])
+                if itm["conversation_id"] == conversation_id
+            ),
+            None,
+        )
+        if conversation_idx is None:
+            patch = [
+                {
+                    "op": "add",
+                    "path": "/histories/-",
+                    "value": {
+                        "conversation_id": conversation_id,
+                        "topic": history[0]["user"],
+                        "timestamp": int(datetime.now().timestamp()),
+                        "history": history,
+                    },
+                }
+            ]
+        else:
+            patch = [
+                {
+                    "op": "add",
+                    "path": f"/histories/{conversation_idx}/history/-",
+                    "value": entry,
+                }
+                for entry in history
+            ]
+        await self.cdb_service.patch(
+            item_id=item["id"], partition_key=item["id"], patch=patch
+        )
+
+
+def make_turn(i: int, answer_chars: int) -> List[Dict[str, Any]]:
+    return [
+        {"user": f"Question {i}?"},
+        {
+            "answer": "a" * answer_chars,
+            "data_points": [f"doc-{j}.pdf: " + "d" * 200 for j in range(3)],
+            "thoughts": "Searched for: question",
+        },
+    ]
+
+
+def legacy_document(
+    user_id: str, conversations: int, turns: int, answer_chars: int
+) -> Dict[str, Any]:
+    now = int(time.time())
+    return {
+        "id": str(uuid.uuid4()),
+        "userId": user_id,
+        "category_id": "category",
+        "histories": [
+            {
+                "conversation_id": f"conversation-{i}",
+                "topic": f"Question {i}?",
+                "timestamp": now - conversations + i,
+                "history": [
+                    entry for t in range(turns) for entry in make_turn(t, answer_chars)
+                ],
+            }
+            for i in range(conversations)
+        ],
+    }
+
+
+async def measure(
+    charge: RequestCharge, operation: Callable[[], Awaitable[Any]], repeat: int
+) -> Tuple[float, float]:
+    """Returns the mean request charge and the median latency in ms of an operation"""
+    charges = []
+    latencies = []
+    for _ in range(repeat):
+        before = charge.total
+        start = time.perf_counter()
+        await operation()
+        latencies.append((time.perf_counter() - start) * 1000)
+        charges.append(charge.total - before)
+    return statistics.mean(charges), statistics.median(latencies)
+
+
+async def seed(container, items: List[Dict[str, Any]], concurrency: int = 20) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def upsert(item):
+        async with semaphore:
+            await container.upsert_item(item)
+
+    await asyncio.gather(*(upsert(item) for item in items))
+
+
+async def run(args) -> None:
+    charge = RequestCharge()
+    app = Quart(__name__)
+    async with CosmosClient(
+        args.endpoint, credential=args.key, raw_response_hook=charge
+    ) as client, app.app_context():
+        app.config[CONFIG_COSMOSDB_CLIENT] = client
+        database = await client.create_database_if_not_exists(args.database)
+        try:
+            legacy_container = await database.create_container_if_not_exists(
+                id=LEGACY_CONTAINER, partition_key=PartitionKey(path="/id")
+            )
+            container = await database.create_container_if_not_exists(
+                id=ChatHistoryService._CONTAINER,
+                partition_key=PartitionKey(path="/userId"),
+            )
+            ChatHistoryService._DATABASE = args.database
+            legacy = LegacyChatHistory(args.database)
+            print(
+                f"{'conversations':>13} {'layout':>9} "
+                + " ".join(f"{op + ' [RU / ms]':>20}" for op in OPERATIONS)
+            )
+            for size in args.sizes:
+                user_id = f"user-{size}"
+                document = legacy_document(user_id, size, args.turns, args.answerchars)
+                await seed(container, to_items(document))
+                rows = {"per item": ChatHistoryService, "legacy": legacy}
+                try:
+                    await legacy_container.create_item(document)
+                except CosmosHttpResponseError as e:
+                    if e.status_code != 413:
+                        raise
+                    print(f"{size:>13} {'legacy':>9} document exceeds 2 MB")
+                    del rows["legacy"]
+                middle = f"conversation-{size // 2}"
+                for layout, service in rows.items():
+                    turn = make_turn(args.turns, args.answerchars)
+                    results = [
+                        await measure(
+                            charge,
+                            lambda: service.get_all_histories(user_id, "category"),
+                            args.repeat,
+                        ),
+                        await measure(
+                            charge,
+                            lambda: service.get_conversation(
+                                user_id, "category", middle
+                            ),
+                            args.repeat,
+                        ),
+                        await measure(
+                            charge,
+                            lambda: service.add_to_history(
+                                user_id, "category", middle, turn
+                            ),
+                            args.repeat,
+                        ),
+                        await measure(
+                            charge,
+                            lambda: service.add_to_history(
+                                user_id,
+                                "category",
+                                str(uuid.uuid4()),
+                                turn,
+                                new_conversation=True,
+                            ),
+                            args.repeat,
+                        ),
+                    ]
+                    print(
+                        f"{size:>13} {layout:>9} "
+                        + " ".join(
+                            f"{f'{ru:.1f} / {ms:.0f}':>20}" for ru, ms in results
+                        )
+                    )
+        finally:
+            await client.delete_database(args.database)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--endpoint", required=True, help="Cosmos DB account url")
+    parser.add_argument("--key", required=True, help="Cosmos DB account key")
+    parser.add_argument("--database", default="ChatHistoryBenchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--turns", type=int, default=4, help="turns per conversation")
+    parser.add_argument("--answerchars", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,72 @@
+"""
+Micro-benchmark of the chat history assembly in MessageBuilder.
+
+Compares the previous assembly, which inserted every history message at a fixed index of a list, with
+MessageBuilder.build over histories of 10 to 500 turns. Token counting is replaced by a word count, so only the
+assembly itself is measured.
+
+Run from the repository root:
+    PYTHONPATH=app/backend python tests/benchmark_messagebuilder.py
+"""
+import argparse
+import timeit
+from typing import Dict, List
+from unittest import mock
+
+from core.messagebuilder import MessageBuilder
+
+MODEL = "gpt-35-turbo"
+
+
+class WordEncoding:
+    name = "words"
+
+    def encode_batch(self, texts):
+        return [text.split() for text in texts]
+
+
+def make_turns(n: int) -> List[List[Dict[str, str]]]:
+    return [
+        [
+            {"role": "user", "content": f"question {i} " * 20},
+            {"role": "assistant", "content": f"answer {i} " * 60},
+        ]
+        for i in range(n)
+    ]
+
+
+def build_with_insert(turns: List[List[Dict[str, str]]]) -> List[Dict[str, str]]:
+    builder = MessageBuilder("system", MODEL)
+    builder.append_message("user", "latest question")
+    for turn in turns:
+        for message in reversed(turn):
+            builder.append_message(message["role"], message["content"], index=1)
+    return builder.messages
+
+
+def build_with_segments(turns: List[List[Dict[str, str]]]) -> List[Dict[str, str]]:
+    builder = MessageBuilder("system", MODEL)
+    builder.append_trailing("user", "latest question")
+    return builder.build(turns, max_tokens=10**9)
+
+
+def run(sizes: List[int], number: int) -> None:
+    print(f"{'turns':>6} {'insert [ms]':>12} {'build [ms]':>12} {'ratio':>7}")
+    for size in sizes:
+        turns = make_turns(size)
+        assert build_with_insert(turns) == build_with_segments(turns)
+        insert = timeit.timeit(lambda: build_with_insert(turns), number=number)
+        build = timeit.timeit(lambda: build_with_segments(turns), number=number)
+        print(
+            f"{size:>6} {insert / number * 1000:>12.3f} {build / number * 1000:>12.3f}"
+            f" {insert / build:>7.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 100, 250, 500])
+    parser.add_argument("--number", type=int, default=20)
+    args = parser.parse_args()
+    with mock.patch("core.tokencounter.get_encoding", return_value=WordEncoding()):
+        run(args.sizes, args.number)
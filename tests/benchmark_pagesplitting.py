@@ -0,0 +1,140 @@
+"""
+Peak memory of splitting uploaded pdfs into single-page pdfs.
+
+Compares the previous eager splitting, which held the file bytes, a BytesIO copy and the bytes of every page at once,
+with the lazy FileReaderService.iter_pages used by the file management strategies and with split_pdf_to_files run
+by a process pool over chunks of pages. Every variant runs in a fresh interpreter and reports the growth of the peak
+RSS (plus the growth of every worker, for the process pool) per MB of pdf.
+
+Run from the repository root:
+    PYTHONPATH=app/backend python tests/benchmark_pagesplitting.py
+"""
+import argparse
+import io
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+from pypdf import PdfWriter
+from pypdf.generic import DecodedStreamObject, NameObject
+
+from services.FileReaderService import FileReaderService, split_pdf_to_files
+
+VARIANTS = ["eager", "lazy", "process_pool"]
+
+
+def make_pdf(path: str, pages: int) -> None:
+    writer = PdfWriter()
+    for i in range(pages):
+        page = writer.add_blank_page(width=612, height=792)
+        content = DecodedStreamObject()
+        content.set_data(
+            (f"BT /F1 10 Tf 10 10 Td (page {i} {'x' * 80}) Tj ET\n" * 300).encode()
+        )
+        page[NameObject("/Contents")] = writer._add_object(content)
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+def peak_rss_kb() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+# every split returns the additional peak RSS in KB outside of the measuring process, if any
+
+
+def split_eager(path: str) -> int:
+    with open(path, "rb") as f:
+        file_bytes = f.read()
+    file_io = io.BytesIO(file_bytes)
+    # the file bytes, their BytesIO and all pages are alive at the same time, as before
+    pages = FileReaderService(stream=file_io).pages_to_bytes()
+    del pages
+    return 0
+
+
+def split_lazy(path: str) -> int:
+    with open(path, "rb") as f:
+        for page in FileReaderService(stream=f).iter_pages():
+            # stands in for the blob upload of the page
+            page.getbuffer().nbytes
+    return 0
+
+
+def split_chunk(path: str, directory: str, start: int, stop: int) -> int:
+    """Runs in a worker and returns its peak RSS growth in KB"""
+    before = peak_rss_kb()
+    split_pdf_to_files(path, directory, start, stop)
+    return peak_rss_kb() - before
+
+
+def split_process_pool(path: str, workers: int = 2) -> int:
+    with open(path, "rb") as f:
+        pages = len(FileReaderService(stream=f).pages)
+    chunk = -(-pages // workers)
+    with tempfile.TemporaryDirectory() as directory, ProcessPoolExecutor(
+        workers
+    ) as pool:
+        # the workers run concurrently, so their growths add up
+        return sum(
+            pool.map(
+                split_chunk,
+                [path] * workers,
+                [directory] * workers,
+                range(0, pages, chunk),
+                range(chunk, pages + chunk, chunk),
+            )
+        )
+
+
+def measure(variant: str, path: str) -> None:
+    """Runs in a child interpreter and prints the peak RSS growth in KB"""
+    before = peak_rss_kb()
+    split = {
+        "eager": split_eager,
+        "lazy": split_lazy,
+        "process_pool": split_process_pool,
+    }[variant]
+    result = split(path)
+    growth = peak_rss_kb() - before
+    if variant == "process_pool":
+        growth += result
+    print(growth)
+
+
+def run(sizes: List[int]) -> None:
+    print(
+        f"{'pages':>6} {'pdf [MB]':>9} "
+        + " ".join(f"{v + ' [MB/MB]':>22}" for v in VARIANTS)
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        for pages in sizes:
+            path = os.path.join(directory, f"{pages}.pdf")
+            make_pdf(path, pages)
+            size_mb = os.path.getsize(path) / 2**20
+            row = []
+            for variant in VARIANTS:
+                output = subprocess.run(
+                    [sys.executable, __file__, "--measure", variant, path],
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                    env=os.environ,
+                ).stdout
+                row.append(int(output.strip()) / 1024 / size_mb)
+            print(f"{pages:>6} {size_mb:>9.1f} " + " ".join(f"{r:>22.2f}" for r in row))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 200, 500])
+    parser.add_argument("--measure", nargs=2, metavar=("VARIANT", "PDF"))
+    args = parser.parse_args()
+    if args.measure:
+        measure(*args.measure)
+    else:
+        run(args.sizes)
@@ -0,0 +1,134 @@
+"""
+Time of splitting the text of large documents into sections.
+
+Compares the previous character-by-character split_text, whose page lookup scanned all pages for every section, with
+SectionSplitter, which finds sentence endings and word breaks by binary search over their positions and bisects the
+page offsets. Both must return the same sections.
+
+Run from the repository root:
+    PYTHONPATH=app/backend python tests/benchmark_splittext.py
+"""
+
+import argparse
+import random
+import time
+from typing import Callable, List, Tuple
+
+from services.TextManagementService import SectionSplitter
+
+PageMap = List[Tuple[int, int, str]]
+
+
+def split_text_scanning(page_map: PageMap) -> List[Tuple[str, int]]:
+    """The previous implementation of FormRecognizerTextManagementService.split_text"""
+    MAX_SECTION_LENGTH: int = 1000
+    SENTENCE_SEARCH_LIMIT: int = 100
+    SECTION_OVERLAP: int = 100
+    SENTENCE_ENDINGS = [".", "!", "?"]
+    WORDS_BREAKS = [",", ";", ":", " ", "(", ")", "[", "]", "{", "}", "\t", "\n"]
+
+    def find_page(offset: int) -> int:
+        num_pages = len(page_map)
+        for i in range(num_pages - 1):
+            if offset >= page_map[i][1] and offset < page_map[i + 1][1]:
+                return i
+        return num_pages - 1
+
+    all_text = "".join(p[2] for p in page_map)
+    length = len(all_text)
+    start: int = 0
+    end = length
+    res: List[Tuple[str, int]] = []
+    while start + SECTION_OVERLAP < length:
+        last_word = -1
+        end = start + MAX_SECTION_LENGTH
+
+        if end > length:
+            end = length
+        else:
+            while (
+                end < length
+                and (end - start - MAX_SECTION_LENGTH) < SENTENCE_SEARCH_LIMIT
+                and all_text[end] not in SENTENCE_ENDINGS
+            ):
+                if all_text[end] in WORDS_BREAKS:
+                    last_word = end
+                end += 1
+            if end < length and all_text[end] not in SENTENCE_ENDINGS and last_word > 0:
+                end = last_word
+        if end < length:
+            end += 1
+
+        last_word = -1
+        while (
+            start > 0
+            and start > end - MAX_SECTION_LENGTH - 2 * SENTENCE_SEARCH_LIMIT
+            and all_text[start] not in SENTENCE_ENDINGS
+        ):
+            if all_text[start] in WORDS_BREAKS:
+                last_word = start
+            start -= 1
+        if all_text[start] not in SENTENCE_ENDINGS and last_word > 0:
+            start = last_word
+        if start > 0:
+            start += 1
+
+        section_text = all_text[start:end]
+        res.append((section_text, find_page(start)))
+
+        last_table_start = section_text.rfind("<table")
+        if (
+            last_table_start > 2 * SENTENCE_SEARCH_LIMIT
+            and last_table_start > section_text.rfind("</table")
+        ):
+            start = min(end - SECTION_OVERLAP, start + last_table_start)
+        else:
+            start = end - SECTION_OVERLAP
+
+    if start + SECTION_OVERLAP < end:
+        res.append((all_text[start:end], find_page(start)))
+    return res
+
+
+def make_page_map(pages: int, seed: int = 0) -> PageMap:
+    rng = random.Random(seed)
+    words = ["Lorem", "ipsum", "dolor", "sit", "amet,", "consectetur", "elit."]
+    table = "<table><tr><td>" + "cell " * 40 + "</td></tr></table>"
+    page_map: PageMap = []
+    offset = 0
+    for i in range(pages):
+        text = " ".join(rng.choice(words) for _ in range(450))
+        if rng.random() < 0.2:
+            text += " " + table * rng.randint(1, 4)
+        text += "\n"
+        page_map.append((i, offset, text))
+        offset += len(text)
+    return page_map
+
+
+def timed(split: Callable[[PageMap], List[Tuple[str, int]]], page_map: PageMap):
+    start = time.perf_counter()
+    sections = split(page_map)
+    return sections, time.perf_counter() - start
+
+
+def run(sizes: List[int]) -> None:
+    print(
+        f"{'pages':>6} {'chars [M]':>9} {'sections':>9} {'scanning [s]':>13} {'bisect [s]':>11}"
+    )
+    for pages in sizes:
+        page_map = make_page_map(pages)
+        chars = sum(len(p[2]) for p in page_map)
+        old, old_seconds = timed(split_text_scanning, page_map)
+        new, new_seconds = timed(SectionSplitter().split, page_map)
+        assert old == new, "the sections differ"
+        print(
+            f"{pages:>6} {chars / 1e6:>9.1f} {len(new):>9} "
+            f"{old_seconds:>13.2f} {new_seconds:>11.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 2000, 5000])
+    run(parser.parse_args().sizes)
@@ -0,0 +1,115 @@
+"""
+Local stand-in for the Microsoft identity platform JWKS endpoint.
+
+It generates its own RSA signing key, publishes it at /discovery/v2.0/keys and issues tokens signed with it, so
+require_auth and the JWKSKeyStore can be exercised without access to login.microsoftonline.com.
+
+Run it standalone and point the backend at it:
+
+    python tests/jwks_server.py --port 8765
+    export AZURE_AUTH_JWKS_URI=http://localhost:8765/discovery/v2.0/keys
+"""
+import argparse
+import asyncio
+import base64
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwt
+
+JWKS_PATH = "/discovery/v2.0/keys"
+
+
+def _b64url_uint(value: int) -> str:
+    raw = value.to_bytes((value.bit_length() + 7) // 8, "big")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+class LocalJWKSServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self._runner: Optional[web.AppRunner] = None
+        self.rotate()
+
+    def rotate(self) -> str:
+        """Replaces the signing key with a new one and returns its kid"""
+        self.kid = str(uuid.uuid4())
+        self._private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        return self.kid
+
+    @property
+    def jwks_uri(self) -> str:
+        return f"http://{self.host}:{self.port}{JWKS_PATH}"
+
+    @property
+    def jwks(self) -> Dict[str, Any]:
+        numbers = self._private_key.public_key().public_numbers()
+        return {
+            "keys": [
+                {
+                    "kty": "RSA",
+                    "use": "sig",
+                    "kid": self.kid,
+                    "n": _b64url_uint(numbers.n),
+                    "e": _b64url_uint(numbers.e),
+                }
+            ]
+        }
+
+    def issue_token(self, claims: Dict[str, Any], lifetime: int = 3600) -> str:
+        now = int(time.time())
+        body = {"iat": now, "nbf": now, "exp": now + lifetime, **claims}
+        pem = self._private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption(),
+        )
+        return jwt.encode(body, pem.decode("ascii"), algorithm="RS256", headers={"kid": self.kid})
+
+    async def _handle_keys(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        return web.json_response(self.jwks)
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get(JWKS_PATH, self._handle_keys)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def _serve(port: int, tenant_id: str, client_id: str) -> None:
+    server = LocalJWKSServer(port=port)
+    await server.start()
+    token = server.issue_token(
+        {
+            "aud": client_id,
+            "iss": f"https://login.microsoftonline.com/{tenant_id}/v2.0",
+            "oid": str(uuid.uuid4()),
+        }
+    )
+    print(f"AZURE_AUTH_JWKS_URI={server.jwks_uri}")
+    print(f"Bearer token: {token}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in JWKS server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--tenant-id", default="local-tenant")
+    parser.add_argument("--client-id", default="local-client")
+    args = parser.parse_args()
+    asyncio.run(_serve(args.port, args.tenant_id, args.client_id))
@@ -0,0 +1,192 @@
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
+from core.answercache import AnswerCacheKey, InMemoryAnswerCache, category_version
+
+ANSWER = {"data_points": ["a.pdf: a"], "answer": "answer"}
+
+
+def key(query, category_id="cat", overrides=None, prompt_version="v1"):
+    return AnswerCacheKey.create(
+        category_id=category_id,
+        query=query,
+        overrides=overrides or {"top": 3},
+        prompt_version=prompt_version,
+    )
+
+
+def test_key_normalizes_query():
+    assert key("  Health  Plans? ") == key("health plans")
+    assert key("health plans") != key("health plans", prompt_version="v2")
+    assert key("health plans") != key("health plans", overrides={"top": 5})
+    follow_up = AnswerCacheKey.create(
+        category_id="cat",
+        query="health plans",
+        overrides={"top": 3},
+        prompt_version="v1",
+        previous_turns=[{"user": "hello", "bot": "hi"}],
+    )
+    assert key("health plans") != follow_up
+    changed_category = AnswerCacheKey.create(
+        category_id="cat",
+        query="health plans",
+        overrides={"top": 3},
+        prompt_version="v1",
+        category_version="etag-2",
+    )
+    assert key("health plans") != changed_category
+
+
+def test_category_version_only_changes_with_the_category():
+    category = {"id": "cat", "system_prompt": "", "files": [{"id": "a"}, {"id": "b"}]}
+    version = category_version(category)
+    assert category_version({**category, "name_en": "renamed"}) == version
+    assert category_version({**category, "files": [{"id": "b"}, {"id": "a"}]}) == version
+    assert category_version({**category, "files": [{"id": "a"}]}) != version
+    assert category_version({**category, "system_prompt": "be brief"}) != version
+
+
+@pytest.mark.asyncio
+async def test_exact_hit_and_category_invalidation():
+    cache = InMemoryAnswerCache(maxsize=10)
+    await cache.set(key("health plans"), ANSWER)
+    await cache.set(key("health plans", category_id="other"), ANSWER)
+    assert await cache.get(key("Health plans")) == ANSWER
+    await cache.invalidate_category("cat")
+    assert await cache.get(key("health plans")) is None
+    assert await cache.get(key("health plans", category_id="other")) == ANSWER
+
+
+@pytest.mark.asyncio
+async def test_similarity_lookup():
+    cache = InMemoryAnswerCache(maxsize=10, similarity_threshold=0.95)
+    await cache.set(key("health plans"), ANSWER, embedding=[1.0, 0.0, 0.0])
+    assert await cache.get(key("my health plans"), embedding=[0.99, 0.05, 0.0]) == ANSWER
+    assert await cache.get(key("vacation"), embedding=[0.0, 1.0, 0.0]) is None
+    # near duplicates are only looked up within the same context
+    assert (
+        await cache.get(key("my health plans", prompt_version="v2"), embedding=[1.0, 0.0, 0.0])
+        is None
+    )
+    assert cache.metrics()["similar_hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_similarity_groups_of_evicted_answers_are_dropped():
+    cache = InMemoryAnswerCache(maxsize=2, similarity_threshold=0.95)
+    for version in range(10):
+        await cache.set(
+            key("health plans", prompt_version=f"v{version}"),
+            ANSWER,
+            embedding=[1.0, 0.0, 0.0],
+        )
+    assert len(cache._vectors) <= 4
+    assert await cache.get(key("plans", prompt_version="v9"), embedding=[1.0, 0.0, 0.0])
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction_and_ttl():
+    cache = InMemoryAnswerCache(maxsize=1)
+    await cache.set(key("a"), ANSWER)
+    await cache.set(key("b"), ANSWER)
+    assert await cache.get(key("a")) is None
+    expired = InMemoryAnswerCache(maxsize=1, ttl=-1)
+    await expired.set(key("a"), ANSWER)
+    assert await expired.get(key("a")) is None
+
+
+class SearchResults:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def __aiter__(self):
+        async def gen():
+            for doc in self.docs:
+                yield doc
+
+        return gen()
+
+
+def cached_approach():
+    search_client = mock.AsyncMock()
+    search_client.search.side_effect = lambda *args, **kwargs: SearchResults(
+        [{"sourcepage": "a.pdf", "content": "a"}]
+    )
+    approach = ChatReadRetrieveReadApproach(
+        search_client,
+        "chat",
+        "gpt-35-turbo",
+        "embedding",
+        "sourcepage",
+        "content",
+        answer_cache=InMemoryAnswerCache(maxsize=10),
+    )
+    completions = []
+
+    async def acreate(**kwargs):
+        completions.append(kwargs)
+        content = "health plans" if kwargs["max_tokens"] == 32 else "answer"
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))]
+        )
+
+    return approach, search_client, completions, acreate
+
+
+@pytest.mark.asyncio
+async def test_approach_serves_repeated_question_from_cache():
+    approach, search_client, completions, acreate = cached_approach()
+    with mock.patch.object(
+        approach, "get_messages_from_history", return_value=[]
+    ), mock.patch("openai.ChatCompletion.acreate", acreate):
+        for _ in range(2):
+            r = await approach.run(
+                history=[{"user": "What are my health plans?"}],
+                overrides={"retrievalMode": "text"},
+                category_id="cat",
+                prompt_version="v1",
+            )
+            assert r["answer"] == "answer"
+            assert r["data_points"] == ["a.pdf: a"]
+
+    # the second request only generated the search query
+    assert len(completions) == 3
+    assert search_client.search.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_approach_never_serves_thoughts_of_another_history():
+    approach, search_client, completions, acreate = cached_approach()
+    histories = {
+        user: [
+            {"user": f"I am {user}, my id is {user}-123", "bot": "noted"},
+            {"user": "What are my health plans?"},
+        ]
+        for user in ["alice", "bob"]
+    }
+
+    def messages(
+        system_prompt, model_id, history, user_conv, few_shots=[], max_tokens=4096
+    ):
+        return [{"role": "user", "content": turn["user"]} for turn in history]
+
+    with mock.patch.object(
+        approach, "get_messages_from_history", side_effect=messages
+    ), mock.patch("openai.ChatCompletion.acreate", acreate):
+        for user in ["alice", "bob", "alice", "bob"]:
+            r = await approach.run(
+                history=histories[user],
+                overrides={"retrievalMode": "text"},
+                category_id="cat",
+                prompt_version="v1",
+            )
+            other = "bob" if user == "alice" else "alice"
+            assert f"{user}-123" in r["thoughts"]
+            assert f"{other}-123" not in r["thoughts"]
+
+    # the repeated questions were answered from the cache, each with the answer for its own history
+    assert search_client.search.await_count == 2
+    assert len(completions) == 6
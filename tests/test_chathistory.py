@@ -0,0 +1,382 @@
+import asyncio
+import re
+from typing import Any, Dict, List, Optional, Tuple
+from unittest import mock
+
+import pytest
+from azure.core.async_paging import AsyncItemPaged, AsyncList
+from azure.cosmos.exceptions import (
+    CosmosHttpResponseError,
+    CosmosResourceExistsError,
+    CosmosResourceNotFoundError,
+)
+from setup.cosmos.migrate_chat_history import to_items
+
+from chat import _is_new_conversation, _listing_limit, _listing_newest_first
+from customerrors import ConversationNotFoundError, InvalidQueryParameterError
+from services.ChatHistoryService import ChatHistoryService, ConversationModel
+from services.ChatHistoryWriter import ChatHistoryWriter
+from services.CosmosDBService import CosmosDBService
+
+
+class FakeCosmosDBService:
+    """In-memory container partitioned by userId that understands the queries of ChatHistoryService"""
+
+    items: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    queries: List[Tuple[str, Any]] = []
+    requests = 0
+    # exceptions raised by the next creates (None succeeds), and an event the creates of turns wait for if set
+    failures: List[Optional[Exception]] = []
+    gate: Optional[asyncio.Event] = None
+
+    def __init__(self, database, container): ...
+
+    async def query(self, query, params=None, partition_key=None):
+        FakeCosmosDBService.requests += 1
+        FakeCosmosDBService.queries.append((query, partition_key))
+        values = {param["name"]: param["value"] for param in params or []}
+        conditions = [
+            (field, values[value] if value.startswith("@") else value.strip("'"))
+            for field, value in re.findall(r"c\.(\w+) = (@\w+|'[^']*')", query)
+        ]
+        items = [
+            item
+            for (partition, _), item in self.items.items()
+            if partition_key in (None, partition)
+            and all(item.get(field) == value for field, value in conditions)
+        ]
+        order = re.search(r"ORDER BY c\.(\w+)( DESC)?", query)
+        if order:
+            items.sort(key=lambda item: item[order.group(1)], reverse=bool(order[2]))
+        fields = re.match(r"SELECT (.*?) from", query, re.IGNORECASE).group(1)
+        if fields.strip() == "*":
+            return items
+        names = [field.strip()[len("c.") :] for field in fields.split(",")]
+        return [{name: item[name] for name in names} for item in items]
+
+    async def query_page(
+        self,
+        query,
+        max_item_count,
+        params=None,
+        partition_key=None,
+        continuation_token=None,
+    ):
+        start = int(continuation_token or 0)
+        items = await self.query(query, params, partition_key)
+        end = start + max_item_count
+        return items[start:end], str(end) if end < len(items) else None
+
+    async def read(self, item_id, partition_key, **kwargs):
+        FakeCosmosDBService.requests += 1
+        if (partition_key, item_id) not in self.items:
+            raise CosmosResourceNotFoundError(message="not found")
+        return self.items[(partition_key, item_id)]
+
+    async def create_item(self, body, **kwargs):
+        FakeCosmosDBService.requests += 1
+        if self.gate is not None and body["type"] == "turn":
+            await self.gate.wait()
+        failure = self.failures.pop(0) if self.failures else None
+        if failure is not None:
+            raise failure
+        key = (body["userId"], body["id"])
+        if key in self.items:
+            raise CosmosResourceExistsError(message="exists")
+        self.items[key] = dict(body)
+        return self.items[key]
+
+    async def delete(self, item_id, partition_key, **kwargs):
+        FakeCosmosDBService.requests += 1
+        del self.items[(partition_key, item_id)]
+
+    async def bulk_delete(self, item_ids, partition_keys, progress=None):
+        for done, (item_id, partition_key) in enumerate(zip(item_ids, partition_keys)):
+            await self.delete(item_id, partition_key)
+            if progress is not None:
+                progress(done + 1, len(item_ids))
+        return len(item_ids)
+
+
+@pytest.fixture
+def cosmos():
+    FakeCosmosDBService.items = {}
+    FakeCosmosDBService.queries = []
+    FakeCosmosDBService.requests = 0
+    FakeCosmosDBService.failures = []
+    FakeCosmosDBService.gate = None
+    with mock.patch("services.ChatHistoryService.CosmosDBService", FakeCosmosDBService):
+        yield FakeCosmosDBService
+
+
+def turn(question: str) -> List[Dict[str, Any]]:
+    return [{"user": question}, {"answer": f"answer to {question}"}]
+
+
+async def add(user_id, conversation_id, question, category_id="cat", new=True):
+    return await ChatHistoryService.add_to_history(
+        user_id, category_id, conversation_id, turn(question), new_conversation=new
+    )
+
+
+@pytest.mark.asyncio
+async def test_conversations_and_turns_are_separate_items(cosmos):
+    await add("u1", "conv-1", "first?")
+    await add("u1", "conv-1", "second?", new=False)
+    await add("u1", "conv-2", "other?")
+    await add("u2", "conv-1", "u2?")
+
+    assert len(cosmos.items) == 4 + 3
+    conversation = await ChatHistoryService.get_conversation("u1", "cat", "conv-1")
+    assert conversation == {"history": turn("first?") + turn("second?")}
+    histories = await ChatHistoryService.get_all_histories("u1", "cat")
+    assert [h.conversation_id for h in histories] == ["conv-1", "conv-2"]
+    assert [h.topic for h in histories] == ["first?", "other?"]
+    details = await ChatHistoryService.get_conversation_details("u2", "cat", "conv-1")
+    assert details == ConversationModel("conv-1", details.timestamp, "u2?")
+
+
+@pytest.mark.asyncio
+async def test_listing_reads_no_turns(cosmos):
+    for i in range(5):
+        await add("u1", f"conv-{i}", "q?")
+    cosmos.queries.clear()
+    await ChatHistoryService.get_all_histories("u1", "cat")
+    ((query, partition_key),) = cosmos.queries
+    assert partition_key == "u1"
+    assert "c.history" not in query and "*" not in query
+
+
+@pytest.mark.asyncio
+async def test_delete_conversation_removes_its_turns(cosmos):
+    await add("u1", "conv-1", "first?")
+    await add("u1", "conv-1", "second?", new=False)
+    await add("u1", "conv-2", "other?")
+    await ChatHistoryService.delete_conversation("u1", "cat", "conv-1")
+    assert [item["conversation_id"] for item in cosmos.items.values()] == [
+        "conv-2",
+        "conv-2",
+    ]
+    with pytest.raises(ConversationNotFoundError):
+        await ChatHistoryService.delete_conversation("u1", "cat", "conv-1")
+    with pytest.raises(ConversationNotFoundError):
+        await ChatHistoryService.get_conversation("u1", "cat", "conv-1")
+
+
+@pytest.mark.asyncio
+async def test_delete_by_category_covers_all_users(cosmos):
+    await add("u1", "conv-1", "q?")
+    await add("u2", "conv-1", "q?")
+    await add("u2", "conv-1", "q?", category_id="keep")
+    progress = []
+    deleted = await ChatHistoryService.delete_chat_history_by_category(
+        "cat", lambda done, total: progress.append((done, total))
+    )
+    assert deleted == 4 and progress[-1] == (4, 4)
+    query, partition_key = cosmos.queries[-1]
+    assert query.startswith("SELECT c.id, c.userId ") and partition_key is None
+    assert {item["category_id"] for item in cosmos.items.values()} == {"keep"}
+
+
+@pytest.mark.asyncio
+async def test_migrated_documents_read_like_new_ones(cosmos):
+    legacy = {
+        "id": "doc",
+        "userId": "u1",
+        "category_id": "cat",
+        "histories": [
+            {
+                "conversation_id": "conv-1",
+                "topic": "first?",
+                "timestamp": 1700000000,
+                "history": turn("first?") + turn("second?") + [{"user": "third?"}],
+            },
+            {
+                "conversation_id": "conv-2",
+                "topic": "other?",
+                "timestamp": 1700000100,
+                "history": turn("other?"),
+            },
+        ],
+    }
+    for item in to_items(legacy):
+        await cosmos("User", "Conversations").create_item(item)
+
+    conversation = await ChatHistoryService.get_conversation("u1", "cat", "conv-1")
+    assert conversation["history"] == legacy["histories"][0]["history"]
+    assert await ChatHistoryService.get_all_histories("u1", "cat") == [
+        ConversationModel("conv-1", 1700000000, "first?"),
+        ConversationModel("conv-2", 1700000100, "other?"),
+    ]
+    # new turns of migrated conversations are sorted after the migrated ones
+    await add("u1", "conv-2", "more?", new=False)
+    conversation = await ChatHistoryService.get_conversation("u1", "cat", "conv-2")
+    assert conversation["history"] == turn("other?") + turn("more?")
+
+
+@pytest.mark.asyncio
+async def test_a_turn_is_one_request_and_returns_new_conversations(cosmos):
+    details = await add("u1", "conv-1", "first?")
+    assert details == ConversationModel("conv-1", details.timestamp, "first?")
+    # the turn and the conversation are created concurrently
+    assert cosmos.requests == 2
+
+    cosmos.requests = 0
+    assert await add("u1", "conv-1", "second?", new=False) is None
+    assert cosmos.requests == 1
+
+    # a repeated first turn keeps the conversation
+    assert await add("u1", "conv-1", "again?") == details
+    conversation = await ChatHistoryService.get_conversation("u1", "cat", "conv-1")
+    assert [entry.get("user") for entry in conversation["history"]][::2] == [
+        "first?",
+        "second?",
+        "again?",
+    ]
+
+
+def test_first_question_starts_a_conversation():
+    assert _is_new_conversation({"new_conversation": True, "history": [{}, {}, {}]})
+    assert _is_new_conversation({"history": [{"user": "first?"}]})
+    assert not _is_new_conversation(
+        {"new_conversation": False, "history": [{"user": "a", "bot": "b"}, {}]}
+    )
+
+
+@pytest.mark.asyncio
+async def test_writer_returns_before_the_turn_is_written(cosmos):
+    cosmos.gate = asyncio.Event()
+    writer = ChatHistoryWriter()
+    details = await writer.add_to_history(
+        "u1", "cat", "conv-1", turn("first?"), new_conversation=True
+    )
+    # the conversation is stored before the answer is returned, its turn is not
+    assert details == ConversationModel("conv-1", details.timestamp, "first?")
+    assert await ChatHistoryService.get_all_histories("u1", "cat") == [details]
+    for question in ["second?", "third?"]:
+        assert (
+            await writer.add_to_history("u1", "cat", "conv-1", turn(question)) is None
+        )
+    await writer.add_to_history("u1", "cat", "conv-2", turn("other?"), True)
+    assert {item["type"] for item in cosmos.items.values()} == {"conversation"}
+    assert writer.metrics()["pending"] == 4
+
+    cosmos.gate.set()
+    await writer.flushed("u1")
+    assert writer.metrics()["pending"] == 0
+    conversation = await ChatHistoryService.get_conversation("u1", "cat", "conv-1")
+    assert conversation == {
+        "history": turn("first?") + turn("second?") + turn("third?")
+    }
+    assert writer.written == 4 and writer.failed == 0
+
+
+@pytest.mark.asyncio
+async def test_writer_retries_transient_errors(cosmos):
+    cosmos.failures = [
+        CosmosHttpResponseError(status_code=429, message="too many requests"),
+        None,
+        None,
+        CosmosHttpResponseError(status_code=400, message="bad request"),
+    ]
+    writer = ChatHistoryWriter()
+    await writer.add_to_history("u1", "cat", "conv-1", turn("kept?"), True)
+    await writer.add_to_history("u1", "cat", "conv-1", turn("lost?"))
+    await writer.flushed("u1")
+    conversation = await ChatHistoryService.get_conversation("u1", "cat", "conv-1")
+    # the conversation item is retried, the bad request of the second turn is not
+    assert conversation == {"history": turn("kept?")}
+    assert (writer.retries, writer.written, writer.failed) == (1, 1, 1)
+
+
+@pytest.mark.asyncio
+async def test_writer_queues_no_turn_of_a_failed_conversation(cosmos):
+    cosmos.failures = [CosmosHttpResponseError(status_code=400, message="bad")]
+    writer = ChatHistoryWriter()
+    with pytest.raises(CosmosHttpResponseError):
+        await writer.add_to_history("u1", "cat", "conv-1", turn("first?"), True)
+    await writer.flushed("u1")
+    assert cosmos.items == {} and writer.submitted == 0
+
+
+@pytest.mark.asyncio
+async def test_writer_applies_backpressure_and_flushes_on_stop(cosmos):
+    cosmos.gate = asyncio.Event()
+    writer = ChatHistoryWriter(max_pending=1)
+    await writer.add_to_history("u1", "cat", "conv-1", turn("first?"), True)
+    second = asyncio.create_task(
+        writer.add_to_history("u2", "cat", "conv-1", turn("second?"), True)
+    )
+    for _ in range(3):
+        await asyncio.sleep(0)
+    assert not second.done() and writer.throttled == 1
+
+    cosmos.gate.set()
+    await second
+    await writer.stop()
+    assert writer.metrics()["writers"] == 0
+    assert len(cosmos.items) == 4
+    # after stop, turns are written directly
+    await writer.add_to_history("u1", "cat", "conv-1", turn("late?"))
+    assert len(cosmos.items) == 5
+
+
+@pytest.mark.asyncio
+async def test_histories_are_listed_in_pages(cosmos):
+    for i in range(5):
+        await add("u1", f"conv-{i}", f"q{i}?")
+        cosmos.items[("u1", f"cat_conv-{i}")]["timestamp"] = 1700000000 + i
+    await add("u2", "conv-9", "other user?")
+
+    for newest_first in (False, True):
+        pages = []
+        token = None
+        while True:
+            page, token = await ChatHistoryService.get_histories_page(
+                "u1", "cat", 2, token, newest_first=newest_first
+            )
+            pages.append([h.conversation_id for h in page])
+            if token is None:
+                break
+        ids = [f"conv-{i}" for i in range(5)][:: -1 if newest_first else 1]
+        assert pages == [ids[0:2], ids[2:4], ids[4:]]
+    query, partition_key = cosmos.queries[-1]
+    assert partition_key == "u1" and "c.history" not in query
+
+
+def test_listing_parameters_are_validated():
+    assert _listing_limit(None) is None
+    assert _listing_limit("10") == 10
+    for limit in ("0", "-1", "ten", "1000"):
+        with pytest.raises(InvalidQueryParameterError):
+            _listing_limit(limit)
+    assert _listing_newest_first("desc") and not _listing_newest_first("asc")
+    with pytest.raises(InvalidQueryParameterError):
+        _listing_newest_first("newest")
+
+
+@pytest.mark.asyncio
+async def test_query_page_requests_a_single_page():
+    results = [{"id": str(i)} for i in range(5)]
+    requested = []
+
+    def query_items(query, parameters, max_item_count, **kwargs):
+        async def get_next(token):
+            requested.append(token)
+            start = int(token or 0)
+            return results[start : start + max_item_count], start + max_item_count
+
+        async def extract_data(response):
+            items, end = response
+            return (str(end) if end < len(results) else None), AsyncList(items)
+
+        return AsyncItemPaged(get_next, extract_data)
+
+    service = CosmosDBService.__new__(CosmosDBService)
+    service.container = mock.Mock(query_items=query_items)
+    assert await service.query_page("SELECT * from c", 2) == (results[:2], "2")
+    assert await service.query_page("SELECT * from c", 2, continuation_token="4") == (
+        results[4:],
+        None,
+    )
+    assert requested == [None, "4"]
@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+from approaches.standardchat import StandardChatApproach
+
+
+def chunk(content=None, choices=True):
+    if not choices:
+        return SimpleNamespace(choices=[])
+    delta = {"content": content} if content is not None else {}
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+async def fake_stream(**kwargs):
+    assert kwargs["stream"] is True
+    for c in [chunk(choices=False), chunk(), chunk("Hel"), chunk("lo"), chunk("")]:
+        yield c
+
+
+@pytest.mark.asyncio
+async def test_run_stream_yields_leading_frame_and_chunks():
+    approach = StandardChatApproach("chat", "gpt-35-turbo")
+    history = [{"user": "hi"}]
+    messages = [{"role": "user", "content": "hi"}]
+
+    async def acreate(**kwargs):
+        return fake_stream(**kwargs)
+
+    with mock.patch.object(
+        approach, "get_messages_from_history", return_value=messages
+    ), mock.patch("openai.ChatCompletion.acreate", acreate):
+        frames = [
+            frame
+            async for frame in approach.run_stream(
+                history=history, overrides={}, category_id="cat"
+            )
+        ]
+
+    assert frames[0]["data_points"] == []
+    assert "hi" in frames[0]["thoughts"]
+    assert frames[1:] == [{"answer": "Hel"}, {"answer": "lo"}]
+
+
+@pytest.mark.asyncio
+async def test_run_and_run_stream_share_the_prompt():
+    approach = StandardChatApproach("chat", "gpt-35-turbo")
+    history = [{"user": "hi"}]
+    messages = [{"role": "user", "content": "hi"}]
+    completion = SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content="Hello"))]
+    )
+
+    async def acreate(**kwargs):
+        assert kwargs["messages"] == messages
+        return completion
+
+    with mock.patch.object(
+        approach, "get_messages_from_history", return_value=messages
+    ), mock.patch("openai.ChatCompletion.acreate", acreate):
+        r = await approach.run(history=history, overrides={}, category_id="cat")
+    assert r["answer"] == "Hello"
+    assert r["data_points"] == []
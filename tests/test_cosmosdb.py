@@ -0,0 +1,100 @@
+import asyncio
+from typing import Dict, List, Set, Tuple
+
+import pytest
+from azure.cosmos.exceptions import (
+    CosmosHttpResponseError,
+    CosmosResourceNotFoundError,
+)
+
+from services.CosmosDBService import CosmosDBService
+
+
+class FakeContainer:
+    """Deletes items after a short delay, throttles the first delete of the ids in `throttled`"""
+
+    def __init__(self, items: Set[Tuple[str, str]], throttled: Set[str] = set()):
+        self.items = items
+        self.throttled = set(throttled)
+        self.requests: List[Tuple[str, str]] = []
+        self.running = 0
+        self.max_running = 0
+
+    async def delete_item(self, item, partition_key, **kwargs):
+        self.requests.append((partition_key, item))
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(0.001)
+            if item in self.throttled:
+                self.throttled.remove(item)
+                error = CosmosHttpResponseError(status_code=429, message="throttled")
+                error.headers = {"x-ms-retry-after-ms": "5"}
+                raise error
+            if (partition_key, item) not in self.items:
+                raise CosmosResourceNotFoundError(message="not found")
+            self.items.remove((partition_key, item))
+        finally:
+            self.running -= 1
+
+
+def service(container: FakeContainer) -> CosmosDBService:
+    cdb_service = CosmosDBService.__new__(CosmosDBService)
+    cdb_service.container = container
+    return cdb_service
+
+
+@pytest.mark.asyncio
+async def test_bulk_delete_bounds_concurrency_and_retries_throttled_deletes():
+    items = {(f"user-{i % 3}", f"item-{i}") for i in range(30)}
+    container = FakeContainer(set(items), throttled={"item-4", "item-5"})
+    progress: List[Tuple[int, int]] = []
+
+    deleted = await service(container).bulk_delete(
+        item_ids=[item_id for _, item_id in items],
+        partition_keys=[partition_key for partition_key, _ in items],
+        concurrency=4,
+        progress=lambda done, total: progress.append((done, total)),
+    )
+    assert deleted == 30 and container.items == set()
+    assert container.max_running == 4
+    assert len(container.requests) == 32
+    assert progress == [(done, 30) for done in range(1, 31)]
+
+
+@pytest.mark.asyncio
+async def test_bulk_delete_spreads_requests_over_partitions():
+    partitions: Dict[str, List[str]] = {
+        "user-a": ["a1", "a2", "a3"],
+        "user-b": ["b1"],
+        "user-c": ["c1", "c2"],
+    }
+    items = {(pk, item_id) for pk, ids in partitions.items() for item_id in ids}
+    container = FakeContainer(set(items))
+    ids = [item_id for pk, item_ids in partitions.items() for item_id in item_ids]
+    await service(container).bulk_delete(
+        item_ids=ids,
+        partition_keys=[f"user-{item_id[0]}" for item_id in ids],
+        concurrency=1,
+    )
+    assert [item for _, item in container.requests] == [
+        "a1",
+        "b1",
+        "c1",
+        "a2",
+        "c2",
+        "a3",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_bulk_delete_can_be_repeated_and_gives_up_on_errors():
+    container = FakeContainer({("user", "item")})
+    cdb_service = service(container)
+    # items that are gone count as deleted
+    assert await cdb_service.bulk_delete(["item", "gone"], ["user", "user"]) == 2
+    assert await cdb_service.bulk_delete([], []) == 0
+
+    container.throttled = {"item"}
+    with pytest.raises(CosmosHttpResponseError):
+        await cdb_service.bulk_delete(["item"], ["user"], max_attempts=1)
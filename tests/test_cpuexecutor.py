@@ -0,0 +1,81 @@
+import asyncio
+import io
+import os
+
+import pytest
+from pypdf import PdfReader, PdfWriter
+
+from core.cpuexecutor import CPUExecutor
+from core.uploadedfile import UploadedFile
+from models.Models import FileModel
+from services.FileManagementService import FileManagementService
+from services.FileReaderService import split_pdf_to_files
+
+
+def pdf(pages: int) -> bytes:
+    writer = PdfWriter()
+    for i in range(pages):
+        writer.add_blank_page(width=72 + i, height=72)
+    f = io.BytesIO()
+    writer.write(f)
+    return f.getvalue()
+
+
+@pytest.mark.asyncio
+async def test_process_pool_runs_module_level_functions(tmp_path):
+    source = tmp_path / "doc.pdf"
+    source.write_bytes(pdf(3))
+    executor = CPUExecutor(max_workers=1)
+    executor.start()
+    try:
+        paths = await executor.run(split_pdf_to_files, str(source), str(tmp_path))
+        with pytest.raises(FileNotFoundError):
+            await executor.run(split_pdf_to_files, str(tmp_path / "missing.pdf"), "")
+    finally:
+        await executor.stop()
+    assert len(paths) == 3
+    assert executor.metrics() | {"total_seconds": 0} == {
+        "workers": 1,
+        "submitted": 2,
+        "completed": 1,
+        "failed": 1,
+        "queue_depth": 0,
+        "max_queue_depth": 1,
+        "total_seconds": 0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_queue_depth_counts_queued_and_running_tasks():
+    executor = CPUExecutor(max_workers=0)
+    executor.start()
+    release = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    def wait():
+        asyncio.run_coroutine_threadsafe(release.wait(), loop).result()
+
+    tasks = [asyncio.create_task(executor.run(wait)) for _ in range(3)]
+    await asyncio.sleep(0.05)
+    assert executor.metrics()["queue_depth"] == 3
+    release.set()
+    await asyncio.gather(*tasks)
+    assert executor.metrics()["queue_depth"] == 0
+    assert executor.metrics()["max_queue_depth"] == 3
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("data", [pdf(2), UploadedFile.spool(io.BytesIO(pdf(2)))])
+async def test_offloaded_processing_splits_pages_on_disk(data):
+    executor = CPUExecutor(max_workers=0)
+    file = FileModel(id="1", data=data, name="doc.pdf")
+    service = FileManagementService.for_file(file)
+    with await service.process_file_offloaded(file, executor) as strategy:
+        assert strategy.page_names == ["doc-0.pdf", "doc-1.pdf"]
+        pages_dir = strategy._pages_dir
+        widths = [
+            float(PdfReader(page).pages[0].mediabox.width)
+            for page in strategy.iter_pages()
+        ]
+    assert widths == [72, 73]
+    assert not os.path.exists(pages_dir)
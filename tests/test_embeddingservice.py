@@ -0,0 +1,142 @@
+import asyncio
+from unittest import mock
+
+import numpy as np
+import openai
+import pytest
+
+from services.EmbeddingService import DocumentEmbeddingService, EmbeddingService
+
+
+class FakeEmbeddings:
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, engine, input):
+        self.calls.append(list(input))
+        await asyncio.sleep(0)
+        # answer in reversed order, the service has to sort by index
+        return {
+            "data": [
+                {"index": i, "embedding": [float(len(text)), 1.0]}
+                for i, text in reversed(list(enumerate(input)))
+            ]
+        }
+
+
+@pytest.fixture
+def embeddings():
+    fake = FakeEmbeddings()
+    with mock.patch("openai.Embedding.acreate", fake):
+        yield fake
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_are_batched_and_cached(embeddings):
+    service = EmbeddingService("embedding", batch_window=0.01)
+    vectors = await asyncio.gather(
+        service.embed("a"), service.embed("bb"), service.embed("a"), service.embed("ccc")
+    )
+    assert vectors == [[1.0, 1.0], [2.0, 1.0], [1.0, 1.0], [3.0, 1.0]]
+    assert embeddings.calls == [["a", "bb", "ccc"]]
+    assert await service.embed("bb") == [2.0, 1.0]
+    assert len(embeddings.calls) == 1
+    metrics = service.metrics()
+    assert metrics["coalesced"] == 1
+    assert metrics["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_batches_are_split_at_max_batch_size(embeddings):
+    service = EmbeddingService("embedding", max_batch_size=2)
+    await service.embed_many(["a", "b", "c", "d", "e"])
+    assert sorted(len(call) for call in embeddings.calls) == [1, 2, 2]
+
+
+@pytest.mark.asyncio
+async def test_errors_are_raised_to_all_waiters():
+    async def fail(engine, input):
+        raise RuntimeError("rate limited")
+
+    service = EmbeddingService("embedding")
+    with mock.patch("openai.Embedding.acreate", fail):
+        results = await asyncio.gather(
+            service.embed("a"), service.embed("a"), return_exceptions=True
+        )
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+@pytest.mark.asyncio
+async def test_missing_embeddings_fail_every_waiter():
+    async def truncated(engine, input):
+        return {"data": [{"index": 0, "embedding": [1.0]}]}
+
+    service = EmbeddingService("embedding")
+    with mock.patch("openai.Embedding.acreate", truncated):
+        results = await asyncio.wait_for(
+            asyncio.gather(
+                service.embed("a"), service.embed("b"), return_exceptions=True
+            ),
+            timeout=1,
+        )
+    assert all(isinstance(r, ValueError) for r in results)
+    assert service.metrics()["size"] == 0
+
+
+@pytest.mark.asyncio
+async def test_cache_is_persisted(embeddings, tmp_path):
+    path = str(tmp_path / "embeddings.npz")
+    service = EmbeddingService("embedding", persist_path=path)
+    await service.start()
+    await service.embed("persisted")
+    await service.stop()
+
+    restarted = EmbeddingService("embedding", persist_path=path)
+    await restarted.start()
+    vector = await restarted.embed_array("persisted")
+    assert vector.dtype == np.float32
+    assert vector.tolist() == [9.0, 1.0]
+    assert len(embeddings.calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_documents_are_embedded_in_order_with_bounded_concurrency():
+    running = 0
+    max_running = 0
+    calls = []
+
+    async def acreate(input, **kwargs):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        calls.append(list(input))
+        await asyncio.sleep(0.01 if input[0] == "0" else 0)
+        running -= 1
+        return {"data": [{"index": i, "embedding": [float(t)]} for i, t in enumerate(input)]}
+
+    service = DocumentEmbeddingService("embedding", batch_size=3, concurrency=2)
+    texts = [str(i) for i in range(10)]
+    with mock.patch("openai.Embedding.acreate", acreate):
+        vectors = await service.embed(texts)
+    assert vectors == [[float(i)] for i in range(10)]
+    assert len(calls) == 4
+    assert max_running == 2
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_batches_wait_for_retry_after():
+    attempts = []
+
+    async def acreate(input, **kwargs):
+        attempts.append(list(input))
+        if len(attempts) == 1:
+            raise openai.error.RateLimitError(
+                "rate limited", headers={"Retry-After": "0"}
+            )
+        return {"data": [{"index": 0, "embedding": [1.0]}]}
+
+    service = DocumentEmbeddingService("embedding")
+    with mock.patch("openai.Embedding.acreate", acreate):
+        assert await service.embed(["a"]) == [[1.0]]
+    assert service.metrics()["retries"] == 1
+    assert len(attempts) == 2
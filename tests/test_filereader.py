@@ -0,0 +1,75 @@
+import asyncio
+import io
+from unittest import mock
+
+import pytest
+from pypdf import PdfReader, PdfWriter
+
+from models.Models import FileBlobStorageModel, PageBlobStorageModel
+from services.BlobService import BlobService
+from services.FileReaderService import FileReaderService, split_pdf_to_files
+
+
+def pdf(pages: int) -> bytes:
+    writer = PdfWriter()
+    for i in range(pages):
+        writer.add_blank_page(width=72 + i, height=72)
+    f = io.BytesIO()
+    writer.write(f)
+    return f.getvalue()
+
+
+def test_iter_pages_yields_single_page_pdfs_lazily():
+    reader = FileReaderService(io.BytesIO(pdf(3)))
+    pages = reader.iter_pages()
+    first = next(pages)
+    assert [float(p.mediabox.width) for p in PdfReader(first).pages] == [72]
+    assert len(list(pages)) == 2
+    assert [
+        float(PdfReader(io.BytesIO(p)).pages[0].mediabox.width)
+        for p in reader.pages_to_bytes()
+    ] == [72, 73, 74]
+
+
+def test_split_pdf_to_files(tmp_path):
+    source = tmp_path / "doc.pdf"
+    source.write_bytes(pdf(5))
+    paths = split_pdf_to_files(str(source), str(tmp_path), start=1, stop=3)
+    assert [p.rsplit("/", 1)[1] for p in paths] == ["1.pdf", "2.pdf"]
+    assert float(PdfReader(paths[1]).pages[0].mediabox.width) == 74
+
+
+@pytest.mark.asyncio
+async def test_bulk_upload_bounds_pages_in_flight():
+    in_flight = 0
+    max_in_flight = 0
+    created = 0
+
+    def pages():
+        nonlocal created
+        for i in range(20):
+            created += 1
+            # a page is only split once an upload slot is free
+            assert created - uploaded <= BlobService.MAX_CONCURRENT_PAGE_UPLOADS
+            yield PageBlobStorageModel(data=b"page", path=f"pages/{i}.pdf")
+
+    uploaded = 0
+
+    async def upload(container, name, data, metadata, tags):
+        nonlocal in_flight, max_in_flight, uploaded
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.001)
+        in_flight -= 1
+        uploaded += 1
+        return name
+
+    service = BlobService()
+    with mock.patch.object(service, "upload", side_effect=upload):
+        file, page_blobs = await service.bulk_upload(
+            FileBlobStorageModel(data=b"file", path="doc.pdf", pages=pages()),
+            container="documents",
+        )
+    assert file == "doc.pdf"
+    assert page_blobs == [f"pages/{i}.pdf" for i in range(20)]
+    assert max_in_flight <= BlobService.MAX_CONCURRENT_PAGE_UPLOADS + 1
@@ -0,0 +1,38 @@
+import pytest
+from aiohttp import web
+
+from core.httppool import HTTPSessionPool
+
+
+@pytest.mark.asyncio
+async def test_pool_reuses_connections():
+    app = web.Application()
+    app.router.add_get("/", lambda request: web.json_response({"ok": True}))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+
+    pool = HTTPSessionPool(limit_per_host=1)
+    await pool.open()
+    try:
+        for _ in range(3):
+            async with pool.session.get(f"http://127.0.0.1:{port}/") as response:
+                assert (await response.json())["ok"]
+    finally:
+        await pool.close()
+        await runner.cleanup()
+
+    metrics = pool.metrics()
+    assert metrics["requests"] == 3
+    assert metrics["connections_created"] == 1
+    assert metrics["connections_reused"] == 2
+    assert not metrics["open"]
+
+
+@pytest.mark.asyncio
+async def test_pool_must_be_opened():
+    pool = HTTPSessionPool()
+    with pytest.raises(RuntimeError):
+        pool.session
@@ -0,0 +1,29 @@
+import asyncio
+
+import pytest
+from quart import Quart, g
+
+from customerrors import AuthError
+from utils import current_user_id
+
+
+@pytest.mark.asyncio
+async def test_current_user_is_request_scoped():
+    app = Quart(__name__)
+
+    async def handle(oid: str) -> str:
+        async with app.test_request_context("/"):
+            g.user = {"oid": oid}
+            await asyncio.sleep(0)
+            return current_user_id()
+
+    oids = [f"user-{i}" for i in range(50)]
+    assert await asyncio.gather(*[handle(oid) for oid in oids]) == oids
+
+
+@pytest.mark.asyncio
+async def test_current_user_requires_auth():
+    app = Quart(__name__)
+    async with app.test_request_context("/"):
+        with pytest.raises(AuthError):
+            current_user_id()
@@ -0,0 +1,209 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from quart import Quart
+
+from customerrors import NotFoundError
+from services.ABCUsecaseService import CONFIG_USECASE_DEFINITION_CACHE
+from services.CategoryService import (
+    CONFIG_INGESTION_JOB_SERVICE,
+    JOB_POST_CATEGORY,
+    JOB_PUT_CATEGORY,
+    CategoryService,
+)
+from services.IngestionJobService import (
+    IngestionJobService,
+    IngestionJobStore,
+    JobStatus,
+)
+from services.UsecaseDefinitionService import UsecaseDefinition
+
+STAGES = ["upload", "embed", "index"]
+
+
+def test_store_claims_jobs_in_order_and_tracks_stages(tmp_path):
+    store = IngestionJobStore(str(tmp_path))
+    first = store.add("kind", "user", {"n": 1}, {"a": b"\x00pdf", "b": "text"}, STAGES)
+    second = store.add("kind", "user", {"n": 2}, {}, STAGES)
+    assert first.status == JobStatus.QUEUED.value
+
+    claimed = store.claim()
+    assert claimed.id == first.id
+    assert claimed.status == JobStatus.RUNNING.value
+    assert claimed.attempts == 1
+    assert store.load_payload(first.id) == ({"n": 1}, {"a": b"\x00pdf", "b": "text"})
+
+    store.set_stage(first.id, "upload")
+    store.set_stage(first.id, "index")
+    assert [s["status"] for s in store.get(first.id).stages] == [
+        "done",
+        "pending",
+        "running",
+    ]
+
+    store.finish(first.id, JobStatus.SUCCEEDED, result=[{"id": "cat"}])
+    job = store.get(first.id)
+    assert job.result == [{"id": "cat"}]
+    assert [s["status"] for s in job.stages] == ["done", "skipped", "done"]
+    assert not (tmp_path / "attachments" / first.id).exists()
+
+    assert store.claim().id == second.id
+    assert store.claim() is None
+
+
+def test_store_requeues_interrupted_jobs(tmp_path):
+    store = IngestionJobStore(str(tmp_path))
+    job = store.add("kind", "user", {}, {}, STAGES)
+    store.claim()
+
+    # a new store on the same directory, like after a restart
+    restarted = IngestionJobStore(str(tmp_path))
+    assert restarted.requeue_stale(stale_after=60, max_attempts=3) == 0
+    assert restarted.requeue_stale(stale_after=-1, max_attempts=3) == 1
+    assert restarted.claim().attempts == 2
+    assert restarted.requeue_stale(stale_after=-1, max_attempts=2) == 0
+    assert restarted.get(job.id).status == JobStatus.FAILED.value
+
+
+@pytest.mark.asyncio
+async def test_service_runs_handlers_in_background(tmp_path):
+    service = IngestionJobService(str(tmp_path), concurrency=2, poll_interval=0.01)
+
+    async def handler(payload, attachments, progress):
+        await progress("upload")
+        if payload["fail"]:
+            raise ValueError("form recognizer failed")
+        await progress("embed")
+        return {"size": len(attachments["file"])}
+
+    service.register("kind", handler)
+    await service.start()
+    try:
+        ok = await service.submit("kind", "user", {"fail": False}, {"file": b"abc"}, STAGES)
+        failed = await service.submit("kind", "user", {"fail": True}, {"file": b""}, STAGES)
+        for _ in range(200):
+            jobs = [await service.get(ok.id), await service.get(failed.id)]
+            if all(job.status in ("succeeded", "failed") for job in jobs):
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await service.stop()
+
+    assert jobs[0].status == "succeeded"
+    assert jobs[0].result == {"size": 3}
+    assert jobs[1].status == "failed"
+    assert jobs[1].error == "form recognizer failed"
+    assert service.metrics()["jobs"] == {"succeeded": 1, "failed": 1}
+
+
+@pytest.mark.asyncio
+async def test_service_rejects_unknown_kinds(tmp_path):
+    service = IngestionJobService(str(tmp_path))
+    with pytest.raises(ValueError):
+        await service.submit("unknown", "user", {}, {}, STAGES)
+
+
+@pytest.mark.asyncio
+async def test_service_requeues_jobs_of_dead_workers_while_running(tmp_path):
+    # claimed by a worker of another process that dies right after, so its heartbeat is still fresh at start
+    store = IngestionJobStore(str(tmp_path))
+    job = store.add("kind", "user", {}, {}, STAGES)
+    store.claim()
+    service = IngestionJobService(
+        str(tmp_path), poll_interval=0.01, heartbeat_interval=0.05
+    )
+    ran = asyncio.Event()
+
+    async def handler(payload, attachments, progress):
+        ran.set()
+
+    service.register("kind", handler)
+    await service.start()
+    try:
+        assert (await service.get(job.id)).status == "running"
+        await asyncio.wait_for(ran.wait(), timeout=5)
+    finally:
+        await service.stop()
+    assert (await service.get(job.id)).attempts == 2
+
+
+@pytest.mark.asyncio
+async def test_stop_lets_running_jobs_finish_and_claims_no_more(tmp_path):
+    service = IngestionJobService(str(tmp_path), concurrency=1, poll_interval=0.01)
+    started = asyncio.Event()
+
+    async def handler(payload, attachments, progress):
+        started.set()
+        await asyncio.sleep(payload["seconds"])
+
+    service.register("kind", handler)
+    await service.start()
+    running = await service.submit("kind", "user", {"seconds": 0.1}, {}, STAGES)
+    await asyncio.wait_for(started.wait(), timeout=5)
+    queued = await service.submit("kind", "user", {"seconds": 0}, {}, STAGES)
+    await service.stop()
+    assert (await service.get(running.id)).status == "succeeded"
+    assert (await service.get(queued.id)).status == "queued"
+
+    # jobs that take longer than stop_timeout are cancelled and stay running until requeued
+    service = IngestionJobService(str(tmp_path), poll_interval=0.01, stop_timeout=0.05)
+    service.register("kind", handler)
+    started.clear()
+    await service.start()
+    slow = await service.submit("kind", "user", {"seconds": 10}, {}, STAGES)
+    await asyncio.wait_for(started.wait(), timeout=5)
+    await service.stop()
+    assert (await service.get(slow.id)).status == "running"
+
+
+class FakeDefinitionCache:
+    def __init__(self, item):
+        self.item = item
+        self.refreshed = 0
+
+    async def get(self, usecasetype_id, refresh=False):
+        self.refreshed += refresh
+        return UsecaseDefinition(self.item)
+
+
+class FakeJobService:
+    def __init__(self):
+        self.submitted = []
+
+    async def submit(self, **kwargs):
+        self.submitted.append(kwargs)
+        return kwargs
+
+
+@pytest.mark.asyncio
+async def test_category_submit_checks_index_and_category_before_queueing():
+    app = Quart(__name__)
+    definitions = FakeDefinitionCache(
+        {"id": "usecase", "indices": [{"id": "index", "categories": [{"id": "cat"}]}]}
+    )
+    job_service = FakeJobService()
+    app.config[CONFIG_USECASE_DEFINITION_CACHE] = definitions
+    app.config[CONFIG_INGESTION_JOB_SERVICE] = job_service
+
+    def category(id):
+        return SimpleNamespace(
+            id=id, jsonify=lambda: {"id": id, "files": [{"id": "f", "data": b"pdf"}]}
+        )
+
+    async with app.app_context():
+        service = CategoryService()
+        with pytest.raises(NotFoundError):
+            await service.submit(JOB_POST_CATEGORY, category("new"), "usecase", "missing", "user")
+        with pytest.raises(NotFoundError):
+            await service.submit(JOB_PUT_CATEGORY, category("missing"), "usecase", "index", "user")
+        assert job_service.submitted == []
+
+        await service.submit(JOB_POST_CATEGORY, category("new"), "usecase", "index", "user")
+        await service.submit(JOB_PUT_CATEGORY, category("cat"), "usecase", "index", "user")
+    assert [job["kind"] for job in job_service.submitted] == [
+        JOB_POST_CATEGORY,
+        JOB_PUT_CATEGORY,
+    ]
+    assert job_service.submitted[0]["attachments"] == {"f": b"pdf"}
+    assert definitions.refreshed == 4
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+from jose import jwt
+from jwks_server import LocalJWKSServer
+
+from core.jwks import JWKSKeyStore
+from customerrors import KeyNotFoundError
+
+
+@pytest_asyncio.fixture
+async def jwks_server():
+    server = LocalJWKSServer()
+    await server.start()
+    yield server
+    await server.stop()
+
+
+@pytest.mark.asyncio
+async def test_keystore_verifies_token(jwks_server):
+    keystore = JWKSKeyStore(jwks_uri=jwks_server.jwks_uri)
+    token = jwks_server.issue_token({"aud": "client", "oid": "user-1"})
+    key = await keystore.get_key(jwt.get_unverified_headers(token)["kid"])
+    payload = jwt.decode(token, key=key, algorithms=["RS256"], audience="client")
+    assert payload["oid"] == "user-1"
+
+
+@pytest.mark.asyncio
+async def test_keystore_caches_keys(jwks_server):
+    keystore = JWKSKeyStore(jwks_uri=jwks_server.jwks_uri)
+    for _ in range(5):
+        await keystore.get_key(jwks_server.kid)
+    assert jwks_server.requests == 1
+
+
+@pytest.mark.asyncio
+async def test_keystore_shares_inflight_refresh(jwks_server):
+    keystore = JWKSKeyStore(jwks_uri=jwks_server.jwks_uri)
+    await asyncio.gather(*[keystore.get_key(jwks_server.kid) for _ in range(20)])
+    assert jwks_server.requests == 1
+
+
+@pytest.mark.asyncio
+async def test_keystore_refreshes_on_unknown_kid(jwks_server):
+    keystore = JWKSKeyStore(jwks_uri=jwks_server.jwks_uri, min_refresh_interval=0)
+    await keystore.get_key(jwks_server.kid)
+    new_kid = jwks_server.rotate()
+    await keystore.get_key(new_kid)
+    assert jwks_server.requests == 2
+
+
+@pytest.mark.asyncio
+async def test_keystore_rate_limits_unknown_kid(jwks_server):
+    keystore = JWKSKeyStore(jwks_uri=jwks_server.jwks_uri)
+    await keystore.get_key(jwks_server.kid)
+    with pytest.raises(KeyNotFoundError):
+        await keystore.get_key("unknown")
+    assert jwks_server.requests == 1
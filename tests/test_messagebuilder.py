@@ -1,3 +1,7 @@
+from unittest import mock
+
+import pytest
+
 from core.messagebuilder import MessageBuilder
 
 
@@ -22,3 +26,54 @@ def test_messagebuilder_append():
     ]
     assert builder.model == "gpt-35-turbo"
     assert builder.token_length == 17
+
+
+class WordEncoding:
+    name = "words"
+
+    def encode_batch(self, texts):
+        return [text.split() for text in texts]
+
+
+@pytest.fixture
+def word_encoding():
+    with mock.patch("core.tokencounter.get_encoding", return_value=WordEncoding()):
+        yield
+
+
+def test_messagebuilder_segments(word_encoding):
+    builder = MessageBuilder("system", "gpt-35-turbo")
+    builder.append_leading("user", "shot question")
+    builder.append_leading("assistant", "shot answer")
+    builder.append_trailing("user", "latest question")
+    messages = builder.build(
+        [
+            [{"role": "user", "content": "second"}, {"role": "assistant", "content": "2"}],
+            [{"role": "user", "content": "first"}, {"role": "assistant", "content": "1"}],
+        ],
+        max_tokens=100,
+    )
+    assert [m["content"] for m in messages] == [
+        "system",
+        "shot question",
+        "shot answer",
+        "first",
+        "1",
+        "second",
+        "2",
+        "latest question",
+    ]
+    assert builder.token_length == sum(2 + len(m["content"].split()) + 1 for m in messages)
+
+
+def test_messagebuilder_build_stops_at_token_limit(word_encoding):
+    builder = MessageBuilder("system", "gpt-35-turbo")
+    builder.append_trailing("user", "question")
+    # system and question: 4 tokens each, every turn: 8 tokens
+    turns = [
+        [{"role": "user", "content": str(i)}, {"role": "assistant", "content": str(i)}]
+        for i in range(10)
+    ]
+    messages = builder.build(turns, max_tokens=4 + 4 + 2 * 8 + 7)
+    assert [m["content"] for m in messages] == ["system", "1", "1", "0", "0", "question"]
+    assert builder.token_length == 24
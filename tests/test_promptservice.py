@@ -0,0 +1,65 @@
+import json
+from unittest import mock
+
+import pytest
+
+from services.PromptService import PromptService, PromptTypes
+
+PROMPTS = [
+    {"type": "system", "content": "system prompt"},
+    {"type": "query", "content": "query prompt"},
+    {"type": "followup", "content": "followup prompt"},
+    {"type": "query_fewshots", "content": json.dumps([{"role": "user", "content": "hi"}])},
+]
+
+
+class FakeCosmosDBService:
+    items = PROMPTS
+    queries = 0
+
+    def __init__(self, database, container):
+        ...
+
+    async def query(self, query, params=None):
+        FakeCosmosDBService.queries += 1
+        return self.items
+
+
+@pytest.mark.asyncio
+async def test_prompts_are_loaded_once():
+    with mock.patch("services.PromptService.CosmosDBService", FakeCosmosDBService):
+        FakeCosmosDBService.queries = 0
+        service = PromptService(ttl=3600)
+        await service.start()
+        try:
+            for _ in range(3):
+                assert service.get(PromptTypes.SYSTEM) == "system prompt"
+                assert service.get("query") == "query prompt"
+                assert service.query_fewshots == [{"role": "user", "content": "hi"}]
+        finally:
+            await service.stop()
+    assert FakeCosmosDBService.queries == 1
+
+
+@pytest.mark.asyncio
+async def test_version_changes_with_content():
+    with mock.patch("services.PromptService.CosmosDBService", FakeCosmosDBService):
+        service = PromptService()
+        await service.load()
+        version = service.version
+        FakeCosmosDBService.items = PROMPTS[:-1] + [{"type": "query_fewshots", "content": "[]"}]
+        try:
+            await service.load()
+        finally:
+            FakeCosmosDBService.items = PROMPTS
+    assert service.version != version
+    assert service.query_fewshots == []
+
+
+@pytest.mark.asyncio
+async def test_unknown_prompt_type():
+    with mock.patch("services.PromptService.CosmosDBService", FakeCosmosDBService):
+        service = PromptService()
+        await service.load()
+    with pytest.raises(KeyError):
+        service.get(PromptTypes.EXAMPLE)
@@ -0,0 +1,49 @@
+import pytest
+
+from core.querycache import QueryRewriteCache
+
+HISTORY = [
+    {"user": "What are my health plans?", "bot": "Northwind Standard"},
+    {"user": "Does it cover cardio?"},
+]
+
+
+class Rewriter:
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        return f"query {self.calls}"
+
+
+@pytest.mark.asyncio
+async def test_rewrite_is_cached_per_question_history_and_prompt_version():
+    cache = QueryRewriteCache()
+    rewrite = Rewriter()
+    assert await cache.get_or_rewrite(HISTORY, "v1", rewrite) == "query 1"
+    assert await cache.get_or_rewrite(HISTORY, "v1", rewrite) == "query 1"
+    assert await cache.get_or_rewrite(HISTORY, "v2", rewrite) == "query 2"
+    other_history = [{"user": "vacation days?", "bot": "25"}, HISTORY[-1]]
+    assert await cache.get_or_rewrite(other_history, "v1", rewrite) == "query 3"
+    assert cache.metrics()["llm_calls_saved"] == 1
+
+
+@pytest.mark.asyncio
+async def test_key_only_includes_recent_turns():
+    cache = QueryRewriteCache(history_turns=1)
+    old = [{"user": "a", "bot": "b"}]
+    assert cache.key(old + HISTORY, "v1") == cache.key(HISTORY, "v1")
+
+
+@pytest.mark.asyncio
+async def test_single_turn_fast_path():
+    rewrite = Rewriter()
+    cache = QueryRewriteCache(skip_single_turn=True)
+    assert await cache.get_or_rewrite(HISTORY[-1:], "v1", rewrite) == "Does it cover cardio?"
+    assert rewrite.calls == 0
+    assert await cache.get_or_rewrite(HISTORY, "v1", rewrite) == "query 1"
+    metrics = cache.metrics()
+    assert metrics["skipped_single_turn"] == 1
+    assert metrics["rewrites"] == 1
+    assert metrics["llm_calls_saved"] == 1
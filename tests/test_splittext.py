@@ -0,0 +1,212 @@
+"""
+Golden-file tests of the section splitting of FormRecognizerTextManagementService.split_text and of
+scripts/prepdocs.py.
+
+tests/golden/split_text.json holds, per generated page map, the number of sections and a sha256 of the sections the
+original implementation produced. Regenerate it with
+    PYTHONPATH=app/backend python tests/test_splittext.py
+only when the expected output changes on purpose.
+"""
+
+import hashlib
+import json
+import os
+import random
+from types import SimpleNamespace
+from typing import Dict, List, Tuple
+
+import pytest
+import scripts.prepdocs as prepdocs
+import tiktoken
+
+import services.TextManagementService
+from services.TextManagementService import (
+    FormRecognizerTextManagementService,
+    SectionSplitter,
+    TokenSectionSplitter,
+)
+from strategies.CognitiveSearchIndexStrategy import (
+    CognitiveSearchIndexStrategyProvider,
+)
+
+GOLDEN_FILE = os.path.join(os.path.dirname(__file__), "golden", "split_text.json")
+
+PageMap = List[Tuple[int, int, str]]
+
+
+def to_page_map(pages: List[str]) -> PageMap:
+    page_map: PageMap = []
+    offset = 0
+    for i, text in enumerate(pages):
+        page_map.append((i, offset, text))
+        offset += len(text)
+    return page_map
+
+
+def random_pages(seed: int, pages: int, words_per_page: int) -> List[str]:
+    rng = random.Random(seed)
+    words = [
+        "Lorem",
+        "ipsum",
+        "dolor",
+        "sit.",
+        "amet,",
+        "(x)",
+        "a;b",
+        "[1]",
+        "Äö!",
+        "why?",
+        "\t",
+        "\n",
+    ]
+    table = "<table><tr><td>" + "cell " * 60 + "</td></tr></table>"
+    result = []
+    for _ in range(pages):
+        parts = []
+        for _ in range(rng.randint(0, words_per_page)):
+            r = rng.random()
+            if r < 0.01:
+                parts.append(table * rng.randint(1, 5))
+            elif r < 0.02:
+                parts.append("x" * rng.randint(100, 1500))  # no breaks at all
+            else:
+                parts.append(rng.choice(words))
+        result.append(" ".join(parts) + " ")
+    return result
+
+
+def page_maps() -> Dict[str, PageMap]:
+    maps = {
+        "empty": to_page_map([]),
+        "empty_page": to_page_map([" "]),
+        "shorter_than_overlap": to_page_map(["Short text. "]),
+        "no_breaks": to_page_map(["y" * 5000 + " "]),
+        "no_sentence_endings": to_page_map(["word " * 1000, "more " * 500]),
+        "starts_with_ending": to_page_map(["." * 50 + "Text. " * 400]),
+        "unclosed_table": to_page_map(
+            [
+                "Intro. " * 40
+                + "<table>"
+                + "<tr><td>row</td></tr>" * 200
+                + "</table> End. "
+            ]
+        ),
+    }
+    for seed in range(12):
+        maps[f"random_{seed}"] = to_page_map(random_pages(seed, 1 + seed * 3, 400))
+    return maps
+
+
+def digest(sections: List[Tuple[str, int]]) -> Dict[str, object]:
+    return {
+        "sections": len(sections),
+        "sha256": hashlib.sha256(
+            json.dumps(sections, ensure_ascii=False).encode("utf-8")
+        ).hexdigest(),
+    }
+
+
+def load_golden() -> Dict[str, Dict[str, object]]:
+    with open(GOLDEN_FILE, encoding="utf-8") as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize("case", sorted(page_maps()))
+def test_split_text_matches_golden_file(case):
+    sections = FormRecognizerTextManagementService.split_text(page_maps()[case])
+    assert digest([list(section) for section in sections]) == load_golden()[case]
+
+
+@pytest.mark.parametrize("case", sorted(page_maps()))
+def test_prepdocs_split_text_matches_golden_file(case, monkeypatch):
+    monkeypatch.setattr(prepdocs, "args", SimpleNamespace(verbose=False), raising=False)
+    monkeypatch.setattr(prepdocs, "filename", "doc.pdf", raising=False)
+    sections = list(prepdocs.split_text(page_maps()[case]))
+    assert digest([list(section) for section in sections]) == load_golden()[case]
+
+
+def test_splitter_parameters_are_configurable():
+    page_map = to_page_map(["One sentence here. " * 200])
+    small = SectionSplitter(
+        max_section_length=200, sentence_search_limit=20, section_overlap=20
+    )
+    sections = small.split(page_map)
+    assert len(sections) > len(SectionSplitter().split(page_map))
+    assert all(len(text) <= 200 + 20 + 1 for text, _ in sections)
+    # every section starts right after a sentence ending
+    assert all(text.lstrip().startswith("One") for text, _ in sections)
+
+
+def test_find_page_uses_page_offsets():
+    splitter = SectionSplitter()
+    offsets = [0, 10, 10, 25]
+    assert [splitter.find_page(offsets, o) for o in (0, 9, 10, 24, 25, 100)] == [
+        0,
+        0,
+        2,
+        2,
+        3,
+        3,
+    ]
+
+
+@pytest.fixture
+def byte_encoding(monkeypatch):
+    """An encoding with one token per utf-8 byte, which needs no download"""
+    encoding = tiktoken.Encoding(
+        name="bytes",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={},
+    )
+    monkeypatch.setattr(
+        services.TextManagementService, "get_encoding", lambda model: encoding
+    )
+    return encoding
+
+
+def test_token_splitter_measures_sections_in_tokens(byte_encoding):
+    # one token per character, so tokens and characters split alike
+    ascii_map = to_page_map([p.replace("Äö", "Ao") for p in random_pages(3, 10, 400)])
+    assert TokenSectionSplitter(200, 20, 20).split(ascii_map) == SectionSplitter(
+        200, 20, 20
+    ).split(ascii_map)
+
+    # two tokens per character
+    page_map = to_page_map(["Größe ändern. " * 100, "Übermäßig äußerst. " * 100])
+    sections = TokenSectionSplitter(200, 20, 20).split(page_map)
+    assert "".join(text for text, _ in sections).startswith("Größe ändern.")
+    assert sections[-1][0].endswith("Übermäßig äußerst. ")
+    assert [page for _, page in sections] == sorted(page for _, page in sections)
+    tokens = [len(byte_encoding.encode_ordinary(text)) for text, _ in sections]
+    assert max(tokens) <= 200 + 3 * 20 * 2
+    assert max(len(text) for text, _ in sections) < 200
+
+
+def test_index_strategy_selects_section_splitter():
+    assert isinstance(
+        CognitiveSearchIndexStrategyProvider.get_context(
+            "gptkbindex-woe-tokens"
+        ).section_splitter,
+        TokenSectionSplitter,
+    )
+    assert (
+        type(
+            CognitiveSearchIndexStrategyProvider.get_context(
+                "gptkbindex-woe"
+            ).section_splitter
+        )
+        is SectionSplitter
+    )
+
+
+if __name__ == "__main__":
+    golden = {
+        case: digest(
+            [list(s) for s in FormRecognizerTextManagementService.split_text(page_map)]
+        )
+        for case, page_map in page_maps().items()
+    }
+    os.makedirs(os.path.dirname(GOLDEN_FILE), exist_ok=True)
+    with open(GOLDEN_FILE, "w", encoding="utf-8") as f:
+        json.dump(golden, f, indent=1, sort_keys=True)
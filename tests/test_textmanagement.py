@@ -0,0 +1,255 @@
+"""
+Golden-file tests of FormRecognizerTextManagementService.convert_text.
+
+The golden files in tests/golden/convert_text hold synthetic layout results and the page maps the original
+character-by-character implementation produced for them. Regenerate them with
+    PYTHONPATH=app/backend python tests/test_textmanagement.py
+only when the expected output changes on purpose.
+"""
+
+import json
+import os
+import random
+from typing import Any, Dict, List
+
+import pytest
+from azure.ai.formrecognizer import (
+    AnalyzeResult,
+    BoundingRegion,
+    DocumentPage,
+    DocumentSpan,
+    DocumentTable,
+    DocumentTableCell,
+)
+
+from services.FormRecognizerService import PREBUILTLAYOUT
+from services.TextManagementService import FormRecognizerTextManagementService
+
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), "golden", "convert_text")
+
+
+def to_layout(document: Dict[str, Any]) -> PREBUILTLAYOUT:
+    """Builds a layout result from the compact document format of the golden files"""
+    return PREBUILTLAYOUT.analyzeresult_to_model(
+        AnalyzeResult(
+            content=document["content"],
+            pages=[
+                DocumentPage(
+                    page_number=i + 1,
+                    spans=[DocumentSpan(offset=offset, length=length)],
+                )
+                for i, (offset, length) in enumerate(document["pages"])
+            ],
+            tables=[
+                DocumentTable(
+                    row_count=table["row_count"],
+                    column_count=table["column_count"],
+                    cells=[
+                        DocumentTableCell(
+                            kind=kind,
+                            row_index=row,
+                            column_index=column,
+                            row_span=row_span,
+                            column_span=column_span,
+                            content=content,
+                        )
+                        for kind, row, column, row_span, column_span, content in table[
+                            "cells"
+                        ]
+                    ],
+                    bounding_regions=[
+                        BoundingRegion(page_number=table["page"], polygon=[])
+                    ],
+                    spans=[
+                        DocumentSpan(offset=offset, length=length)
+                        for offset, length in table["spans"]
+                    ],
+                )
+                for table in document["tables"]
+            ],
+        )
+    )
+
+
+def random_table(
+    rng: random.Random, page: int, spans: List[List[int]]
+) -> Dict[str, Any]:
+    row_count = rng.randint(1, 4)
+    column_count = rng.randint(1, 4)
+    cells = []
+    for row in range(row_count):
+        for column in range(column_count):
+            if rng.random() < 0.1:
+                continue  # covered by a span
+            kind = rng.choice(["content", "columnHeader", "rowHeader", None])
+            cells.append(
+                [
+                    kind,
+                    row,
+                    column,
+                    rng.choice([None, 1, 2]),
+                    rng.choice([None, 1, 3]),
+                    rng.choice(["1 & 2", "<b>x</b>", "Äpfel", "", 'text "quoted"']),
+                ]
+            )
+    rng.shuffle(cells)
+    return {
+        "page": page,
+        "row_count": row_count,
+        "column_count": column_count,
+        "cells": cells,
+        "spans": spans,
+    }
+
+
+def random_document(seed: int) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    words = ["Lorem", "ipsum", "dolor.", "sit", "amet,", "ÄÖÜ", "\n", "<tag>", "&"]
+    pages = []
+    tables = []
+    content = ""
+    for page in range(1, rng.randint(2, 6) + 1):
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(0, 200)))
+        offset = len(content)
+        pages.append([offset, len(text)])
+        content += text + "\n"
+        for _ in range(rng.randint(0, 3)):
+            spans = []
+            for _ in range(rng.randint(1, 3)):
+                # spans may overlap each other, other tables and the page boundaries
+                start = rng.randint(offset - 5, offset + max(len(text), 1))
+                spans.append([start, rng.randint(0, 60)])
+            tables.append(random_table(rng, page, spans))
+    return {"content": content, "pages": pages, "tables": tables}
+
+
+def documents() -> Dict[str, Dict[str, Any]]:
+    cell = ["content", 0, 0, 1, 1, "a"]
+    docs = {
+        "no_tables": {
+            "content": "First page.\nSecond page.",
+            "pages": [[0, 12], [12, 12]],
+            "tables": [],
+        },
+        "empty_page": {
+            "content": "text",
+            "pages": [[0, 4], [4, 0]],
+            "tables": [],
+        },
+        "table_in_middle": {
+            "content": "before TABLE after",
+            "pages": [[0, 18]],
+            "tables": [
+                {
+                    "page": 1,
+                    "row_count": 2,
+                    "column_count": 2,
+                    "cells": [
+                        ["columnHeader", 0, 1, 1, 1, "h2"],
+                        ["columnHeader", 0, 0, 1, 2, "h<1>"],
+                        ["content", 1, 0, 2, 1, "a & b"],
+                        ["rowHeader", 1, 1, None, None, "c"],
+                    ],
+                    "spans": [[7, 5]],
+                }
+            ],
+        },
+        "table_with_two_spans_and_second_page": {
+            "content": "aa TT bb TT cc|dd TT ee",
+            "pages": [[0, 15], [15, 8]],
+            "tables": [
+                {
+                    "page": 1,
+                    "row_count": 1,
+                    "column_count": 1,
+                    "cells": [cell],
+                    "spans": [[3, 2], [9, 2]],
+                },
+                {
+                    "page": 2,
+                    "row_count": 1,
+                    "column_count": 1,
+                    "cells": [cell],
+                    "spans": [[18, 2]],
+                },
+            ],
+        },
+        "overlapping_tables": {
+            "content": "0123456789",
+            "pages": [[0, 10]],
+            "tables": [
+                {
+                    "page": 1,
+                    "row_count": 1,
+                    "column_count": 1,
+                    "cells": [["content", 0, 0, 1, 1, "first"]],
+                    "spans": [[1, 5]],
+                },
+                {
+                    "page": 1,
+                    "row_count": 1,
+                    "column_count": 1,
+                    "cells": [["content", 0, 0, 1, 1, "second"]],
+                    "spans": [[3, 2]],
+                },
+            ],
+        },
+        "span_outside_page": {
+            "content": "page one|page two",
+            "pages": [[0, 9], [9, 8]],
+            "tables": [
+                {
+                    "page": 2,
+                    "row_count": 1,
+                    "column_count": 1,
+                    "cells": [cell],
+                    "spans": [[5, 7], [15, 10]],
+                },
+            ],
+        },
+        "table_on_other_page_than_span": {
+            "content": "abcdef",
+            "pages": [[0, 3], [3, 3]],
+            "tables": [
+                {
+                    "page": 2,
+                    "row_count": 1,
+                    "column_count": 1,
+                    "cells": [cell],
+                    "spans": [[1, 1]],
+                },
+            ],
+        },
+    }
+    for seed in range(8):
+        docs[f"random_{seed}"] = random_document(seed)
+    return docs
+
+
+def golden_cases() -> List[str]:
+    if not os.path.isdir(GOLDEN_DIR):
+        return []
+    return sorted(name[: -len(".json")] for name in os.listdir(GOLDEN_DIR))
+
+
+@pytest.mark.parametrize("case", golden_cases())
+def test_convert_text_matches_golden_file(case):
+    with open(os.path.join(GOLDEN_DIR, f"{case}.json"), encoding="utf-8") as f:
+        golden = json.load(f)
+    page_map = FormRecognizerTextManagementService.convert_text(
+        to_layout(golden["document"])
+    )
+    assert [list(page) for page in page_map] == golden["page_map"]
+
+
+if __name__ == "__main__":
+    os.makedirs(GOLDEN_DIR, exist_ok=True)
+    for name, document in documents().items():
+        page_map = FormRecognizerTextManagementService.convert_text(to_layout(document))
+        with open(os.path.join(GOLDEN_DIR, f"{name}.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {"document": document, "page_map": [list(page) for page in page_map]},
+                f,
+                ensure_ascii=False,
+                indent=1,
+            )
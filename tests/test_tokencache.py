@@ -0,0 +1,46 @@
+import time
+
+from core.cache import LRUCache
+from core.tokencache import VerifiedTokenCache
+
+
+def test_lrucache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_lrucache_expires_entries():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1, expires_at=time.time() - 1)
+    assert cache.get("a") is None
+    assert cache.expirations == 1
+    assert len(cache) == 0
+
+
+def test_tokencache_hit_and_miss():
+    cache = VerifiedTokenCache(maxsize=10)
+    payload = {"oid": "user-1", "exp": time.time() + 60}
+    assert cache.get("token") is None
+    cache.set("token", payload)
+    assert cache.get("token") == payload
+    assert cache.metrics()["hits"] == 1
+    assert cache.metrics()["misses"] == 1
+
+
+def test_tokencache_does_not_store_expired_tokens():
+    cache = VerifiedTokenCache(maxsize=10)
+    cache.set("expired", {"oid": "user-1", "exp": time.time() - 1})
+    cache.set("no-exp", {"oid": "user-1"})
+    assert cache.metrics()["size"] == 0
+
+
+def test_tokencache_keys_by_hash():
+    assert VerifiedTokenCache.key("token") != "token"
+    assert len(VerifiedTokenCache.key("token")) == 64
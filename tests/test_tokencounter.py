@@ -0,0 +1,49 @@
+from unittest import mock
+
+import pytest
+
+from core.tokencounter import TokenCounter
+
+
+class FakeEncoding:
+    name = "fake"
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode_batch(self, texts):
+        self.encoded.extend(texts)
+        return [text.split() for text in texts]
+
+
+@pytest.fixture
+def encoding():
+    fake = FakeEncoding()
+    with mock.patch("core.tokencounter.get_encoding", return_value=fake):
+        yield fake
+
+
+def test_counts_are_cached_by_content(encoding):
+    counter = TokenCounter()
+    assert counter.count("one two three", "gpt-35-turbo") == 3
+    assert counter.count("one two three", "gpt-35-turbo") == 3
+    assert encoding.encoded == ["one two three"]
+    assert counter.metrics()["hits"] == 1
+
+
+def test_batch_encodes_only_missing_texts_once(encoding):
+    counter = TokenCounter()
+    counter.count("a b", "gpt-35-turbo")
+    assert counter.count_batch(["a b", "c", "c", "d e f"], "gpt-35-turbo") == [2, 1, 1, 3]
+    assert encoding.encoded == ["a b", "c", "d e f"]
+
+
+def test_count_messages_adds_overhead_per_message(encoding):
+    counter = TokenCounter()
+    messages = [
+        {"role": "user", "content": "Hello, how are you?"},
+        {"role": "assistant", "content": "fine"},
+    ]
+    # 2 + 1 + 4 and 2 + 1 + 1
+    assert counter.count_messages(messages, "gpt-35-turbo") == [7, 4]
+    assert counter.count_message(messages[1], "gpt-35-turbo") == 4
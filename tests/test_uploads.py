@@ -0,0 +1,87 @@
+import gc
+import io
+import os
+
+from pypdf import PdfWriter
+from werkzeug.datastructures import FileStorage, MultiDict
+
+from core.uploadedfile import UploadedFile
+from providers.ModelProvider import CategoryModelFactory
+from services.FileManagementService import (
+    FileManagementService,
+    UploadedFileManagementStrategy,
+)
+from services.IngestionJobService import IngestionJobStore, JobStatus
+
+
+def pdf(pages: int) -> bytes:
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=72, height=72)
+    f = io.BytesIO()
+    writer.write(f)
+    return f.getvalue()
+
+
+def test_spooled_upload_is_removed_with_its_object(monkeypatch):
+    monkeypatch.setattr(UploadedFile, "CHUNK_SIZE", 4)
+    upload = UploadedFile.spool(io.BytesIO(b"0123456789"))
+    path = upload.path
+    assert upload.size == 10
+    with upload.open() as a, upload.open() as b:
+        assert a.read(3) == b"012"
+        assert b.read() == b"0123456789"
+    del upload
+    gc.collect()
+    assert not os.path.exists(path)
+
+
+def test_category_factory_spools_files_instead_of_reading_them():
+    files = MultiDict(
+        [("files", FileStorage(stream=io.BytesIO(pdf(2)), filename="doc.pdf"))]
+    )
+    form = MultiDict(
+        [
+            (f"category<cat>:{prop}", "value")
+            for prop in (
+                "name_de",
+                "name_en",
+                "description_de",
+                "description_en",
+                "system_prompt",
+                "temperature",
+                "model",
+            )
+        ]
+    )
+    category = CategoryModelFactory().create_bytes_model(files=files, form=form)
+    (file,) = category.files
+    assert isinstance(file.data, UploadedFile)
+    assert file.name == "doc.pdf"
+    # serializing the model, e.g. for a job, keeps the spooled file
+    assert category.jsonify()["files"][0]["data"] is file.data
+
+    service = FileManagementService.for_file(file)
+    assert isinstance(service.strategy, UploadedFileManagementStrategy)
+    with service.process_file(file) as strategy:
+        assert strategy.page_names == ["doc-0.pdf", "doc-1.pdf"]
+        model = strategy._to_model("index", "cat")
+        assert model.data.read() == file.data.read()
+    assert model.data.closed
+
+
+def test_job_store_takes_over_spooled_uploads(tmp_path):
+    store = IngestionJobStore(str(tmp_path / "jobs"))
+    upload = UploadedFile.spool(io.BytesIO(b"%PDF"))
+    spooled_path = upload.path
+    job = store.add("kind", "user", {}, {"file": upload}, [])
+    assert not os.path.exists(spooled_path)
+
+    _, attachments = store.load_payload(job.id)
+    assert attachments["file"].read() == b"%PDF"
+    path = attachments["file"].path
+    del attachments, upload
+    gc.collect()
+    assert os.path.exists(path)
+    store.finish(job.id, JobStatus.SUCCEEDED)
+    assert not os.path.exists(path)
@@ -0,0 +1,75 @@
+from unittest import mock
+
+import pytest
+from azure.cosmos.exceptions import CosmosResourceNotFoundError
+
+from customerrors import NotFoundError
+from services.UsecaseDefinitionService import UsecaseDefinition, UsecaseDefinitionCache
+
+ITEM = {
+    "id": "usecase",
+    "_etag": '"1"',
+    "indices": [
+        {"id": "index-a", "categories": [{"id": "cat-1"}, {"id": "cat-2"}]},
+        {"id": "index-b", "categories": [{"id": "cat-3", "system_prompt": "hi"}]},
+    ],
+}
+
+
+class FakeCosmosDBService:
+    reads = 0
+    item = ITEM
+
+    def __init__(self, database, container):
+        ...
+
+    async def read(self, item_id, partition_key, **kwargs):
+        FakeCosmosDBService.reads += 1
+        if item_id != self.item["id"]:
+            raise CosmosResourceNotFoundError(message="not found")
+        return self.item
+
+
+def test_definition_positions():
+    definition = UsecaseDefinition(ITEM)
+    assert definition.etag == '"1"'
+    assert definition.index_position("index-b") == 1
+    assert definition.category_position("index-a", "cat-2") == (0, 1)
+    assert definition.get_category("index-b", "cat-3")["system_prompt"] == "hi"
+    with pytest.raises(NotFoundError):
+        definition.category_position("index-a", "cat-3")
+    with pytest.raises(NotFoundError):
+        definition.index_position("index-c")
+
+
+@pytest.mark.asyncio
+async def test_cache_reads_once_until_refresh():
+    with mock.patch(
+        "services.UsecaseDefinitionService.CosmosDBService", FakeCosmosDBService
+    ):
+        FakeCosmosDBService.reads = 0
+        cache = UsecaseDefinitionCache(ttl=3600)
+        for _ in range(3):
+            definition = await cache.get("usecase")
+        assert definition.index_position("index-a") == 0
+        assert FakeCosmosDBService.reads == 1
+        await cache.get("usecase", refresh=True)
+        assert FakeCosmosDBService.reads == 2
+        assert cache.metrics()["hits"] == 2
+
+
+@pytest.mark.asyncio
+async def test_cache_stores_patched_documents():
+    with mock.patch(
+        "services.UsecaseDefinitionService.CosmosDBService", FakeCosmosDBService
+    ):
+        FakeCosmosDBService.reads = 0
+        cache = UsecaseDefinitionCache(ttl=3600)
+        patched = dict(ITEM, _etag='"2"', indices=ITEM["indices"][1:])
+        cache.store(patched)
+        definition = await cache.get("usecase")
+        assert definition.etag == '"2"'
+        assert definition.index_position("index-b") == 0
+        assert FakeCosmosDBService.reads == 0
+        with pytest.raises(NotFoundError):
+            await cache.get("unknown")